@@ -2,10 +2,21 @@ from flask import Flask, render_template
 from flask_bootstrap import Bootstrap
 from flask_mail import Mail
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_pagedown import PageDown
 from config import config
+from .cache import Cache
+from .last_seen import LastSeenTracker
+from .render import Renderer
+from .page_cache import PageCache
+from .rate_limit import RateLimiter
+from .mail_queue import MailQueue
+from .credentials import CredentialCache
+from .identity import IdentityCache
+from .compression import Compress
+from .assets import Assets
+from .replicas import RoutingSQLAlchemy
+from .db_stats import QueryStats
 
 
 
@@ -13,9 +24,20 @@ from config import config
 bootstrap = Bootstrap()
 mail = Mail()
 moment = Moment()
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 login_manager = LoginManager()
 page_down = PageDown()
+cache = Cache()
+last_seen_tracker = LastSeenTracker()
+renderer = Renderer()
+page_cache = PageCache()
+rate_limiter = RateLimiter()
+mail_queue = MailQueue()
+credential_cache = CredentialCache()
+identity_cache = IdentityCache()
+compress = Compress()
+assets = Assets()
+query_stats = QueryStats()
 login_manager.login_view = 'auth.login'
 
 def create_app(config_name):
@@ -29,6 +51,17 @@ def create_app(config_name):
     db.init_app(app)
     login_manager.init_app(app)
     page_down.init_app(app)
+    cache.init_app(app)
+    last_seen_tracker.init_app(app)
+    renderer.init_app(app)
+    page_cache.init_app(app)
+    rate_limiter.init_app(app)
+    mail_queue.init_app(app)
+    credential_cache.init_app(app)
+    identity_cache.init_app(app)
+    compress.init_app(app)
+    assets.init_app(app)
+    query_stats.init_app(app)
 
     # 添加路由和自定义的错误页面
     from .main import main as main_blueprint
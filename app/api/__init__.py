@@ -1,5 +1,10 @@
 from flask import Blueprint
+from .. import rate_limiter
 
 api = Blueprint('api', __name__)
+# the credentials are not verified yet when the limits are checked, so a
+# client making up a new username per request is held back by its IP
+rate_limiter.limit_blueprint(api, 'RATELIMIT_API_IP', key='ip')
+rate_limiter.limit_blueprint(api, 'RATELIMIT_API', key='user')
 
-from . import authentication, posts, users, comments, errors
+from . import authentication, posts, users, comments, errors, caching
@@ -1,5 +1,6 @@
 from flask import g, jsonify
 from flask_httpauth import HTTPBasicAuth
+from .. import db, credential_cache
 from ..models import User
 from . import api
 from .errors import unauthorized, forbidden
@@ -15,12 +16,24 @@ def verify_password(email_or_token, password):
         g.current_user = User.verify_auth_token(email_or_token)
         g.token_used = True
         return g.current_user is not None
+    g.token_used = False
+    verified = credential_cache.get(email_or_token, password)
+    if verified is not None:
+        user_id, password_hash = verified
+        user = User.query.get(user_id)
+        if user is not None and user.email == email_or_token and \
+                user.password_hash == password_hash:
+            g.current_user = user
+            return True
     user = User.query.filter_by(email=email_or_token).first()
     if not user:
         return False
     g.current_user = user
-    g.token_used = False
-    return user.verify_password(password)
+    if not user.verify_password(password):
+        return False
+    db.session.commit()
+    credential_cache.set(email_or_token, password, user)
+    return True
 
 
 @auth.error_handler
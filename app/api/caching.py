@@ -0,0 +1,43 @@
+import hashlib
+from functools import wraps
+from flask import request, make_response, current_app
+from . import api
+
+
+def conditional(version):
+    """Answer conditional GETs from a cheap version of the resource.
+
+    ``version`` gets the view arguments and returns anything whose repr
+    changes whenever the serialized resource does (usually a few columns
+    read without loading the row), or ``None`` to let the view handle a
+    missing resource. A strong ETag is derived from it and the request URL;
+    a matching If-None-Match is answered with 304 before the view loads or
+    serializes anything.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            current = version(**kwargs)
+            if current is None:
+                return f(*args, **kwargs)
+            etag = hashlib.sha1(('%s|%r' % (request.full_path, tuple(current)))
+                                .encode('utf-8')).hexdigest()
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+            response.set_etag(etag)
+            return response
+        return decorated_function
+    return decorator
+
+
+@api.after_request
+def cache_control(response):
+    if request.method == 'GET' and response.status_code in (200, 304):
+        # responses depend on the credentials, so only the client may keep
+        # them, and it has to revalidate before reuse
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.vary.add('Authorization')
+    return response
@@ -1,12 +1,29 @@
+from datetime import datetime
 from flask import jsonify, request, g, url_for, current_app
 from .. import db
+from ..exceptions import ValidationError
 from ..models import Post, Permission, Comment
+from ..listing import comment_tree
 from . import api
 from .decorators import permission_required
+from .pagination import paginate_cursor
+from .caching import conditional
+from .serializers import json_response, serialize_comments
 
 
 @api.route('/comments/')
+@conditional(lambda: db.session.query(db.func.count(Comment.id), db.func.max(Comment.id),
+                                      db.func.max(Comment.update_time)).one())
 def get_comments():
+    if 'cursor' in request.args:
+        comments, prev, next = paginate_cursor(
+            Comment.query, Comment, current_app.config['FLASKY_COMMENTS_PER_PAGE'],
+            'api.get_comments')
+        return json_response({
+            'comments': serialize_comments(comments),
+            'prev': prev,
+            'next': next
+        })
     page = request.args.get('page', 1, type=int)
     pagination = Comment.query.order_by(Comment.timestamp.desc()).paginate(
         page, per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
@@ -18,8 +35,8 @@ def get_comments():
     next = None
     if pagination.has_next:
         next = url_for('api.get_comments', page=page+1)
-    return jsonify({
-        'comments': [comment.to_json() for comment in comments],
+    return json_response({
+        'comments': serialize_comments(comments),
         'prev': prev,
         'next': next,
         'count': pagination.total
@@ -27,6 +44,7 @@ def get_comments():
 
 
 @api.route('/comments/<int:id>')
+@conditional(lambda id: db.session.query(Comment.update_time).filter(Comment.id == id).first())
 def get_comment(id):
     comment = Comment.query.get_or_404(id)
     return jsonify(comment.to_json())
@@ -35,6 +53,15 @@ def get_comment(id):
 @api.route('/posts/<int:id>/comments/')
 def get_post_comments(id):
     post = Post.query.get_or_404(id)
+    if 'cursor' in request.args:
+        comments, prev, next = paginate_cursor(
+            post.comments, Comment, current_app.config['FLASKY_COMMENTS_PER_PAGE'],
+            'api.get_post_comments', ascending=True, id=id)
+        return json_response({
+            'comments': serialize_comments(comments),
+            'prev': prev,
+            'next': next
+        })
     page = request.args.get('page', 1, type=int)
     pagination = post.comments.order_by(Comment.timestamp.asc()).paginate(
         page, per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
@@ -46,14 +73,69 @@ def get_post_comments(id):
     next = None
     if pagination.has_next:
         next = url_for('api.get_post_comments', id=id, page=page+1)
-    return jsonify({
-        'comments': [comment.to_json() for comment in comments],
+    return json_response({
+        'comments': serialize_comments(comments),
         'prev': prev,
         'next': next,
         'count': pagination.total
     })
 
 
+@api.route('/posts/<int:id>/comments/tree')
+def get_post_comment_tree(id):
+    post = Post.query.get_or_404(id)
+    root = request.args.get('root', type=int)
+    tree = comment_tree(post.id, root)
+    nodes = []
+    pending = list(tree)
+    while pending:
+        node = pending.pop()
+        nodes.append(node)
+        pending.extend(node['replies'])
+    for node, json_comment in zip(nodes, serialize_comments(
+            node['comment'] for node in nodes)):
+        json_comment['depth'] = node['comment'].depth
+        node['json'] = json_comment
+    for node in nodes:
+        node['json']['replies'] = [reply['json'] for reply in node['replies']]
+    return json_response({
+        'comments': [node['json'] for node in tree]
+    })
+
+
+@api.route('/comments/moderate', methods=['POST'])
+@permission_required(Permission.MODERATE)
+def moderate_comments():
+    json_request = request.json or {}
+    action = json_request.get('action')
+    if action not in ('enable', 'disable'):
+        raise ValidationError('action must be "enable" or "disable"')
+    ids = json_request.get('ids') or []
+    if not isinstance(ids, list) or not all(isinstance(id, int) for id in ids):
+        raise ValidationError('ids must be a list of comment ids')
+    post_id = json_request.get('post_id')
+    if post_id is not None and not isinstance(post_id, int):
+        raise ValidationError('post_id must be a post id')
+    condition = Comment.selection(
+        ids=ids, post_id=post_id,
+        email=json_request.get('email'), url=json_request.get('url'),
+        since=parse_time(json_request.get('since')),
+        until=parse_time(json_request.get('until')),
+        pending=bool(json_request.get('pending')))
+    count = Comment.moderate(condition, disabled=action == 'disable')
+    db.session.commit()
+    return jsonify({'action': action, 'count': count})
+
+
+def parse_time(value):
+    if value is None:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S')
+    except (TypeError, ValueError):
+        raise ValidationError('times must be given as YYYY-MM-DDTHH:MM:SS')
+
+
 @api.route('/posts/<int:id>/comments/', methods=['POST'])
 @permission_required(Permission.COMMENT)
 def new_post_comment(id):
@@ -15,6 +15,14 @@ def unauthorized(message):
     return response
 
 
+def too_many_requests(message, retry_after=None):
+    response = jsonify({'error': 'too many requests', 'message': message})
+    response.status_code = 429
+    if retry_after:
+        response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
 def forbidden(message):
     response = jsonify({'error': 'forbidden', 'message': message})
     response.status_code = 403
@@ -24,3 +32,9 @@ def forbidden(message):
 @api.errorhandler(ValidationError)
 def validation_error(e):
     return bad_request(e.args[0])
+
+
+@api.errorhandler(429)
+def rate_limit_exceeded(e):
+    return too_many_requests('Rate limit exceeded',
+                             getattr(e, 'retry_after', None))
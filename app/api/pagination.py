@@ -0,0 +1,70 @@
+import json
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import datetime
+from flask import request, url_for
+from sqlalchemy import and_, or_
+from ..exceptions import ValidationError
+
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def encode_cursor(direction, item):
+    data = [direction, item.timestamp.strftime(TIMESTAMP_FORMAT), item.id]
+    return urlsafe_b64encode(json.dumps(data).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        direction, timestamp, id = json.loads(
+            urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        timestamp = datetime.strptime(timestamp, TIMESTAMP_FORMAT)
+    except Exception:
+        raise ValidationError('invalid cursor')
+    if direction not in ('next', 'prev') or not isinstance(id, int):
+        raise ValidationError('invalid cursor')
+    return direction, timestamp, id
+
+
+def paginate_cursor(query, model, per_page, endpoint, ascending=False,
+                    **kwargs):
+    """Keyset pagination ordered by ``(timestamp, id)``.
+
+    The page after (or before) the position encoded in ``?cursor=`` is found
+    with a range condition on the ordering columns instead of OFFSET, and no
+    total is counted, so every page costs the same. An empty cursor starts
+    at the first page. Returns ``(items, prev_url, next_url)``.
+    """
+    cursor = request.args.get('cursor', '')
+    direction, position = 'next', None
+    if cursor:
+        direction, timestamp, id = decode_cursor(cursor)
+        position = timestamp, id
+
+    # walking backwards is a forward walk in the reverse order
+    forward = ascending == (direction == 'next')
+    if position is not None:
+        timestamp, id = position
+        if forward:
+            query = query.filter(or_(model.timestamp > timestamp,
+                                     and_(model.timestamp == timestamp, model.id > id)))
+        else:
+            query = query.filter(or_(model.timestamp < timestamp,
+                                     and_(model.timestamp == timestamp, model.id < id)))
+    if forward:
+        query = query.order_by(model.timestamp.asc(), model.id.asc())
+    else:
+        query = query.order_by(model.timestamp.desc(), model.id.desc())
+    items = query.limit(per_page + 1).all()
+    has_more = len(items) > per_page
+    items = items[:per_page]
+    if direction == 'prev':
+        items.reverse()
+
+    prev = next = None
+    if items:
+        if direction == 'next' and position is not None or \
+                direction == 'prev' and has_more:
+            prev = url_for(endpoint, cursor=encode_cursor('prev', items[0]), **kwargs)
+        if direction == 'prev' or has_more:
+            next = url_for(endpoint, cursor=encode_cursor('next', items[-1]), **kwargs)
+    return items, prev, next
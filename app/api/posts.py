@@ -4,23 +4,38 @@ from ..models import Post, Permission
 from . import api
 from .decorators import permission_required
 from .errors import forbidden
+from .pagination import paginate_cursor
+from .caching import conditional
+from .serializers import json_response, serialize_posts, post_selection, fieldset_args, \
+    post_version
 
 
 @api.route('/posts/')
 def get_posts():
+    fields, embed, options = post_selection()
+    query = Post.query.options(*options)
+    if 'cursor' in request.args:
+        posts, prev, next = paginate_cursor(
+            query, Post, current_app.config['FLASKY_POSTS_PER_PAGE'],
+            'api.get_posts', **fieldset_args())
+        return json_response({
+            'posts': serialize_posts(posts, fields, embed),
+            'prev': prev,
+            'next': next
+        })
     page = request.args.get('page', 1, type=int)
-    pagination = Post.query.paginate(
+    pagination = query.order_by(Post.timestamp.desc(), Post.id.desc()).paginate(
         page, per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
         error_out=False)
     posts = pagination.items
     prev = None
     if pagination.has_prev:
-        prev = url_for('api.get_posts', page=page-1)
+        prev = url_for('api.get_posts', page=page-1, **fieldset_args())
     next = None
     if pagination.has_next:
-        next = url_for('api.get_posts', page=page+1)
-    return jsonify({
-        'posts': [post.to_json() for post in posts],
+        next = url_for('api.get_posts', page=page+1, **fieldset_args())
+    return json_response({
+        'posts': serialize_posts(posts, fields, embed),
         'prev': prev,
         'next': next,
         'count': pagination.total
@@ -28,9 +43,14 @@ def get_posts():
 
 
 @api.route('/posts/<int:id>')
+@conditional(post_version)
 def get_post(id):
-    post = Post.query.get_or_404(id)
-    return jsonify(post.to_json())
+    if 'fields' not in request.args and 'embed' not in request.args:
+        post = Post.query.get_or_404(id)
+        return jsonify(post.to_json())
+    fields, embed, options = post_selection()
+    post = Post.query.options(*options).get_or_404(id)
+    return json_response(serialize_posts([post], fields, embed)[0])
 
 
 @api.route('/posts/', methods=['POST'])
@@ -0,0 +1,192 @@
+import json
+from collections import OrderedDict
+from flask import current_app, request, url_for
+from sqlalchemy.orm import joinedload, load_only
+from werkzeug.http import http_date
+from .. import db
+from ..exceptions import ValidationError
+from ..models import Post
+
+try:
+    import orjson
+except ImportError:  # the standard library encoder is used instead
+    orjson = None
+
+# an id that cannot clash with anything else in a URL
+ID_MARK = 987654321
+
+
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':'))
+
+
+def json_response(data, status=200):
+    """Like ``jsonify``, with the fastest encoder available; dates must
+    already be strings."""
+    return current_app.response_class(dumps(data), status=status,
+                                      mimetype='application/json')
+
+
+def date(value):
+    # the format jsonify uses
+    return http_date(value.utctimetuple()) if value is not None else None
+
+
+class URLTemplate(object):
+    """``url_for(endpoint, id=...)`` built once and then filled in by string
+    concatenation."""
+
+    def __init__(self, endpoint):
+        url = url_for(endpoint, id=ID_MARK)
+        self.prefix, self.suffix = url.split(str(ID_MARK))
+
+    def __call__(self, id):
+        if id is None:
+            return None
+        return self.prefix + str(id) + self.suffix
+
+
+def url_templates(*endpoints):
+    templates = current_app.extensions.setdefault('api_url_templates', {})
+    result = []
+    for endpoint in endpoints:
+        key = endpoint, request.script_root
+        template = templates.get(key)
+        if template is None:
+            template = templates[key] = URLTemplate(endpoint)
+        result.append(template)
+    return result
+
+
+# the columns each post field is read from
+POST_FIELDS = OrderedDict([
+    ('id', ['id']),
+    ('url', ['id']),
+    ('title', ['title']),
+    ('summary', ['summary']),
+    ('body', ['body']),
+    ('body_html', ['body_html']),
+    ('timestamp', ['timestamp']),
+    ('author_url', ['author_id']),
+    ('comments_url', ['id']),
+    ('comment_count', ['comment_count']),
+])
+DEFAULT_POST_FIELDS = ['url', 'body', 'body_html', 'timestamp', 'author_url',
+                       'comments_url', 'comment_count']
+POST_EMBEDS = {
+    'author': ('author_id', ['id', 'username', 'join_time', 'last_seen', 'post_count']),
+    'category': ('category_id', ['id', 'name']),
+}
+
+
+def split_names(name, allowed):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    names = [item.strip() for item in value.split(',') if item.strip()]
+    for item in names:
+        if item not in allowed:
+            raise ValidationError('unknown %s "%s"' % (name, item))
+    return names
+
+
+def fieldset_args():
+    """The ``fields`` and ``embed`` arguments of the request, for the links
+    to other pages."""
+    return {name: request.args[name] for name in ('fields', 'embed')
+            if name in request.args}
+
+
+def post_selection():
+    """The post fields and embedded objects asked for with ``?fields=`` and
+    ``?embed=``, and the query options that load just those, in one query."""
+    fields = split_names('fields', POST_FIELDS) or DEFAULT_POST_FIELDS
+    embed = split_names('embed', POST_EMBEDS) or []
+    # id and timestamp are needed for the ordering and the cursors
+    columns = ['id', 'timestamp']
+    for field in fields:
+        columns.extend(POST_FIELDS[field])
+    options = []
+    for name in embed:
+        foreign_key, related_columns = POST_EMBEDS[name]
+        columns.append(foreign_key)
+        options.append(joinedload(name).load_only(*related_columns))
+    options.append(load_only(*OrderedDict.fromkeys(columns)))
+    return fields, embed, options
+
+
+def post_version(id):
+    """The version of post ``id`` for ``conditional``: its update time and
+    comment count, plus the columns of the objects asked for with
+    ``?embed=``, read in one query."""
+    embed = split_names('embed', POST_EMBEDS) or []
+    query = db.session.query(Post.update_time, Post.comment_count) \
+        .filter(Post.id == id)
+    for name in embed:
+        relationship = getattr(Post, name)
+        related = relationship.property.mapper.class_
+        query = query.outerjoin(related, relationship).add_columns(
+            *[getattr(related, column) for column in POST_EMBEDS[name][1]])
+    return query.first()
+
+
+def serialize_posts(posts, fields=None, embed=()):
+    """``Post.to_json()`` for a page of posts, or just ``fields`` of it, with
+    the ``embed`` objects inlined. Comment counts come from the stored
+    ``comment_count`` column loaded with the rows."""
+    post_url, user_url, posts_url, comments_url = url_templates(
+        'api.get_post', 'api.get_user', 'api.get_user_posts', 'api.get_post_comments')
+    getters = {
+        'id': lambda post: post.id,
+        'url': lambda post: post_url(post.id),
+        'title': lambda post: post.title,
+        'summary': lambda post: post.summary,
+        'body': lambda post: post.body,
+        'body_html': lambda post: post.body_html,
+        'timestamp': lambda post: date(post.timestamp),
+        'author_url': lambda post: user_url(post.author_id),
+        'comments_url': lambda post: comments_url(post.id),
+        'comment_count': lambda post: post.comment_count,
+    }
+
+    def author(post):
+        user = post.author
+        if user is None:
+            return None
+        return {
+            'url': user_url(user.id),
+            'username': user.username,
+            'join_time': date(user.join_time),
+            'last_seen': date(user.last_seen),
+            'posts_url': posts_url(user.id),
+            'post_count': user.post_count
+        }
+
+    def category(post):
+        category = post.category
+        if category is None:
+            return None
+        return {'id': category.id, 'name': category.name}
+
+    embedders = {'author': author, 'category': category}
+    selected = [(field, getters[field]) for field in fields or DEFAULT_POST_FIELDS] + \
+        [(name, embedders[name]) for name in embed]
+    return [{name: get(post) for name, get in selected} for post in posts]
+
+
+def serialize_comments(comments):
+    """``Comment.to_json()`` for a page of comments."""
+    comment_url, post_url = url_templates('api.get_comment', 'api.get_post')
+    return [{
+        'url': comment_url(comment.id),
+        'post_url': post_url(comment.post_id),
+        'body': comment.body,
+        'body_html': comment.body_html,
+        'timestamp': date(comment.timestamp),
+        'user_name': comment.user_name,
+        'author_url': comment.url,
+        'name': comment.user_name,
+        'replay_id': comment.replay_id,
+    } for comment in comments]
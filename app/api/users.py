@@ -1,9 +1,15 @@
 from flask import jsonify, request, current_app, url_for
 from . import api
 from ..models import User, Post
+from .pagination import paginate_cursor
+from .caching import conditional
+from .serializers import json_response, serialize_posts, post_selection, fieldset_args
+from .. import db
 
 
 @api.route('/users/<int:id>')
+@conditional(lambda id: db.session.query(User.username, User.last_seen, User.post_count)
+             .filter(User.id == id).first())
 def get_user(id):
     user = User.query.get_or_404(id)
     return jsonify(user.to_json())
@@ -12,19 +18,30 @@ def get_user(id):
 @api.route('/users/<int:id>/posts/')
 def get_user_posts(id):
     user = User.query.get_or_404(id)
+    fields, embed, options = post_selection()
+    query = user.posts.options(*options)
+    if 'cursor' in request.args:
+        posts, prev, next = paginate_cursor(
+            query, Post, current_app.config['FLASKY_POSTS_PER_PAGE'],
+            'api.get_user_posts', id=id, **fieldset_args())
+        return json_response({
+            'posts': serialize_posts(posts, fields, embed),
+            'prev': prev,
+            'next': next
+        })
     page = request.args.get('page', 1, type=int)
-    pagination = user.posts.order_by(Post.timestamp.desc()).paginate(
+    pagination = query.order_by(Post.timestamp.desc()).paginate(
         page, per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
         error_out=False)
     posts = pagination.items
     prev = None
     if pagination.has_prev:
-        prev = url_for('api.get_user_posts', id=id, page=page-1)
+        prev = url_for('api.get_user_posts', id=id, page=page-1, **fieldset_args())
     next = None
     if pagination.has_next:
-        next = url_for('api.get_user_posts', id=id, page=page+1)
-    return jsonify({
-        'posts': [post.to_json() for post in posts],
+        next = url_for('api.get_user_posts', id=id, page=page+1, **fieldset_args())
+    return json_response({
+        'posts': serialize_posts(posts, fields, embed),
         'prev': prev,
         'next': next,
         'count': pagination.total
@@ -0,0 +1,113 @@
+import time
+from flask import current_app
+from . import db, cache
+from .models import Post
+
+CACHE_KEY = 'archive_tree'
+
+
+def _entry(id, title, timestamp):
+    return {'id': id, 'title': title, 'timestamp': timestamp}
+
+
+def _add(tree, entry):
+    timestamp = entry['timestamp']
+    date = "%s-%s" % (timestamp.month, timestamp.day)
+    posts = tree['years'].setdefault(timestamp.year, {}) \
+        .setdefault(timestamp.month, {}).setdefault(date, [])
+    posts.append(entry)
+    posts.sort(key=lambda post: post['timestamp'])
+    tree['index'][entry['id']] = (timestamp.year, timestamp.month, date)
+
+
+def _remove(tree, id):
+    location = tree['index'].pop(id, None)
+    if location is None:
+        return
+    year, month, date = location
+    months = tree['years'][year]
+    dates = months[month]
+    dates[date] = [post for post in dates[date] if post['id'] != id]
+    if not dates[date]:
+        del dates[date]
+        if not dates:
+            del months[month]
+            if not months:
+                del tree['years'][year]
+
+
+def build_tree():
+    """Bucket every post by year, month and day.
+
+    Only ``(id, title, timestamp)`` is selected and rows are streamed in
+    batches, so post bodies are never loaded.
+    """
+    tree = {'years': {}, 'index': {},
+            'expires': time.time() + current_app.config['CACHE_TIMEOUT']}
+    rows = db.session.query(Post.id, Post.title, Post.timestamp) \
+        .filter(Post.timestamp != None) \
+        .order_by(Post.id).yield_per(500)
+    for id, title, timestamp in rows:
+        _add(tree, _entry(id, title, timestamp))
+    return tree
+
+
+def archive_years(year=None):
+    """Return the cached ``{year: {month: {'m-d': [post]}}}`` archive tree,
+    optionally restricted to one year."""
+    tree = cache.get(CACHE_KEY)
+    if tree is None:
+        with db.primary_reads():
+            tree = build_tree()
+        cache.set(CACHE_KEY, tree)
+    years = tree['years']
+    if year is not None:
+        return {year: years[year]} if year in years else {}
+    return years
+
+
+# The cached tree is patched in place when posts are created, retitled,
+# re-dated or deleted, once the transaction commits. Patching keeps the
+# tree's original expiry so that it is still rebuilt now and then to pick
+# up posts changed by other processes.
+def archive_after_flush(session, flush_context):
+    changes = session.info.setdefault('archive_changes', [])
+    for obj in session.new:
+        if isinstance(obj, Post):
+            changes.append((obj.id, _entry(obj.id, obj.title, obj.timestamp)))
+    for obj in session.deleted:
+        if isinstance(obj, Post):
+            changes.append((obj.id, None))
+    for obj in session.dirty:
+        if isinstance(obj, Post):
+            state = db.inspect(obj)
+            if state.attrs.title.history.has_changes() or \
+                    state.attrs.timestamp.history.has_changes():
+                changes.append((obj.id, _entry(obj.id, obj.title, obj.timestamp)))
+
+
+def archive_after_commit(session):
+    changes = session.info.pop('archive_changes', None)
+    if not changes:
+        return
+    tree = cache.get(CACHE_KEY)
+    if tree is None:
+        return
+    timeout = int(tree['expires'] - time.time())
+    if timeout < 1:
+        cache.delete(CACHE_KEY)
+        return
+    for id, entry in changes:
+        _remove(tree, id)
+        if entry is not None and entry['timestamp'] is not None:
+            _add(tree, entry)
+    cache.set(CACHE_KEY, tree, timeout=timeout)
+
+
+def archive_after_rollback(session, previous_transaction):
+    session.info.pop('archive_changes', None)
+
+
+db.event.listen(db.session, 'after_flush', archive_after_flush)
+db.event.listen(db.session, 'after_commit', archive_after_commit)
+db.event.listen(db.session, 'after_soft_rollback', archive_after_rollback)
@@ -0,0 +1,328 @@
+import base64
+import hashlib
+import json
+import os
+import posixpath
+import re
+import time
+from collections import OrderedDict
+from urllib.parse import urljoin, urlsplit
+from urllib.request import urlopen
+from flask import current_app, request, url_for
+
+try:
+    import rjsmin
+except ImportError:  # scripts are bundled without minifying them
+    rjsmin = None
+
+# third-party files, by where they are kept under the static folder: where
+# to download them from and the Subresource Integrity digest they must have.
+# A file without a digest (None) is neither downloaded nor loaded from its
+# CDN; `flask assets build` stops with the digest it got, to be checked
+# against the one cdnjs publishes before pinning it here.
+VENDOR = OrderedDict([
+    ('vendor/bootstrap/css/bootstrap.min.css',
+     ('https://cdnjs.cloudflare.com/ajax/libs/twitter-bootstrap/3.3.7/css/bootstrap.min.css',
+      'sha384-BVYiiSIFeK1dGmJRAkycuHAHRg32OmUcww7on3RYdg4Va+PmSTsz/K68vbdEjh4u')),
+    ('vendor/font-awesome/css/font-awesome.min.css',
+     ('https://cdnjs.cloudflare.com/ajax/libs/font-awesome/4.7.0/css/font-awesome.min.css',
+      'sha384-wvfXpqpZZVQGK6TAh5PVlGOfQNHSoD2xbE+QkPxCAFlNEevoEH3Sl0sibVcOQVnN')),
+    ('vendor/flat-ui/css/flat-ui.min.css',
+     ('https://cdnjs.cloudflare.com/ajax/libs/flat-ui/2.3.0/css/flat-ui.min.css',
+      None)),
+    ('vendor/jquery/jquery.min.js',
+     ('https://cdnjs.cloudflare.com/ajax/libs/jquery/1.12.4/jquery.min.js',
+      'sha256-ZosEbRLbNQzLpnKIkEdrPv7lOy9C27hHQ+Xp8a4MxAQ=')),
+    ('vendor/bootstrap/js/bootstrap.min.js',
+     ('https://cdnjs.cloudflare.com/ajax/libs/twitter-bootstrap/3.3.7/js/bootstrap.min.js',
+      'sha384-Tc5IQib027qvyjSMfHjOMaLkfuWVxZxUPnCJA7l2mCWNIpG9mGCD8wGNIcPD7Txa')),
+    ('vendor/moment/moment-with-locales.min.js',
+     ('https://cdnjs.cloudflare.com/ajax/libs/moment.js/2.23.0/moment-with-locales.min.js',
+      None)),
+])
+
+# the fonts and images the vendored stylesheets refer to, by where they are
+# kept under the static folder, with the digest each must have
+VENDOR_REFS = OrderedDict()
+
+# one bundle per kind of page, from files under the static folder
+BUNDLES = OrderedDict([
+    ('base.css', ['vendor/bootstrap/css/bootstrap.min.css',
+                  'vendor/font-awesome/css/font-awesome.min.css',
+                  'vendor/flat-ui/css/flat-ui.min.css',
+                  'styles.css']),
+    ('base.js', ['vendor/jquery/jquery.min.js',
+                 'vendor/bootstrap/js/bootstrap.min.js',
+                 'vendor/moment/moment-with-locales.min.js',
+                 'js/base.js']),
+    ('post.js', ['js/post.js']),
+])
+
+OUTPUT = 'dist'
+MANIFEST = OUTPUT + '/manifest.json'
+
+CSS_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+CSS_STRING = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')')
+SOURCE_MAP = re.compile(r'^\s*//[#@] sourceMappingURL=.*$', re.M)
+
+
+def fingerprint(filename, data):
+    """``css/a.css`` -> ``css/a.<hash>.css``."""
+    base, ext = posixpath.splitext(filename)
+    return '%s.%s%s' % (base, hashlib.sha1(data).hexdigest()[:12], ext)
+
+
+def minify_css(text):
+    def minify(part):
+        part = re.sub(r'\s+', ' ', part)
+        part = re.sub(r' ?([{};,>]) ?', r'\1', part)
+        return part.replace(';}', '}')
+    # strings are left alone
+    parts = CSS_STRING.split(re.sub(r'/\*.*?\*/', '', text, flags=re.S))
+    return ''.join(part if i % 2 else minify(part)
+                   for i, part in enumerate(parts)).strip()
+
+
+def minify_js(text):
+    text = SOURCE_MAP.sub('', text)
+    if rjsmin is not None:
+        return rjsmin.jsmin(text)
+    return text.strip()
+
+
+def _is_local(url):
+    return not (url.startswith(('data:', '#', '/')) or urlsplit(url).scheme)
+
+
+def integrity(data, algorithm='sha384'):
+    """The Subresource Integrity digest of ``data``."""
+    return '%s-%s' % (algorithm, base64.b64encode(
+        hashlib.new(algorithm, data).digest()).decode('ascii'))
+
+
+def _fetch(url):
+    try:
+        with urlopen(url, timeout=30) as f:
+            return f.read()
+    except OSError as e:
+        raise RuntimeError('could not fetch %s: %s' % (url, e))
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _verified(url, data, pinned, unpinned):
+    """Whether ``data`` may be written: it matches its pin, or there is no
+    pin and its digest is noted in ``unpinned``."""
+    if pinned is None:
+        unpinned.append('%s %s' % (url, integrity(data)))
+        return False
+    if integrity(data, pinned.split('-', 1)[0]) != pinned:
+        raise RuntimeError('%s does not match its pinned digest %s' % (url, pinned))
+    return True
+
+
+def vendor(static_folder, log=print):
+    """Download the third-party files that are not in the static folder yet,
+    with the fonts and images their stylesheets refer to. Each must match
+    its pin in ``VENDOR`` or ``VENDOR_REFS``: a file that differs stops the
+    build, and one without a pin is not written and is reported, with its
+    digest, once the others are done."""
+    unpinned = []
+    for filename, (url, pinned) in VENDOR.items():
+        path = os.path.join(static_folder, filename)
+        if os.path.exists(path):
+            continue
+        data = _fetch(url)
+        log('fetched %s' % url)
+        if not _verified(url, data, pinned, unpinned):
+            continue
+        if filename.endswith('.css'):
+            for _, ref in CSS_URL.findall(data.decode('utf-8')):
+                ref = ref.split('#')[0].split('?')[0]
+                if not _is_local(ref):
+                    continue
+                target = posixpath.normpath(
+                    posixpath.join(posixpath.dirname(filename), ref))
+                target_path = os.path.join(static_folder, target)
+                if not os.path.exists(target_path):
+                    ref_url = urljoin(url, ref)
+                    ref_data = _fetch(ref_url)
+                    log('fetched %s' % ref_url)
+                    if _verified(ref_url, ref_data, VENDOR_REFS.get(target), unpinned):
+                        _write(target_path, ref_data)
+        _write(path, data)
+    if unpinned:
+        raise RuntimeError('not pinned, check these digests and pin them:\n'
+                           + '\n'.join(unpinned))
+
+
+class Builder(object):
+    def __init__(self, static_folder, log=print):
+        self.static_folder = static_folder
+        self.log = log
+        self.manifest = OrderedDict()
+
+    def read(self, filename):
+        with open(os.path.join(self.static_folder, filename), 'rb') as f:
+            return f.read()
+
+    def emit(self, name, data):
+        output = posixpath.join(OUTPUT, fingerprint(name, data))
+        path = os.path.join(self.static_folder, output)
+        if not os.path.exists(path):
+            _write(path, data)
+        self.manifest[name] = output
+        return output
+
+    def copy(self, filename):
+        """Fingerprint a file referred to by a stylesheet, once."""
+        if filename not in self.manifest:
+            self.emit(filename, self.read(filename))
+        return self.manifest[filename]
+
+    def css(self, filename, output):
+        """A stylesheet with its ``url()`` references fingerprinted and made
+        relative to ``output``."""
+        def rewrite(match):
+            ref = match.group(2)
+            if not _is_local(ref):
+                return match.group(0)
+            path, _, fragment = ref.partition('#')
+            target = posixpath.normpath(
+                posixpath.join(posixpath.dirname(filename), path.split('?')[0]))
+            if not os.path.isfile(os.path.join(self.static_folder, target)):
+                self.log('warning: %s refers to missing %s' % (filename, target))
+                copied = target
+            else:
+                copied = self.copy(target)
+            url = posixpath.relpath(copied, posixpath.dirname(output))
+            return 'url(%s)' % (url + '#' + fragment if fragment else url)
+        return CSS_URL.sub(rewrite, self.read(filename).decode('utf-8'))
+
+    def bundle(self, name, sources):
+        # the output lies directly in OUTPUT, whatever its hash
+        output = posixpath.join(OUTPUT, name)
+        if name.endswith('.css'):
+            text = '\n'.join(minify_css(self.css(source, output)) for source in sources)
+        else:
+            # a ; between files, in case one does not end its last statement
+            text = ';\n'.join(minify_js(self.read(source).decode('utf-8'))
+                              for source in sources)
+        return self.emit(name, text.encode('utf-8'))
+
+    def static_files(self):
+        """Fingerprint the app's own static files, so they can be linked to
+        individually too."""
+        for root, dirs, files in os.walk(self.static_folder):
+            relative = os.path.relpath(root, self.static_folder).replace(os.sep, '/')
+            if relative in (OUTPUT, 'vendor') or relative.startswith((OUTPUT + '/', 'vendor/')):
+                continue
+            for name in sorted(files):
+                filename = posixpath.normpath(posixpath.join(relative, name))
+                if filename.endswith('.css'):
+                    output = posixpath.join(OUTPUT, filename)
+                    self.emit(filename, self.css(filename, output).encode('utf-8'))
+                else:
+                    self.copy(filename)
+
+    def clean(self, previous):
+        """Remove outputs neither this build nor the previous one use, so
+        pages still being served from the previous build keep working."""
+        keep = set(self.manifest.values()) | set(previous.values()) | {MANIFEST}
+        output_folder = os.path.join(self.static_folder, OUTPUT)
+        for root, dirs, files in os.walk(output_folder):
+            for name in files:
+                path = os.path.join(root, name)
+                filename = os.path.relpath(path, self.static_folder).replace(os.sep, '/')
+                if filename not in keep:
+                    os.remove(path)
+                    self.log('removed %s' % filename)
+
+
+def load_manifest(static_folder):
+    try:
+        with open(os.path.join(static_folder, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def build(static_folder, fetch=True, log=print):
+    """Vendor, bundle and fingerprint the static files; returns the manifest
+    mapping each bundle and file name to its fingerprinted file."""
+    if fetch:
+        vendor(static_folder, log)
+    previous = load_manifest(static_folder)
+    builder = Builder(static_folder, log)
+    builder.static_files()
+    for name, sources in BUNDLES.items():
+        log('%s -> %s' % (name, builder.bundle(name, sources)))
+    builder.clean(previous)
+    _write(os.path.join(static_folder, MANIFEST),
+           json.dumps(builder.manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return builder.manifest
+
+
+class Assets(object):
+    """Links to fingerprinted static files.
+
+    ``flask assets build`` writes each bundle in ``BUNDLES`` and every static
+    file to ``static/dist`` under a name with a hash of its content, and
+    records the names in a manifest. Those files never change, so they are
+    served with ``ASSETS_MAX_AGE`` and ``immutable``. Until a build exists the
+    templates link to the separate source files, or to their CDN, with the
+    pinned Subresource Integrity digest, when a pinned vendored file is
+    missing.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ASSETS_MAX_AGE', 365 * 24 * 3600)
+        app.extensions['assets'] = load_manifest(app.static_folder) \
+            if app.has_static_folder else {}
+        app.jinja_env.globals['asset_url_for'] = self.url_for
+        app.jinja_env.globals['bundle_urls'] = self.bundle_urls
+        app.after_request(self._cache_forever)
+
+    def reload(self, app):
+        app.extensions['assets'] = load_manifest(app.static_folder)
+
+    def url_for(self, endpoint, **values):
+        """``url_for``, with static file names replaced by their
+        fingerprinted ones when there are."""
+        if endpoint == 'static' and 'filename' in values:
+            manifest = current_app.extensions['assets']
+            values['filename'] = manifest.get(values['filename'], values['filename'])
+        return url_for(endpoint, **values)
+
+    def bundle_urls(self, name):
+        """The ``(url, integrity)`` pairs to include a bundle with;
+        ``integrity`` is set for files loaded from their CDN, which only
+        pinned files are."""
+        if name in current_app.extensions['assets']:
+            return [(self.url_for('static', filename=name), None)]
+        urls = []
+        for source in BUNDLES[name]:
+            if source in VENDOR and VENDOR[source][1] is not None and not os.path.exists(
+                    os.path.join(current_app.static_folder, source)):
+                urls.append(VENDOR[source])
+            else:
+                urls.append((url_for('static', filename=source), None))
+        return urls
+
+    def _cache_forever(self, response):
+        if request.endpoint == 'static' and response.status_code in (200, 304) and \
+                request.view_args.get('filename', '').startswith(OUTPUT + '/'):
+            max_age = current_app.config['ASSETS_MAX_AGE']
+            response.cache_control.public = True
+            response.cache_control.max_age = max_age
+            response.headers['Cache-Control'] += ', immutable'
+            response.expires = int(time.time() + max_age)
+        return response
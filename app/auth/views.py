@@ -1,17 +1,20 @@
 from flask import render_template, redirect, request, url_for, flash, current_app, abort
 from flask_login import login_user, logout_user, login_required, current_user
 from . import auth
+from .. import rate_limiter
 from ..models import User, db, Category
 from .forms import LoginForm, RegistrationForm, ChangePasswordForm, PasswordResetRequestForm, PasswordResetForm, ChangeEmailForm
 from ..myemail import send_email
 
 
 @auth.route("/login", methods=['GET', 'POST'])
+@rate_limiter.limit('RATELIMIT_LOGIN', key='ip', methods=['POST'])
 def login():
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
         if user is not None and user.verify_password(form.password.data):
+            db.session.commit()
             login_user(user, form.remember_me.data)
             next = request.args.get("next")
             if next is None or not next.startswith('/'):
@@ -140,6 +143,7 @@ def change_email_request():
     form = ChangeEmailForm()
     if form.validate_on_submit():
         if current_user.verify_password(form.password.data):
+            db.session.commit()
             new_email = form.email.data
             token = current_user.generate_email_change_token(new_email)
             send_email(new_email, '确认邮箱地址',
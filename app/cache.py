@@ -0,0 +1,26 @@
+from flask import current_app
+from werkzeug.contrib.cache import SimpleCache
+
+
+class Cache(object):
+    """Process-level cache, one ``SimpleCache`` per application.
+
+    Whoever writes an entry is expected to delete it when the data behind it
+    changes, but only the writing process knows about the change, so entries
+    also expire after ``CACHE_TIMEOUT`` seconds to pick up what other
+    processes wrote.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CACHE_THRESHOLD', 500)
+        app.config.setdefault('CACHE_TIMEOUT', 60)
+        app.extensions['cache'] = SimpleCache(
+            threshold=app.config['CACHE_THRESHOLD'],
+            default_timeout=app.config['CACHE_TIMEOUT'])
+
+    def __getattr__(self, name):
+        return getattr(current_app.extensions['cache'], name)
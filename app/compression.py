@@ -0,0 +1,235 @@
+import hashlib
+import mimetypes
+import os
+import threading
+import zlib
+from flask import current_app, g, request, safe_join
+from werkzeug.exceptions import NotFound
+from werkzeug.http import http_date
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/xml', 'text/javascript',
+    'application/javascript', 'application/json', 'application/xml',
+    'application/rss+xml', 'image/svg+xml', 'image/x-icon',
+}
+
+
+class GzipEncoder(object):
+    def __init__(self, level):
+        # wbits 31: a gzip header without a timestamp, so output is stable
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def process(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliEncoder(object):
+    def __init__(self, quality):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def process(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+def compress(encoding, data, level):
+    encoder = encoders[encoding](level)
+    return encoder.process(data) + encoder.finish()
+
+
+encoders = {'gzip': GzipEncoder}
+if brotli is not None:
+    encoders['br'] = BrotliEncoder
+
+
+def stream(encoding, level, chunks, charset):
+    """Compress an iterable body chunk by chunk, flushing after each one so
+    the client still gets every chunk as soon as it is produced."""
+    encoder = encoders[encoding](level)
+    try:
+        for chunk in chunks:
+            if not isinstance(chunk, bytes):
+                chunk = chunk.encode(charset)
+            data = encoder.process(chunk) + encoder.flush()
+            if data:
+                yield data
+        yield encoder.finish()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+class StaticFile(object):
+    def __init__(self, path, mimetype, mtime, variants):
+        self.path = path
+        self.mimetype = mimetype
+        self.mtime = mtime
+        # encoding -> (data, etag)
+        self.variants = variants
+
+
+class _State(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.static_files = {}
+        self.send_static_file = None
+
+
+class Compress(object):
+    """Compresses responses for clients that accept it.
+
+    Dynamic responses of a compressible type are compressed with brotli
+    (when the ``brotli`` package is installed) or gzip once they are at
+    least ``COMPRESS_MIN_SIZE`` bytes. Streamed responses are compressed
+    chunk by chunk without buffering. Compressed responses get a weak ETag,
+    as the bytes differ from the uncompressed ones, and ``Vary:
+    Accept-Encoding`` is set whether or not a response was compressed.
+
+    HTML holding the CSRF token of the request is left uncompressed: next to
+    reflected input, such as the search box, its compressed size would let
+    an attacker guess the token one character at a time (BREACH).
+
+    Static files are compressed at the highest level the first time they are
+    requested and then served from memory; a file changed on disk is
+    compressed again on its next request.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_ENABLED', True)
+        app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+        app.config.setdefault('COMPRESS_LEVEL', 6)
+        app.config.setdefault('COMPRESS_BROTLI_QUALITY', 4)
+        app.config.setdefault('COMPRESS_STATIC', True)
+        app.extensions['compress'] = state = _State()
+        # registered before the blueprints, so it runs after their hooks
+        app.after_request(self._compress)
+        if app.config['COMPRESS_ENABLED'] and app.config['COMPRESS_STATIC'] \
+                and app.has_static_folder:
+            state.send_static_file = app.view_functions['static']
+            app.view_functions['static'] = self._static
+
+    def encoding(self, available=None):
+        """The best encoding the client accepts, or ``None``."""
+        choices = [name for name in ('br', 'gzip')
+                   if name in (encoders if available is None else available)]
+        return request.accept_encodings.best_match(choices)
+
+    def _level(self, encoding):
+        if encoding == 'br':
+            return current_app.config['COMPRESS_BROTLI_QUALITY']
+        return current_app.config['COMPRESS_LEVEL']
+
+    def _compress(self, response):
+        if not current_app.config['COMPRESS_ENABLED'] or \
+                response.mimetype not in COMPRESSIBLE_MIMETYPES or \
+                response.status_code < 200 or response.status_code in (204, 304) or \
+                'Content-Encoding' in response.headers or \
+                response.direct_passthrough or \
+                'no-transform' in response.headers.get('Cache-Control', ''):
+            return response
+        if response.mimetype == 'text/html' and self._holds_csrf_token(response):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = self.encoding()
+        if encoding is None:
+            return response
+        level = self._level(encoding)
+        if response.is_streamed:
+            response.response = stream(encoding, level, response.response,
+                                       response.charset)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < current_app.config['COMPRESS_MIN_SIZE']:
+                return response
+            response.set_data(compress(encoding, data, level))
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag is not None and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def _holds_csrf_token(self, response):
+        token = g.get(current_app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token'))
+        if token is None:
+            return False
+        # a streamed body cannot be checked without consuming it
+        return response.is_streamed or token.encode('ascii') in response.get_data()
+
+    def _load(self, app, state, filename):
+        path = safe_join(app.static_folder, filename)
+        mimetype = mimetypes.guess_type(filename)[0]
+        if path is None or mimetype not in COMPRESSIBLE_MIMETYPES or \
+                not os.path.isfile(path):
+            return None
+        mtime = os.path.getmtime(path)
+        with open(path, 'rb') as f:
+            data = f.read()
+        variants = {}
+        for encoding in encoders:
+            # the highest levels, as it is done only once per file
+            compressed = compress(encoding, data, 11 if encoding == 'br' else 9)
+            if len(compressed) < len(data):
+                etag = hashlib.sha1(compressed).hexdigest()
+                variants[encoding] = compressed, etag
+        static_file = StaticFile(path, mimetype, mtime, variants)
+        with state.lock:
+            state.static_files[filename] = static_file
+        return static_file
+
+    def _static(self, filename):
+        response = self._send_precompressed(filename)
+        if response is None:
+            response = current_app.extensions['compress'].send_static_file(filename)
+            if response.mimetype in COMPRESSIBLE_MIMETYPES:
+                response.vary.add('Accept-Encoding')
+        return response
+
+    def _send_precompressed(self, filename):
+        """A precompressed static file, or ``None`` to let Flask send the
+        file itself."""
+        state = current_app.extensions['compress']
+        static_file = state.static_files.get(filename)
+        try:
+            if static_file is None or \
+                    os.path.getmtime(static_file.path) != static_file.mtime:
+                static_file = self._load(current_app, state, filename)
+        except OSError:
+            raise NotFound()
+        if static_file is None:
+            return None
+        encoding = self.encoding(static_file.variants)
+        if encoding is None:
+            return None
+        data, etag = static_file.variants[encoding]
+        response = current_app.response_class(data, mimetype=static_file.mimetype)
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.set_etag(etag)
+        response.headers['Last-Modified'] = http_date(static_file.mtime)
+        max_age = current_app.get_send_file_max_age(filename)
+        if max_age is not None:
+            response.cache_control.public = True
+            response.cache_control.max_age = max_age
+        return response.make_conditional(request)
@@ -0,0 +1,52 @@
+import hashlib
+import hmac
+import os
+from flask import current_app
+from werkzeug.contrib.cache import SimpleCache
+
+
+class _State(object):
+    def __init__(self, app):
+        # never leaves the process, so the keys mean nothing anywhere else
+        self.key = os.urandom(32)
+        self.cache = SimpleCache(threshold=app.config['CREDENTIAL_CACHE_SIZE'],
+                                 default_timeout=app.config['CREDENTIAL_CACHE_TTL'])
+
+
+class CredentialCache(object):
+    """Remembers recently verified email/password pairs.
+
+    Checking a password hash is deliberately slow, which caps the throughput
+    of clients using Basic auth on every request. A successful check is
+    remembered for ``CREDENTIAL_CACHE_TTL`` seconds under an HMAC of the
+    credentials with a random per-process key, together with the password
+    hash it was checked against. An entry only counts while the user still
+    has that hash, so changing the password invalidates it everywhere.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CREDENTIAL_CACHE_TTL', 300)
+        app.config.setdefault('CREDENTIAL_CACHE_SIZE', 1000)
+        app.extensions['credential_cache'] = _State(app)
+
+    def _key(self, state, email, password):
+        message = ('%s\0%s' % (email, password)).encode('utf-8')
+        return hmac.new(state.key, message, hashlib.sha256).hexdigest()
+
+    def get(self, email, password):
+        """The ``(user_id, password_hash)`` the credentials were last
+        verified against, or ``None``."""
+        state = current_app.extensions['credential_cache']
+        if not current_app.config['CREDENTIAL_CACHE_TTL']:
+            return None
+        return state.cache.get(self._key(state, email, password))
+
+    def set(self, email, password, user):
+        state = current_app.extensions['credential_cache']
+        if current_app.config['CREDENTIAL_CACHE_TTL']:
+            state.cache.set(self._key(state, email, password),
+                            (user.id, user.password_hash))
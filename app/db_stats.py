@@ -0,0 +1,287 @@
+import bisect
+import random
+import re
+import sys
+import threading
+import time
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from flask import current_app, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# upper bounds of the histogram buckets, plus one for anything larger
+QUERY_COUNT_BOUNDS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+DB_TIME_BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5)
+
+_STRING = re.compile(r"'(?:''|[^'])*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDERS = re.compile(r'\(\s*(?:\?|%s|:\w+)(?:\s*,\s*(?:\?|%s|:\w+))*\s*\)')
+_SPACE = re.compile(r'\s+')
+
+
+def statement_shape(statement):
+    """A statement with its literals replaced by ``?`` and its ``IN`` lists
+    collapsed, so statements that differ only in values compare equal."""
+    shape = _STRING.sub('?', statement)
+    shape = _NUMBER.sub('?', shape)
+    shape = _PLACEHOLDERS.sub('(?)', shape)
+    return _SPACE.sub(' ', shape).strip()
+
+
+# a statement shape run more than NPLUSONE_THRESHOLD times in one request
+Finding = namedtuple('Finding', 'endpoint template shape count')
+
+
+class NPlusOneError(Exception):
+    def __init__(self, findings):
+        super(NPlusOneError, self).__init__(
+            '; '.join('%s (template %s) ran %d times: %s'
+                      % (finding.endpoint, finding.template or '-', finding.count, finding.shape)
+                      for finding in findings))
+        self.findings = findings
+
+
+class Histogram(object):
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+
+    def to_json(self):
+        return {'bounds': list(self.bounds), 'counts': list(self.counts)}
+
+
+class EndpointStats(object):
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.time = 0.0
+        self.query_counts = Histogram(QUERY_COUNT_BOUNDS)
+        self.db_times = Histogram(DB_TIME_BOUNDS)
+        self.slowest = 0.0
+        self.slowest_shape = None
+
+    def to_json(self):
+        return {
+            'requests': self.requests,
+            'queries': self.queries,
+            'db_time': self.time,
+            'query_counts': self.query_counts.to_json(),
+            'db_times': self.db_times.to_json(),
+            'slowest': self.slowest,
+            'slowest_statement': self.slowest_shape,
+        }
+
+
+class Record(object):
+    """The queries of the request being handled by a thread."""
+
+    def __init__(self, sample_rate, track_statements):
+        self.count = 0
+        self.time = 0.0
+        self.started = None
+        self.slowest = 0.0
+        self.slowest_statement = None
+        self.sample_rate = sample_rate
+        self.samples = []
+        # SELECT statement -> times run, and the template being rendered
+        # the first time, when looking for N+1 queries
+        self.statements = {} if track_statements else None
+        self.templates = {}
+
+
+_local = threading.local()
+
+
+def _template_name():
+    """The name of the innermost template being rendered, so that a query
+    run from an included partial is put down to the partial."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        # the globals of the code Jinja compiles a template to
+        template = frame.f_globals.get('__jinja_template__')
+        if template is not None:
+            return template.name
+        frame = frame.f_back
+    return None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    record = getattr(_local, 'record', None)
+    if record is not None:
+        record.started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    record = getattr(_local, 'record', None)
+    if record is None or record.started is None:
+        return
+    duration = time.perf_counter() - record.started
+    record.started = None
+    record.count += 1
+    record.time += duration
+    if duration > record.slowest:
+        record.slowest = duration
+        record.slowest_statement = statement
+    if record.sample_rate and random.random() < record.sample_rate:
+        record.samples.append((statement, parameters, duration))
+    statements = record.statements
+    if statements is not None and statement.lstrip()[:6].upper() == 'SELECT':
+        count = statements.get(statement)
+        if count is None:
+            statements[statement] = 1
+            record.templates[statement] = _template_name()
+        else:
+            statements[statement] = count + 1
+
+
+def repeated_statements(record, endpoint, threshold):
+    """The statement shapes a request ran more than ``threshold`` times."""
+    shapes = {}
+    for statement, count in record.statements.items():
+        shape = statement_shape(statement)
+        total, template = shapes.get(shape, (0, None))
+        shapes[shape] = total + count, template or record.templates[statement]
+    return [Finding(endpoint, template, shape, count)
+            for shape, (count, template) in shapes.items() if count > threshold]
+
+
+class _State(object):
+    def __init__(self, app):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.samples = deque(maxlen=app.config['DB_STATS_SAMPLE_SIZE'])
+        self.captures = []
+
+
+class QueryStats(object):
+    """Per-endpoint database statistics, gathered at little cost per query.
+
+    Cursor events count the queries of each request and time them; when the
+    request ends its query count and database time go into fixed-size
+    histograms for its endpoint, along with the shape of the slowest
+    statement seen there. A request whose slowest query takes at least
+    ``FLASKY_SLOW_DB_QUERY_TIME`` seconds is logged. Full statements with
+    their parameters are kept for a ``DB_STATS_SAMPLE_RATE`` fraction of the
+    queries only, off by default, in a buffer of the last
+    ``DB_STATS_SAMPLE_SIZE``.
+
+    With ``NPLUSONE_ENABLED`` it also looks for N+1 queries: a SELECT shape
+    run more than ``NPLUSONE_THRESHOLD`` times by one request is logged with
+    the endpoint and the innermost template being rendered when it first
+    ran, and with ``NPLUSONE_RAISE`` the request fails with
+    ``NPlusOneError``.
+
+    Statistics are per process.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('DB_STATS_ENABLED', True)
+        app.config.setdefault('DB_STATS_SAMPLE_RATE', 0)
+        app.config.setdefault('DB_STATS_SAMPLE_SIZE', 100)
+        app.config.setdefault('FLASKY_SLOW_DB_QUERY_TIME', 0.5)
+        app.config.setdefault('NPLUSONE_ENABLED', False)
+        app.config.setdefault('NPLUSONE_THRESHOLD', 5)
+        app.config.setdefault('NPLUSONE_RAISE', False)
+        app.extensions['db_stats'] = _State(app)
+        # every engine, the replicas too; the hooks do nothing outside of
+        # a request
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        app.before_request(self._start)
+        app.after_request(self._check)
+        app.teardown_request(self._finish)
+
+    def snapshot(self):
+        state = current_app.extensions['db_stats']
+        with state.lock:
+            return {
+                'endpoints': {str(endpoint): stats.to_json()
+                              for endpoint, stats in state.endpoints.items()},
+                'samples': [{'endpoint': endpoint, 'statement': statement,
+                             'parameters': repr(parameters), 'duration': duration}
+                            for endpoint, statement, parameters, duration in state.samples],
+            }
+
+    def reset(self):
+        state = current_app.extensions['db_stats']
+        with state.lock:
+            state.endpoints.clear()
+            state.samples.clear()
+
+    @contextmanager
+    def capture(self):
+        """Collect the N+1 findings of the requests made in the block::
+
+            with query_stats.capture() as findings:
+                client.get('/')
+            self.assertEqual(findings, [])
+        """
+        state = current_app.extensions['db_stats']
+        findings = []
+        state.captures.append(findings)
+        try:
+            yield findings
+        finally:
+            state.captures.remove(findings)
+
+    def _start(self):
+        config = current_app.config
+        if config['DB_STATS_ENABLED'] or config['NPLUSONE_ENABLED']:
+            _local.record = Record(config['DB_STATS_SAMPLE_RATE'],
+                                   config['NPLUSONE_ENABLED'])
+
+    def _check(self, response):
+        record = getattr(_local, 'record', None)
+        if record is None or record.statements is None:
+            return response
+        findings = repeated_statements(record, request.endpoint,
+                                       current_app.config['NPLUSONE_THRESHOLD'])
+        # only once per request
+        record.statements = None
+        if not findings:
+            return response
+        for finding in findings:
+            current_app.logger.warning('N+1 queries on %s (template %s): %d x %s'
+                                       % (finding.endpoint, finding.template or '-',
+                                          finding.count, finding.shape))
+        for captured in current_app.extensions['db_stats'].captures:
+            captured.extend(findings)
+        if current_app.config['NPLUSONE_RAISE']:
+            raise NPlusOneError(findings)
+        return response
+
+    def _finish(self, exc=None):
+        record = getattr(_local, 'record', None)
+        _local.record = None
+        if record is None or not current_app.config['DB_STATS_ENABLED']:
+            return
+        state = current_app.extensions['db_stats']
+        endpoint = request.endpoint
+        shape = statement_shape(record.slowest_statement) \
+            if record.slowest_statement is not None else None
+        with state.lock:
+            stats = state.endpoints.get(endpoint)
+            if stats is None:
+                stats = state.endpoints[endpoint] = EndpointStats()
+            stats.requests += 1
+            stats.queries += record.count
+            stats.time += record.time
+            stats.query_counts.add(record.count)
+            stats.db_times.add(record.time)
+            if record.slowest > stats.slowest:
+                stats.slowest = record.slowest
+                stats.slowest_shape = shape
+            for statement, parameters, duration in record.samples:
+                state.samples.append((endpoint, statement, parameters, duration))
+        if record.slowest >= current_app.config['FLASKY_SLOW_DB_QUERY_TIME']:
+            current_app.logger.warning('Slow query on %s: %s\nDuration: %fs'
+                                       % (endpoint, shape, record.slowest))
@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from flask import current_app
+from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
+from sqlalchemy.orm import joinedload, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
+
+Identity = namedtuple('Identity', 'id username confirmed role_id permissions')
+
+
+class _State(object):
+    def __init__(self, app):
+        self.lock = threading.Lock()
+        self.identities = OrderedDict()
+        self.serializer = Serializer(app.config['SECRET_KEY'])
+
+
+class IdentityCache(object):
+    """LRU cache of who a user id is and what they may do.
+
+    Holds an ``Identity`` snapshot per user for ``IDENTITY_CACHE_TTL``
+    seconds, at most ``IDENTITY_CACHE_SIZE`` of them. ``get`` turns a snapshot
+    back into a ``User`` attached to the session without a query: the
+    snapshot columns are loaded, ``can()`` answers from the cached permission
+    bits, and any other column is fetched the first time it is used.
+    Snapshots are dropped when a commit changes a user's name, email,
+    confirmed flag or role, or a role's permissions; other workers see the
+    change when their copy expires.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('IDENTITY_CACHE_TTL', 60)
+        app.config.setdefault('IDENTITY_CACHE_SIZE', 1000)
+        app.extensions['identity_cache'] = _State(app)
+
+    def serializer(self):
+        """A shared serializer for checking auth tokens."""
+        return current_app.extensions['identity_cache'].serializer
+
+    def get(self, user_id):
+        """The ``User`` with ``user_id``, or ``None``."""
+        from . import db
+        from .models import User
+        user = db.session.identity_map.get(identity_key(User, user_id))
+        if user is not None:
+            return user
+        identity = self._lookup(user_id)
+        if identity is None:
+            with db.primary_reads():
+                user = User.query.options(joinedload(User.role)).get(user_id)
+            if user is not None:
+                self._store(Identity(user.id, user.username, user.confirmed, user.role_id,
+                                     user.role.permissions if user.role else 0))
+            return user
+
+        user = User.__mapper__.class_manager.new_instance()
+        for key in ('id', 'username', 'confirmed', 'role_id'):
+            set_committed_value(user, key, getattr(identity, key))
+        make_transient_to_detached(user)
+        user.cached_permissions = identity.permissions
+        db.session.add(user)
+        return user
+
+    def invalidate(self, *user_ids):
+        state = current_app.extensions['identity_cache']
+        with state.lock:
+            for user_id in user_ids:
+                state.identities.pop(user_id, None)
+
+    def clear(self):
+        state = current_app.extensions['identity_cache']
+        with state.lock:
+            state.identities.clear()
+
+    def _lookup(self, user_id):
+        state = current_app.extensions['identity_cache']
+        with state.lock:
+            entry = state.identities.get(user_id)
+            if entry is None:
+                return None
+            expires, identity = entry
+            if expires < time.time():
+                del state.identities[user_id]
+                return None
+            state.identities.move_to_end(user_id)
+            return identity
+
+    def _store(self, identity):
+        state = current_app.extensions['identity_cache']
+        ttl = current_app.config['IDENTITY_CACHE_TTL']
+        if not ttl:
+            return
+        with state.lock:
+            state.identities[identity.id] = time.time() + ttl, identity
+            state.identities.move_to_end(identity.id)
+            while len(state.identities) > current_app.config['IDENTITY_CACHE_SIZE']:
+                state.identities.popitem(last=False)
@@ -0,0 +1,98 @@
+import atexit
+import os
+import threading
+import time
+import weakref
+from flask import current_app
+from sqlalchemy import bindparam, or_
+
+
+class _Buffer(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        # the process whose flusher thread is running
+        self.pid = None
+
+
+class LastSeenTracker(object):
+    """Buffers ``User.last_seen`` updates in memory.
+
+    Activity is recorded per user id and written out as one batched UPDATE
+    every ``LAST_SEEN_FLUSH_INTERVAL`` seconds by a background thread, so a
+    user is written at most once per interval instead of once per request,
+    and an idle worker does not sit on stale values. Every worker keeps its
+    own buffer; the UPDATE only ever moves ``last_seen`` forward, so workers
+    flushing in any order cannot overwrite newer activity with older. Pending
+    activity is flushed one last time when the process exits.
+    """
+
+    def __init__(self, app=None):
+        # every app using the tracker, flushed at exit by a single handler
+        self._apps = weakref.WeakSet()
+        atexit.register(self._flush_at_exit)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LAST_SEEN_FLUSH_INTERVAL', 60)
+        app.extensions['last_seen'] = _Buffer()
+        self._apps.add(app)
+
+    def touch(self, user_id, when):
+        buffer = current_app.extensions['last_seen']
+        with buffer.lock:
+            buffer.pending[user_id] = when
+            # started lazily so that each forked server worker gets its own
+            start = buffer.pid != os.getpid()
+            buffer.pid = os.getpid()
+        if start:
+            threading.Thread(target=self._flush_periodically,
+                             args=(weakref.ref(current_app._get_current_object()),),
+                             daemon=True).start()
+
+    def flush(self):
+        """Write all buffered activity in one batched UPDATE."""
+        from . import db
+        from .models import User
+        buffer = current_app.extensions['last_seen']
+        with buffer.lock:
+            pending, buffer.pending = buffer.pending, {}
+        if not pending:
+            return 0
+        users = User.__table__
+        stmt = users.update() \
+            .where(users.c.id == bindparam('user_id')) \
+            .where(or_(users.c.last_seen == None,
+                       users.c.last_seen < bindparam('seen'))) \
+            .values(last_seen=bindparam('seen'))
+        db.engine.execute(stmt, [{'user_id': user_id, 'seen': seen}
+                                 for user_id, seen in pending.items()])
+        return len(pending)
+
+    def _flush_periodically(self, app_ref):
+        # holds the app weakly, so that the thread ends with it
+        while True:
+            app = app_ref()
+            if app is None:
+                return
+            interval = app.config['LAST_SEEN_FLUSH_INTERVAL']
+            del app
+            time.sleep(interval)
+            app = app_ref()
+            if app is None:
+                return
+            with app.app_context():
+                try:
+                    self.flush()
+                except Exception:
+                    app.logger.exception('Could not flush last_seen updates')
+            del app
+
+    def _flush_at_exit(self):
+        for app in list(self._apps):
+            with app.app_context():
+                try:
+                    self.flush()
+                except Exception:
+                    app.logger.exception('Could not flush last_seen updates')
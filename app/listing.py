@@ -0,0 +1,86 @@
+from flask import current_app
+from flask_sqlalchemy import Pagination
+from sqlalchemy.orm import joinedload
+from . import db
+from .models import Post, Comment
+
+
+def paginate_posts(query, page, per_page=None):
+    """Paginate an already ordered post query for the _posts.html listing.
+
+    The author and category of every post are joined into the page query and
+    comment counts are read from the stored ``Post.comment_count`` column, so
+    a listing page costs a fixed number of queries however many posts it
+    shows.
+    """
+    if per_page is None:
+        per_page = current_app.config['FLASKY_POSTS_PER_PAGE']
+    return query.options(joinedload(Post.author),
+                         joinedload(Post.category)) \
+        .paginate(page, per_page=per_page, error_out=False)
+
+
+def posts_by_id(ids):
+    """Load the posts with the given ids for a listing, keeping their order."""
+    if not ids:
+        return []
+    posts = Post.query.options(joinedload(Post.author),
+                               joinedload(Post.category)) \
+        .filter(Post.id.in_(ids))
+    order = {id: i for i, id in enumerate(ids)}
+    return sorted(posts, key=lambda post: order[post.id])
+
+
+def paginate_comments(post, page, per_page=None):
+    """Paginate the visible comments of ``post``, oldest first.
+
+    The comment each one replies to is joined into the same query, and the
+    total is the stored ``Post.comment_count``, so a page of comments is a
+    single SELECT. ``page=-1`` is the last page.
+    """
+    if per_page is None:
+        per_page = current_app.config['FLASKY_COMMENTS_PER_PAGE']
+    total = post.comment_count or 0
+    if page == -1:
+        page = (total - 1) // per_page + 1
+    page = max(page, 1)
+    items = Comment.query.options(joinedload(Comment.replay)) \
+        .filter(Comment.post_id == post.id, Comment.visible()) \
+        .order_by(Comment.timestamp.asc(), Comment.id.asc()) \
+        .limit(per_page).offset((page - 1) * per_page).all()
+    return Pagination(None, page, per_page, total, items)
+
+
+def comment_tree(post_id, root_id=None):
+    """The visible comments of a post as a list of nested threads.
+
+    One query loads the comments (only the thread of ``root_id`` if given)
+    and the tree is built in a single pass over them. Replies to a comment
+    that is not visible are moved up to the top level.
+    """
+    query = Comment.query.filter(Comment.post_id == post_id, Comment.visible())
+    if root_id is not None:
+        query = query.filter(db.or_(Comment.id == root_id,
+                                    Comment.root_id == root_id))
+    nodes = {}
+    roots = []
+    # a reply always has a larger id than the comment it answers
+    for comment in query.order_by(Comment.id):
+        node = nodes[comment.id] = {'comment': comment, 'replies': []}
+        parent = nodes.get(comment.replay_id)
+        if parent is not None:
+            parent['replies'].append(node)
+        else:
+            roots.append(node)
+    return roots
+
+
+def post_version(id):
+    """The version of a post page: the post's update time and the latest
+    update and number of its comments, read in one query."""
+    return db.session.query(
+        db.select([Post.update_time]).where(Post.id == id).as_scalar(),
+        db.select([db.func.max(Comment.update_time)])
+        .where(Comment.post_id == id).as_scalar(),
+        db.select([db.func.count(Comment.id)])
+        .where(Comment.post_id == id).as_scalar()).one()
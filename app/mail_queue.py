@@ -0,0 +1,192 @@
+import atexit
+import os
+import queue
+import smtplib
+import threading
+import time
+import weakref
+from collections import Counter
+from flask import current_app
+
+
+def is_permanent(error):
+    """Whether retrying cannot help: the server rejected the message itself."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+
+class _State(object):
+    def __init__(self, app):
+        self.app = app
+        self.queue = queue.Queue(app.config['MAIL_QUEUE_SIZE'])
+        self.lock = threading.Lock()
+        self.stats = Counter()
+        self.workers = []
+        self.pid = None
+
+
+class MailQueue(object):
+    """Delivers mail from a bounded queue with a fixed pool of worker threads.
+
+    A worker takes up to ``MAIL_QUEUE_BATCH`` waiting messages and sends them
+    over one SMTP connection. A message that fails with a temporary error is
+    queued again after ``MAIL_QUEUE_BACKOFF`` seconds, doubling the wait each
+    time, up to ``MAIL_QUEUE_RETRIES`` times; the worker goes on with other
+    mail meanwhile. When the
+    queue is full the sender waits up to ``MAIL_QUEUE_PUT_TIMEOUT`` seconds for
+    room and then drops the message. The counts of queued, sent, retried,
+    failed and dropped messages are kept in ``stats()``. Queued mail is
+    delivered at exit for up to ``MAIL_QUEUE_SHUTDOWN_TIMEOUT`` seconds.
+    """
+
+    def __init__(self, app=None):
+        # the queues of every app, delivered at exit by a single handler
+        self._states = weakref.WeakSet()
+        atexit.register(self._flush_at_exit)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MAIL_QUEUE_WORKERS', 2)
+        app.config.setdefault('MAIL_QUEUE_SIZE', 100)
+        app.config.setdefault('MAIL_QUEUE_BATCH', 20)
+        app.config.setdefault('MAIL_QUEUE_RETRIES', 3)
+        app.config.setdefault('MAIL_QUEUE_BACKOFF', 2)
+        app.config.setdefault('MAIL_QUEUE_PUT_TIMEOUT', 1)
+        app.config.setdefault('MAIL_QUEUE_SHUTDOWN_TIMEOUT', 10)
+        app.extensions['mail_queue'] = state = _State(app)
+        self._states.add(state)
+
+    def enqueue(self, msg):
+        state = current_app.extensions['mail_queue']
+        self._start_workers(state)
+        try:
+            state.queue.put((msg, 0), timeout=current_app.config['MAIL_QUEUE_PUT_TIMEOUT'])
+        except queue.Full:
+            self._count(state, 'dropped')
+            current_app.logger.warning('Mail queue full, dropped message to %s',
+                                       ', '.join(msg.send_to))
+            return False
+        self._count(state, 'queued')
+        return True
+
+    def stats(self):
+        state = current_app.extensions['mail_queue']
+        with state.lock:
+            stats = dict(state.stats)
+        stats['waiting'] = state.queue.qsize()
+        return stats
+
+    def flush(self, timeout=None):
+        """Wait until every queued message has been handled; returns ``False``
+        if ``timeout`` ran out first."""
+        return self._wait(current_app.extensions['mail_queue'], timeout)
+
+    def _wait(self, state, timeout):
+        deadline = None if timeout is None else time.time() + timeout
+        with state.queue.all_tasks_done:
+            while state.queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                state.queue.all_tasks_done.wait(remaining)
+        return True
+
+    def _count(self, state, key, n=1):
+        with state.lock:
+            state.stats[key] += n
+
+    def _start_workers(self, state):
+        # started lazily so that each forked server worker gets its own pool
+        with state.lock:
+            if state.pid == os.getpid():
+                return
+            state.pid = os.getpid()
+            state.workers = [
+                threading.Thread(target=self._work, args=(state,), daemon=True)
+                for i in range(state.app.config['MAIL_QUEUE_WORKERS'])]
+        for worker in state.workers:
+            worker.start()
+
+    def _work(self, state):
+        batch_size = state.app.config['MAIL_QUEUE_BATCH']
+        while True:
+            batch = [state.queue.get()]
+            while len(batch) < batch_size:
+                try:
+                    batch.append(state.queue.get_nowait())
+                except queue.Empty:
+                    break
+            retry = []
+            try:
+                with state.app.app_context():
+                    retry = self._send_batch(state, batch)
+            except Exception:
+                state.app.logger.exception('Mail worker failed')
+            # a message waiting for its retry stays unfinished, so flush()
+            # waits for it too
+            for i in range(len(batch) - len(retry)):
+                state.queue.task_done()
+            for msg, attempts in retry:
+                self._schedule(state, msg, attempts)
+
+    def _schedule(self, state, msg, attempts):
+        """Queue a message again after its backoff, without holding up the
+        worker in the meantime."""
+        def requeue():
+            state.queue.put((msg, attempts))
+            state.queue.task_done()
+        self._count(state, 'retried')
+        timer = threading.Timer(
+            state.app.config['MAIL_QUEUE_BACKOFF'] * 2 ** (attempts - 1), requeue)
+        timer.daemon = True
+        timer.start()
+
+    def _send_batch(self, state, batch):
+        """Send a batch of ``(message, attempts)`` over one connection;
+        returns the ones to try again later."""
+        retry, error, handled = [], None, 0
+        connection = None
+        try:
+            with state.app.extensions['mail'].connect() as connection:
+                for msg, attempts in batch:
+                    try:
+                        connection.send(msg)
+                    except (smtplib.SMTPException, OSError) as e:
+                        if not is_permanent(e):
+                            # the connection may be unusable now, so the
+                            # rest of the batch goes out on a new one
+                            retry, error = [(msg, attempts + 1)] + \
+                                [(m, a + 1) for m, a in batch[handled + 1:]], e
+                            break
+                        self._count(state, 'failed')
+                        state.app.logger.error('Mail to %s rejected: %r',
+                                               ', '.join(msg.send_to), e)
+                    else:
+                        self._count(state, 'sent')
+                    handled += 1
+        except (smtplib.SMTPException, OSError) as e:
+            if not retry and handled < len(batch):
+                # could not connect
+                retry, error = [(m, a + 1) for m, a in batch[handled:]], e
+            # otherwise only saying goodbye failed
+            if connection is not None and connection.host is not None:
+                connection.host.close()
+
+        pending = []
+        for msg, attempts in retry:
+            if attempts > state.app.config['MAIL_QUEUE_RETRIES']:
+                self._count(state, 'failed')
+                state.app.logger.error('Giving up on mail to %s: %r',
+                                       ', '.join(msg.send_to), error)
+            else:
+                pending.append((msg, attempts))
+        return pending
+
+    def _flush_at_exit(self):
+        for state in list(self._states):
+            if state.pid == os.getpid() and not self._wait(
+                    state, state.app.config['MAIL_QUEUE_SHUTDOWN_TIMEOUT']):
+                state.app.logger.warning('Exiting with %d messages still queued',
+                                         state.queue.qsize())
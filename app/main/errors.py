@@ -1,4 +1,4 @@
-from flask import render_template, request, jsonify
+from flask import render_template, request, jsonify, make_response
 from . import main
 
 
@@ -31,6 +31,19 @@ def forbidden(e):
     return render_template('418.html'), 418
 
 
+@main.app_errorhandler(429)
+def too_many_requests(e):
+    if request.accept_mimetypes.accept_json and \
+            not request.accept_mimetypes.accept_html:
+        response = jsonify({'error': 'too many requests'})
+        response.status_code = 429
+    else:
+        response = make_response(render_template('429.html'), 429)
+    if getattr(e, 'retry_after', None):
+        response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+
 @main.app_errorhandler(500)
 def internal_server_error(e):
     if request.accept_mimetypes.accept_json and \
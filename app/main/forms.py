@@ -1,8 +1,9 @@
 from flask_wtf import FlaskForm
 from flask_wtf.html5 import URLField, EmailField
 from flask_pagedown.fields import PageDownField
-from wtforms import TextAreaField, SubmitField, StringField, BooleanField, SelectField, ValidationError, IntegerField, RadioField
-from wtforms.validators import DataRequired, Length, Email, Regexp
+from wtforms import TextAreaField, SubmitField, StringField, BooleanField, SelectField, ValidationError, IntegerField, RadioField, \
+    DateTimeField
+from wtforms.validators import DataRequired, Length, Email, Regexp, Optional
 from ..models import Role, User, Category, Comment
 
 
@@ -65,6 +66,12 @@ class CommentForm(FlaskForm):
                 raise ValidationError("回复出错")
 
 
-
-
-
+class ModerateForm(FlaskForm):
+    post_id = IntegerField('文章ID', validators=[Optional()])
+    email = StringField('邮箱', validators=[Optional(), Length(1, 64)])
+    url = StringField('网址', validators=[Optional(), Length(1, 64)])
+    since = DateTimeField('起始时间', format='%Y-%m-%d %H:%M', validators=[Optional()])
+    until = DateTimeField('截止时间', format='%Y-%m-%d %H:%M', validators=[Optional()])
+    pending = BooleanField('仅待审核')
+    enable = SubmitField('恢复')
+    disable = SubmitField('屏蔽')
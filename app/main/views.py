@@ -1,25 +1,19 @@
-import time
-from flask import render_template, request, redirect, url_for, flash, current_app, abort, session, Response
+from flask import render_template, request, redirect, url_for, flash, current_app, abort, \
+    jsonify
 from flask_login import current_user, login_required
-from sqlalchemy import or_
+from sqlalchemy.orm import joinedload
 
 from . import main
-from .. import db
-from ..models import User, Role, Permission, Post, Comment, Category
-from .forms import EditProfileForm, EditProfileAdminForm, PostForm, CommentForm
+from .. import db, page_cache, rate_limiter, query_stats
+from ..models import User, Role, Permission, Post, Comment, Category, PageVersion
+from .forms import EditProfileForm, EditProfileAdminForm, PostForm, CommentForm, ModerateForm
 from ..decorators import admin_required, permission_required
-from flask_sqlalchemy import get_debug_queries
-from collections import defaultdict
-
-@main.after_app_request
-def after_request(response):
-    for query in get_debug_queries():
-        if query.duration >= current_app.config['FLASKY_SLOW_DB_QUERY_TIME']:
-            current_app.logger.warning(
-                'Slow query: %s\nParameters: %s\nDuration: %fs\nContext: %s\n'
-                % (query.statement, query.parameters, query.duration,
-                   query.context))
-    return response
+from ..exceptions import ValidationError
+from ..listing import paginate_posts, paginate_comments, post_version
+from ..archive import archive_years
+from ..search import search_posts
+from ..replicas import primary
+
 
 @main.route('/shutdown')
 def server_shutdown():
@@ -33,14 +27,13 @@ def server_shutdown():
 
 
 @main.route('/', methods=['GET', 'POST'])
+@page_cache.cached(lambda: PageVersion.current('index'))
 def index():
     page = request.args.get("page", 1, type=int)
-    pagination = Post.query.order_by(Post.timestamp.desc()).paginate(page,
-                                                                per_page=current_app.config["FLASKY_POSTS_PER_PAGE"],
-                                                                error_out=False)
+    pagination = paginate_posts(Post.query.order_by(Post.timestamp.desc()), page)
     posts = pagination.items
 
-    categories = Category.query.all()
+    categories = Category.post_counts()
     return render_template('index.html', posts=posts, pagination=pagination, categories=categories)
 
 
@@ -48,9 +41,8 @@ def index():
 def user(username):
     user = User.query.filter_by(username=username).first_or_404()
     page = request.args.get('page', 1, type=int)
-    pagination = user.posts.order_by(Post.timestamp.desc()).paginate(
-        page, per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
-        error_out=False)
+    pagination = paginate_posts(
+        user.posts.order_by(Post.timestamp.desc()), page)
     posts = pagination.items
     return render_template('user.html', user=user, posts=posts,
                            pagination=pagination)
@@ -95,17 +87,12 @@ def edit_profile_admin(id):
 
 
 @main.route('/post/<int:id>', methods=['GET'])
+@page_cache.cached(post_version)
 def post(id):
     post = Post.query.get_or_404(id)
     form = CommentForm()
     page = request.args.get('page', 1, type=int)
-
-    if page == -1:
-        page = (post.comments.count() - 1) // \
-               current_app.config['FLASKY_COMMENTS_PER_PAGE'] + 1
-    pagination = post.comments.order_by(Comment.timestamp.asc()).paginate(
-        page, per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
-        error_out=False)
+    pagination = paginate_comments(post, page)
     comments = pagination.items
     return render_template('post.html', post=post, postForm=form,
                            comments=comments, pagination=pagination)
@@ -150,6 +137,7 @@ def edit(id):
 
 
 @main.route('/delete/<int:id>')
+@primary
 @login_required
 def delete_post(id):
     post = Post.query.get_or_404(id)
@@ -167,15 +155,45 @@ def delete_post(id):
 @permission_required(Permission.MODERATE)
 def moderate():
     page = request.args.get('page', 1, type=int)
-    pagination = Comment.query.order_by(Comment.timestamp.desc()).paginate(
-        page, per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
-        error_out=False)
+    pending = request.args.get('pending', 0, type=int)
+    query = Comment.query
+    if pending:
+        query = query.filter(Comment.pending())
+    pagination = query.options(joinedload(Comment.replay)) \
+        .order_by(Comment.timestamp.desc()).paginate(
+            page, per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
+            error_out=False)
     comments = pagination.items
-    return render_template('moderate.html', comments=comments,
-                           pagination=pagination, page=page)
+    return render_template('moderate.html', comments=comments, form=ModerateForm(),
+                           pagination=pagination, page=page, pending=pending)
+
+
+@main.route('/moderate/bulk', methods=['POST'])
+@login_required
+@permission_required(Permission.MODERATE)
+def moderate_bulk():
+    form = ModerateForm()
+    if form.validate_on_submit():
+        try:
+            condition = Comment.selection(
+                ids=request.form.getlist('ids', type=int), post_id=form.post_id.data,
+                email=form.email.data, url=form.url.data, since=form.since.data,
+                until=form.until.data, pending=form.pending.data)
+        except ValidationError:
+            flash('请选择评论或填写筛选条件')
+        else:
+            count = Comment.moderate(condition, disabled=form.disable.data)
+            db.session.commit()
+            flash('已%s %d 条评论' % ('屏蔽' if form.disable.data else '恢复', count))
+    else:
+        flash('筛选条件有误')
+    return redirect(url_for('.moderate',
+                            page=request.args.get('page', 1, type=int),
+                            pending=request.args.get('pending', 0, type=int)))
 
 
 @main.route('/moderate/enable/<int:id>')
+@primary
 @login_required
 @permission_required(Permission.MODERATE)
 def moderate_enable(id):
@@ -184,10 +202,12 @@ def moderate_enable(id):
     db.session.add(comment)
     db.session.commit()
     return redirect(url_for('.moderate',
-                            page=request.args.get('page', 1, type=int)))
+                            page=request.args.get('page', 1, type=int),
+                            pending=request.args.get('pending', 0, type=int)))
 
 
 @main.route('/moderate/disable/<int:id>')
+@primary
 @login_required
 @permission_required(Permission.MODERATE)
 def moderate_disable(id):
@@ -196,53 +216,46 @@ def moderate_disable(id):
     db.session.add(comment)
     db.session.commit()
     return redirect(url_for('.moderate',
-                            page=request.args.get('page', 1, type=int)))
+                            page=request.args.get('page', 1, type=int),
+                            pending=request.args.get('pending', 0, type=int)))
 
 
 @main.route('/category/<int:id>')
+@page_cache.cached(lambda id: PageVersion.current('category:%d' % id))
 def category(id):
     category = Category.query.get_or_404(id)
     page = request.args.get('page', 1, type=int)
-    pagination = category.posts.order_by(Post.timestamp.desc()).paginate(
-        page, per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
-        error_out=False
-    )
+    pagination = paginate_posts(
+        category.posts.order_by(Post.timestamp.desc()), page)
     posts = pagination.items
     return render_template('category.html', category=category, posts=posts, pagination=pagination)
 
 @main.route('/archive')
+@page_cache.cached(lambda: PageVersion.current('archive'))
 def archive():
-    years = defaultdict(dict)
-    posts = Post.query.all()
-    for post in posts:
-        create_time = post.timestamp
-        year = create_time.year
-        month = create_time.month
-        day = create_time.day
-        date = "%s-%s" % (month, day)
-
-        months = years[year]
-        dateDict = months.setdefault(month, {})
-        postList = dateDict.setdefault(date, [])
-        postList.append(post)
+    return render_template('archive.html', years=archive_years())
+
+
+@main.route('/archive/<int:year>')
+@page_cache.cached(lambda year: PageVersion.current('archive:%d' % year))
+def archive_year(year):
+    years = archive_years(year)
+    if not years:
+        abort(404)
     return render_template('archive.html', years=years)
 
 
 @main.route('/comment/<int:id>', methods=['POST'])
+@rate_limiter.limit('RATELIMIT_COMMENT', key='ip')
+@rate_limiter.limit('RATELIMIT_COMMENT_TOTAL', key='endpoint')
 def add_comment(id):
     if not current_user.can(Permission.COMMENT):
         abort(403)
-    now_time = time.time()
-    last_time = session.get("last_comment_time")
-    if last_time and now_time - last_time < 60:
-        abort(Response('发言太频繁'))
-
-    session['last_comment_time'] = now_time
     post = Post.query.get_or_404(id)
     form = CommentForm()
     replay_id = form.replay_id.data
     if replay_id:
-        Comment.query.get_or_404(replay_id)
+        Comment.query.filter_by(id=replay_id, post_id=post.id).first_or_404()
 
     comment = Comment(body=form.body.data,
                       post=post,
@@ -259,16 +272,21 @@ def add_comment(id):
 @main.route('/search/')
 def search():
     key_word = request.args.get('keyWord', "")
-    key_word = "%" + key_word + "%"
     page = request.args.get("page", 1, type=int)
-    pagination = Post.query.filter(or_(Post.title.like(key_word), Post.summary.like(key_word)))\
-        .order_by(Post.timestamp.desc())\
-        .paginate(page,per_page=current_app.config["FLASKY_POSTS_PER_PAGE"],error_out=False)
+    pagination = search_posts(key_word, page)
     posts = pagination.items
-    categories = Category.query.all()
-    return render_template('index.html', posts=posts, pagination=pagination, categories=categories)
+    categories = Category.post_counts()
+    return render_template('index.html', posts=posts, pagination=pagination, categories=categories,
+                           endpoint='.search', endpoint_args={'keyWord': key_word})
 
 
 @main.route('/about')
 def about():
-    return render_template('about.html')
\ No newline at end of file
+    return render_template('about.html')
+
+
+@main.route('/db-stats')
+@login_required
+@admin_required
+def db_stats():
+    return jsonify(query_stats.snapshot())
@@ -3,12 +3,13 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin, AnonymousUserMixin
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from flask import current_app, request, url_for
-from markdown import markdown
-from . import login_manager
+from . import login_manager, cache, last_seen_tracker, renderer, identity_cache
 from app.exceptions import ValidationError
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
 from datetime import datetime
+from collections import Counter
 import hashlib
-import bleach
 
 
 class Role(db.Model):
@@ -75,7 +76,10 @@ class User(UserMixin, db.Model):
     join_time = db.Column(db.DateTime(), default=datetime.utcnow)
     last_seen = db.Column(db.DateTime(), default=datetime.utcnow)
     avatar_hash = db.Column(db.String(32))
+    post_count = db.Column(db.Integer, default=0)
     posts = db.relationship('Post', backref='author', lazy='dynamic')
+    # the role's permissions, when the user was restored from the identity cache
+    cached_permissions = None
 
 
     def __init__(self, **kwargs):
@@ -94,10 +98,20 @@ class User(UserMixin, db.Model):
 
     @password.setter
     def password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = generate_password_hash(
+            password, method=current_app.config['PASSWORD_HASH_METHOD'])
 
     def verify_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        if not check_password_hash(self.password_hash, password):
+            return False
+        # with PASSWORD_REHASH on, hashes made with another method or cost
+        # are upgraded the next time the password is given; the caller
+        # commits the new hash
+        if current_app.config['PASSWORD_REHASH'] and \
+                self.password_hash.split('$', 1)[0] != current_app.config['PASSWORD_HASH_METHOD']:
+            self.password = password
+            db.session.add(self)
+        return True
 
     def generate_confirmation_token(self, expiration=3600):
         s = Serializer(current_app.config['SECRET_KEY'], expiration)
@@ -161,15 +175,19 @@ class User(UserMixin, db.Model):
             self.avatar_hash = self.gravatar_hash()
 
     def can(self, perm):
+        if self.cached_permissions is not None:
+            return self.cached_permissions & perm == perm
         return self.role is not None and self.role.has_permission(perm)
 
     def is_administrator(self):
         return self.can(Permission.ADMIN)
 
     def ping(self):
-        self.last_seen = datetime.utcnow()
-        db.session.add(self)
-        db.session.commit()
+        # last_seen is written in batches by the tracker, so the change is
+        # kept out of the session
+        now = datetime.utcnow()
+        set_committed_value(self, 'last_seen', now)
+        last_seen_tracker.touch(self.id, now)
 
     def gravatar(self, size=100, default='identicon', rating='g'):
         if request.is_secure:
@@ -191,10 +209,16 @@ class User(UserMixin, db.Model):
             'join_time': self.join_time,
             'last_seen': self.last_seen,
             'posts_url': url_for('api.get_user_posts', id=self.id),
-            'post_count': self.posts.count()
+            'post_count': self.post_count
         }
         return json_user
 
+    @staticmethod
+    def recount():
+        count = db.select([db.func.count(Post.id)]) \
+            .where(Post.author_id == User.id).as_scalar()
+        db.session.execute(User.__table__.update().values(post_count=count))
+
     def generate_auth_token(self, expiration):
         s = Serializer(current_app.config['SECRET_KEY'],
                        expires_in=expiration)
@@ -202,12 +226,11 @@ class User(UserMixin, db.Model):
 
     @staticmethod
     def verify_auth_token(token):
-        s = Serializer(current_app.config['SECRET_KEY'])
         try:
-            data = s.loads(token)
+            data = identity_cache.serializer().loads(token)
         except:
             return None
-        return User.query.get(data['id'])
+        return identity_cache.get(data['id'])
 
     def __repr__(self):
         return '<User %r>' % self.username
@@ -237,20 +260,29 @@ class Post(db.Model):
     __tablename__ = "posts"
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(64))
-    category_id = db.Column(db.Integer, db.ForeignKey('categories.id'))
+    # the previous values are needed to bump the versions of the category
+    # and archive pages a post leaves
+    category_id = db.column_property(db.Column(db.Integer, db.ForeignKey('categories.id')),
+                                     active_history=True)
     summary = db.Column(db.Text)
     body = db.Column(db.Text)
     body_html = db.Column(db.Text)
-    timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
-    update_time = db.Column(db.DateTime, default=datetime.utcnow)
+    toc_html = db.Column(db.Text)
+    timestamp = db.column_property(db.Column(db.DateTime, index=True, default=datetime.utcnow),
+                                   active_history=True)
+    update_time = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    comment_count = db.Column(db.Integer, default=0)
     comments = db.relationship('Comment', backref='post', lazy='dynamic')
 
 
 
     @staticmethod
     def on_changed_body(target, value, oldvalue, initiator):
-        target.body_html = bleach.linkify(markdown(value, extensions=["extra"]))
+        columns = renderer.render('post', value)
+        target.body_html = columns and columns['body_html']
+        target.toc_html = columns and columns['toc_html']
+        target.render_pending = columns is None
 
     def to_json(self):
         json_post = {
@@ -260,10 +292,25 @@ class Post(db.Model):
             'timestamp': self.timestamp,
             'author_url': url_for('api.get_user', id=self.author_id),
             'comments_url': url_for('api.get_post_comments', id=self.id),
-            'comment_count': self.comments.count()
+            'comment_count': self.comment_count
         }
         return json_post
 
+    @staticmethod
+    def recount(ids=None):
+        count = db.select([db.func.count(Comment.id)]) \
+            .where(Comment.post_id == Post.id) \
+            .where(Comment.visible()).as_scalar()
+        stmt = Post.__table__.update().values(comment_count=count)
+        categories = db.session.query(Post.category_id).distinct()
+        if ids is not None:
+            stmt = stmt.where(Post.id.in_(ids))
+            categories = categories.filter(Post.id.in_(ids))
+        db.session.execute(stmt)
+        # the listings show the counts
+        PageVersion.bump(db.session, ['index'] + ['category:%d' % id for id, in categories
+                                                  if id is not None])
+
     @staticmethod
     def from_json(json_post):
         body = json_post.get('body')
@@ -277,25 +324,82 @@ db.event.listen(Post.body, 'set', Post.on_changed_body)
 
 class Comment(db.Model):
     __tablename__ = 'comments'
+    # the moderation queue: pending comments, newest first
+    __table_args__ = (db.Index('ix_comments_disabled_timestamp', 'disabled', 'timestamp'),)
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
     body_html = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
-    disabled = db.Column(db.Boolean)
+    update_time = db.Column(db.DateTime, index=True, default=datetime.utcnow,
+                            onupdate=datetime.utcnow)
+    # the previous value is needed to keep Post.comment_count exact
+    disabled = db.column_property(db.Column(db.Boolean), active_history=True)
     user_name = db.Column(db.String(64))
     email = db.Column(db.String(64))
     url = db.Column(db.String(64))
     post_id = db.Column(db.Integer, db.ForeignKey('posts.id'))
     replay_id = db.Column(db.Integer, db.ForeignKey('comments.id'))
     replay = db.relationship("Comment", remote_side=[id])
+    # thread index: the top-level comment a reply belongs to (None for a
+    # top-level comment) and how deep it is nested
+    root_id = db.Column(db.Integer, index=True)
+    depth = db.Column(db.Integer, default=0, server_default='0')
 
     @staticmethod
     def on_changed_body(target, value, oldvalue, initiator):
-        allowed_tags = ['a', 'abbr', 'acronym', 'b', 'code', 'em', 'i',
-                        'strong']
-        target.body_html = bleach.linkify(bleach.clean(
-            markdown(value, output_format='html'),
-            tags=allowed_tags, strip=True))
+        columns = renderer.render('comment', value)
+        target.body_html = columns and columns['body_html']
+        target.render_pending = columns is None
+
+    @staticmethod
+    def visible():
+        return db.or_(Comment.disabled == None, Comment.disabled == False)
+
+    @staticmethod
+    def pending():
+        """Comments no moderator has enabled or disabled yet."""
+        return Comment.disabled == None
+
+    @staticmethod
+    def selection(ids=None, post_id=None, email=None, url=None, since=None,
+                  until=None, pending=False):
+        """The condition selecting comments for bulk moderation; at least one
+        criterion must be given."""
+        conditions = []
+        if ids:
+            conditions.append(Comment.id.in_(ids))
+        if post_id is not None:
+            conditions.append(Comment.post_id == post_id)
+        if email:
+            conditions.append(Comment.email == email)
+        if url:
+            conditions.append(Comment.url == url)
+        if since is not None:
+            conditions.append(Comment.timestamp >= since)
+        if until is not None:
+            conditions.append(Comment.timestamp < until)
+        if not conditions:
+            raise ValidationError('no comments selected')
+        if pending:
+            conditions.append(Comment.pending())
+        return db.and_(*conditions)
+
+    @staticmethod
+    def moderate(condition, disabled):
+        """Enable or disable every comment matching ``condition`` with a
+        single UPDATE and return how many were matched.
+
+        The UPDATE bypasses the session, so the comment counts of the posts
+        involved are recounted here.
+        """
+        post_ids = [post_id for post_id, in db.session.query(Comment.post_id)
+                    .filter(condition).distinct()]
+        if not post_ids:
+            return 0
+        count = Comment.query.filter(condition) \
+            .update({Comment.disabled: disabled}, synchronize_session=False)
+        Post.recount([post_id for post_id in post_ids if post_id is not None])
+        return count
 
     def to_json(self):
         json_comment = {
@@ -335,12 +439,317 @@ class Category(db.Model):
                 db.session.add(post_category)
         db.session.commit()
 
+    @staticmethod
+    def post_counts():
+        """Categories that have posts, with their post count, for the sidebar."""
+        counts = cache.get('category_post_counts')
+        if counts is None:
+            with db.primary_reads():
+                rows = db.session.query(Category.id, Category.name, db.func.count(Post.id)) \
+                    .join(Post, Post.category_id == Category.id) \
+                    .group_by(Category.id, Category.name) \
+                    .order_by(Category.id).all()
+            counts = [{'id': id, 'name': name, 'post_count': post_count}
+                      for id, name, post_count in rows]
+            cache.set('category_post_counts', counts)
+        return counts
+
     def __repr__(self):
         return '<Category %r>' % self.name
 
 
+class PageVersion(db.Model):
+    """A counter for a cached listing page: ``index``, ``category:<id>``,
+    ``archive`` or ``archive:<year>``. It is bumped in the transaction that
+    changes what the page shows, so the page is validated by reading one
+    row by primary key."""
+    __tablename__ = 'page_versions'
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    update_time = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    # dialect name -> statement bumping a version, creating its row if needed
+    upserts = {
+        'sqlite': 'INSERT INTO page_versions (name, version, update_time) '
+                  'VALUES (:name, 1, :now) ON CONFLICT (name) DO UPDATE SET '
+                  'version = page_versions.version + 1, update_time = excluded.update_time',
+        'postgresql': 'INSERT INTO page_versions (name, version, update_time) '
+                      'VALUES (:name, 1, :now) ON CONFLICT (name) DO UPDATE SET '
+                      'version = page_versions.version + 1, update_time = excluded.update_time',
+        'mysql': 'INSERT INTO page_versions (name, version, update_time) '
+                 'VALUES (:name, 1, :now) ON DUPLICATE KEY UPDATE '
+                 'version = version + 1, update_time = VALUES(update_time)',
+    }
+
+    @staticmethod
+    def bump(session, names):
+        # in a fixed order, so that concurrent writers lock the rows alike
+        names = sorted(set(names))
+        if not names:
+            return
+        now = datetime.utcnow()
+        table = PageVersion.__table__
+        upsert = PageVersion.upserts.get(session.get_bind(PageVersion.__mapper__).dialect.name)
+        if upsert is not None:
+            session.execute(db.text(upsert), [{'name': name, 'now': now} for name in names])
+            return
+        session.execute(table.update().where(table.c.name.in_(names))
+                        .values(version=table.c.version + 1, update_time=now))
+        existing = {name for name, in session.execute(
+            db.select([table.c.name]).where(table.c.name.in_(names)))}
+        missing = [name for name in names if name not in existing]
+        if missing:
+            session.execute(table.insert(), [{'name': name, 'version': 1, 'update_time': now}
+                                             for name in missing])
+
+    @staticmethod
+    def current(*names):
+        """The versions and update times of the named pages, flattened into
+        one tuple for ``PageCache.cached``."""
+        rows = db.session.query(PageVersion.name, PageVersion.version,
+                                PageVersion.update_time) \
+            .filter(PageVersion.name.in_(names)).order_by(PageVersion.name)
+        return tuple(value for row in rows for value in row)
+
+
 db.event.listen(Comment.body, 'set', Comment.on_changed_body)
 
+
+# Post.comment_count and User.post_count are denormalized counters. Comments
+# and posts that are deleted or re-moderated are counted in before_flush, while
+# their rows are still there; new ones in after_flush, once their foreign keys
+# are set. The counters are then bumped with relative UPDATEs so concurrent
+# writers never overwrite each other.
+def _count_delta(counters, obj, delta):
+    if isinstance(obj, Comment):
+        if obj.post_id is not None:
+            counters[(Post, obj.post_id)] += delta
+    elif isinstance(obj, Post):
+        if obj.author_id is not None:
+            counters[(User, obj.author_id)] += delta
+
+
+def count_before_flush(session, flush_context, instances):
+    counters = session.info.setdefault('counters', Counter())
+    for obj in session.deleted:
+        if not isinstance(obj, Comment) or not obj.disabled:
+            _count_delta(counters, obj, -1)
+    for obj in session.dirty:
+        if isinstance(obj, Comment) and obj not in session.deleted:
+            history = db.inspect(obj).attrs.disabled.history
+            if not history.added:
+                continue
+            was_disabled = bool(history.deleted and history.deleted[0])
+            if was_disabled != bool(obj.disabled):
+                _count_delta(counters, obj, -1 if obj.disabled else 1)
+
+
+def count_after_flush(session, flush_context):
+    counters = session.info.pop('counters', Counter())
+    for obj in session.new:
+        if not isinstance(obj, Comment) or not obj.disabled:
+            _count_delta(counters, obj, 1)
+    columns = {Post: Post.comment_count, User: User.post_count}
+    for (model, id), delta in counters.items():
+        if delta:
+            column = columns[model]
+            session.execute(model.__table__.update()
+                            .where(model.id == id)
+                            .values({column.key: column + delta}))
+    session.info['recounted'] = [key for key, delta in counters.items() if delta]
+
+
+def count_after_flush_postexec(session, flush_context):
+    for model, id in session.info.pop('recounted', []):
+        obj = session.identity_map.get(identity_key(model, id))
+        if obj is not None:
+            session.expire(obj, ['comment_count' if model is Post else 'post_count'])
+
+
+# Replies are placed in their thread before they are inserted, from the
+# comment they answer.
+def thread_before_flush(session, flush_context, instances):
+    for obj in session.new:
+        if not isinstance(obj, Comment) or obj.root_id is not None:
+            continue
+        parent = obj.replay
+        if parent is None and obj.replay_id is not None:
+            with session.no_autoflush:
+                parent = session.query(Comment).get(obj.replay_id)
+        if parent is not None and parent.id is not None:
+            obj.root_id = parent.root_id or parent.id
+            obj.depth = (parent.depth or 0) + 1
+
+
+# The category sidebar is dropped from the cache once a transaction that
+# adds, deletes or re-categorizes a post (or renames a category) commits.
+def _category_changed(obj):
+    state = db.inspect(obj)
+    if isinstance(obj, Post):
+        return state.attrs.category_id.history.has_changes() or \
+            state.attrs.category.history.has_changes()
+    return state.attrs.name.history.has_changes()
+
+
+def category_before_flush(session, flush_context, instances):
+    for obj in session.new | session.deleted:
+        if isinstance(obj, (Post, Category)):
+            session.info['category_changed'] = True
+            return
+    for obj in session.dirty:
+        if isinstance(obj, (Post, Category)) and _category_changed(obj):
+            session.info['category_changed'] = True
+            return
+
+
+def category_after_commit(session):
+    if session.info.pop('category_changed', False):
+        cache.delete('category_post_counts')
+
+
+def category_after_rollback(session, previous_transaction):
+    session.info.pop('category_changed', None)
+
+
+# Bodies that missed the render cache are handed to the render pool once
+# the rows holding them are committed.
+def render_after_flush(session, flush_context):
+    jobs = session.info.setdefault('render_jobs', [])
+    for obj in session.new | session.dirty:
+        if getattr(obj, 'render_pending', False):
+            obj.render_pending = False
+            kind = 'post' if isinstance(obj, Post) else 'comment'
+            jobs.append((kind, type(obj), obj.id, obj.body))
+
+
+def render_after_commit(session):
+    for kind, model, id, body in session.info.pop('render_jobs', []):
+        renderer.submit(kind, model, id, body)
+
+
+def render_after_rollback(session, previous_transaction):
+    session.info.pop('render_jobs', None)
+
+
+# Cached identities are dropped once a change to who a user is or what
+# they may do is committed.
+def identity_after_flush(session, flush_context):
+    changed = session.info.setdefault('identities_changed', set())
+    for obj in session.dirty | session.deleted:
+        if isinstance(obj, User):
+            state = db.inspect(obj)
+            if obj in session.deleted or any(
+                    state.attrs[key].history.has_changes()
+                    for key in ('username', 'email', 'confirmed', 'role_id', 'role')):
+                changed.add(obj.id)
+                obj.cached_permissions = None
+        elif isinstance(obj, Role):
+            changed.add(None)
+
+
+def identity_after_commit(session):
+    changed = session.info.pop('identities_changed', None)
+    if changed and None in changed:
+        identity_cache.clear()
+    elif changed:
+        identity_cache.invalidate(*changed)
+
+
+def identity_after_rollback(session, previous_transaction):
+    session.info.pop('identities_changed', None)
+
+
+# The post page and API versions are read from the posts' update_time, so
+# renaming a category or an author marks the posts showing the name as
+# updated.
+def renames_after_flush(session, flush_context):
+    for obj in session.dirty:
+        if isinstance(obj, Category) and \
+                db.inspect(obj).attrs.name.history.has_changes():
+            condition = Post.category_id == obj.id
+        elif isinstance(obj, User) and \
+                db.inspect(obj).attrs.username.history.has_changes():
+            condition = Post.author_id == obj.id
+        else:
+            continue
+        session.execute(Post.__table__.update().where(condition)
+                        .values(update_time=datetime.utcnow()))
+
+
+# The versions of the listing pages are bumped for the posts added, removed
+# or changed in a column the listings show, in the category and archive
+# year they were in and are now in, and for the posts whose comment count
+# or author's name changed.
+LISTED_ATTRIBUTES = ('title', 'summary', 'timestamp', 'category_id', 'category',
+                     'author_id', 'author')
+ARCHIVED_ATTRIBUTES = ('title', 'timestamp')
+
+
+def _changed(obj, keys):
+    state = db.inspect(obj)
+    return any(state.attrs[key].history.has_changes() for key in keys)
+
+
+def _previous(obj, key):
+    return [value for value in db.inspect(obj).attrs[key].history.deleted or ()
+            if value is not None]
+
+
+def pages_after_flush(session, flush_context):
+    pages = set()
+    commented = set()
+    authors = set()
+    for obj in session.new | session.dirty | session.deleted:
+        added_or_deleted = obj in session.new or obj in session.deleted
+        if isinstance(obj, Post):
+            if added_or_deleted or _changed(obj, LISTED_ATTRIBUTES):
+                category_ids = {obj.category_id} | set(_previous(obj, 'category_id')) | \
+                    {category.id for category in _previous(obj, 'category')}
+                pages.add('index')
+                pages.update('category:%d' % id for id in category_ids if id is not None)
+            if added_or_deleted or _changed(obj, ARCHIVED_ATTRIBUTES):
+                timestamps = [obj.timestamp] + _previous(obj, 'timestamp')
+                pages.add('archive')
+                pages.update('archive:%d' % timestamp.year for timestamp in timestamps
+                             if timestamp is not None)
+        elif isinstance(obj, Comment):
+            if added_or_deleted or _changed(obj, ('disabled',)):
+                commented.add(obj.post_id)
+        elif isinstance(obj, Category):
+            if not added_or_deleted and _changed(obj, ('name',)):
+                pages.update(('index', 'category:%d' % obj.id))
+        elif isinstance(obj, User):
+            if not added_or_deleted and _changed(obj, ('username',)):
+                authors.add(obj.id)
+    commented.discard(None)
+    conditions = []
+    if commented:
+        conditions.append(Post.id.in_(commented))
+    if authors:
+        conditions.append(Post.author_id.in_(authors))
+    if conditions:
+        pages.add('index')
+        pages.update('category:%d' % id for id, in session.query(Post.category_id)
+                     .filter(db.or_(*conditions)).distinct() if id is not None)
+    PageVersion.bump(session, pages)
+
+
+db.event.listen(db.session, 'before_flush', thread_before_flush)
+db.event.listen(db.session, 'before_flush', count_before_flush)
+db.event.listen(db.session, 'before_flush', category_before_flush)
+db.event.listen(db.session, 'after_commit', category_after_commit)
+db.event.listen(db.session, 'after_soft_rollback', category_after_rollback)
+db.event.listen(db.session, 'after_flush', render_after_flush)
+db.event.listen(db.session, 'after_commit', render_after_commit)
+db.event.listen(db.session, 'after_soft_rollback', render_after_rollback)
+db.event.listen(db.session, 'after_flush', renames_after_flush)
+db.event.listen(db.session, 'after_flush', pages_after_flush)
+db.event.listen(db.session, 'after_flush', identity_after_flush)
+db.event.listen(db.session, 'after_commit', identity_after_commit)
+db.event.listen(db.session, 'after_soft_rollback', identity_after_rollback)
+db.event.listen(db.session, 'after_flush', count_after_flush)
+db.event.listen(db.session, 'after_flush_postexec', count_after_flush_postexec)
+
 login_manager.anonymous_user = AnonymousUser
 
 
@@ -354,4 +763,4 @@ class Permission:
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return identity_cache.get(int(user_id))
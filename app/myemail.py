@@ -1,20 +1,14 @@
-from threading import Thread
 from flask import current_app, render_template
 from flask_mail import Message
-from . import mail
-
-
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
+from . import mail_queue
 
 
 def send_email(to, subject, template, **kwargs):
+    """Render a message and queue it for delivery; returns ``False`` if the
+    queue was full and the message was dropped."""
     app = current_app._get_current_object()
     msg = Message(app.config['FLASKY_MAIL_SUBJECT_PREFIX'] + ' ' + subject,
                   sender=app.config['FLASKY_MAIL_SENDER'], recipients=[to])
     msg.body = render_template(template + '.txt', **kwargs)
     msg.html = render_template(template + '.html', **kwargs)
-    thr = Thread(target=send_async_email, args=[app, msg])
-    thr.start()
-    return thr
+    return mail_queue.enqueue(msg)
@@ -0,0 +1,78 @@
+import hashlib
+from datetime import datetime
+from functools import wraps
+from flask import current_app, request, session, make_response
+from flask_login import current_user
+from flask_wtf.csrf import generate_csrf
+from werkzeug.contrib.cache import SimpleCache
+
+CSRF_PLACEHOLDER = '__csrf_token__'
+
+
+class PageCache(object):
+    """Whole-page cache for anonymous GET requests.
+
+    Each cached view has a version function, which reads from the database,
+    in one query by primary key, a few columns that change whenever the page
+    does: a post's ``update_time`` and its comments' for a post page, the
+    ``PageVersion`` row bumped by the session hooks for a listing. The
+    version gives the ETag, and its latest time the Last-Modified header, so
+    conditional requests are answered with 304 before the view runs,
+    whichever process changed the data. Pages are stored per
+    URL and version for ``PAGE_CACHE_TIMEOUT`` seconds. Logged-in users and
+    requests with pending flashed messages are never served from the cache.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PAGE_CACHE_TIMEOUT', 60)
+        app.config.setdefault('PAGE_CACHE_THRESHOLD', 500)
+        app.extensions['page_cache'] = SimpleCache(
+            threshold=app.config['PAGE_CACHE_THRESHOLD'],
+            default_timeout=app.config['PAGE_CACHE_TIMEOUT'])
+
+    def cached(self, version):
+        """Cache a view for anonymous users; ``version`` gets the view
+        arguments and returns the page's version as a tuple."""
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                if request.method != 'GET' or current_user.is_authenticated \
+                        or session.get('_flashes'):
+                    return f(*args, **kwargs)
+                current = tuple(version(**kwargs))
+                times = [value for value in current if isinstance(value, datetime)]
+                last_modified = max(times) if times else None
+                etag = hashlib.sha1(('%s|%r' % (request.full_path, current))
+                                    .encode('utf-8')).hexdigest()
+                if request.if_none_match.contains_weak(etag) or \
+                        (not request.if_none_match and request.if_modified_since and
+                         last_modified is not None and
+                         request.if_modified_since >= last_modified.replace(microsecond=0)):
+                    response = current_app.response_class(status=304)
+                else:
+                    pages = current_app.extensions['page_cache']
+                    body = pages.get('page:' + etag)
+                    if body is None:
+                        response = make_response(f(*args, **kwargs))
+                        if response.status_code != 200 or response.direct_passthrough:
+                            return response
+                        body = response.get_data(as_text=True)
+                        # every visitor needs a CSRF token for their own session
+                        token = session.get('csrf_token') and generate_csrf()
+                        if token:
+                            body = body.replace(token, CSRF_PLACEHOLDER)
+                        pages.set('page:' + etag, body)
+                    if CSRF_PLACEHOLDER in body:
+                        body = body.replace(CSRF_PLACEHOLDER, generate_csrf())
+                    response = current_app.response_class(body, mimetype='text/html')
+                response.set_etag(etag)
+                response.last_modified = last_modified
+                response.cache_control.no_cache = True
+                response.vary.add('Cookie')
+                return response
+            return decorated_function
+        return decorator
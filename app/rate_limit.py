@@ -0,0 +1,235 @@
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+from flask import current_app, request, session
+from werkzeug.exceptions import TooManyRequests
+
+try:
+    import redis
+except ImportError:  # only needed for a redis:// store
+    redis = None
+
+PERIODS = {
+    'second': 1,
+    'minute': 60,
+    'hour': 3600,
+    'day': 86400,
+}
+
+
+def parse_limit(limit):
+    """Parse a limit such as ``"10/minute"`` into ``(10, 60)``."""
+    try:
+        count, period = limit.split('/')
+        return int(count), PERIODS[period.strip()]
+    except (ValueError, KeyError):
+        raise ValueError('invalid rate limit %r' % limit)
+
+
+class RateLimitExceeded(TooManyRequests):
+    def __init__(self, retry_after):
+        super(RateLimitExceeded, self).__init__()
+        self.retry_after = retry_after
+
+
+class MemoryStore(object):
+    """Counters in the process; every worker counts on its own."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.purged_at = time.time()
+
+    def hit(self, key, previous_key, expires):
+        now = time.time()
+        with self.lock:
+            if now - self.purged_at > 60:
+                self.counters = {k: v for k, v in self.counters.items()
+                                 if v[1] > now}
+                self.purged_at = now
+            count, expiry = self.counters.get(key, (0, 0))
+            count = count + 1 if expiry > now else 1
+            self.counters[key] = count, now + expires
+            previous, expiry = self.counters.get(previous_key, (0, 0))
+        return (previous if expiry > now else 0), count
+
+
+class SQLiteStore(object):
+    """Counters in a SQLite file shared by every worker on the host."""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+
+    def connection(self):
+        # one connection per thread, and a new one after a fork
+        if getattr(self.local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute('CREATE TABLE IF NOT EXISTS rate_limits '
+                               '(key TEXT PRIMARY KEY, count INTEGER, expires REAL)')
+            self.local.connection, self.local.pid = connection, os.getpid()
+        return self.local.connection
+
+    def hit(self, key, previous_key, expires):
+        now = time.time()
+        connection = self.connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute(
+                'INSERT INTO rate_limits (key, count, expires) VALUES (?, 1, ?) '
+                'ON CONFLICT (key) DO UPDATE SET '
+                'count = CASE WHEN expires > ? THEN count + 1 ELSE 1 END, '
+                'expires = excluded.expires', (key, now + expires, now))
+            rows = dict(connection.execute(
+                'SELECT key, count FROM rate_limits '
+                'WHERE key IN (?, ?) AND expires > ?', (key, previous_key, now)))
+            if random.random() < 0.01:
+                connection.execute('DELETE FROM rate_limits WHERE expires <= ?', (now,))
+        return rows.get(previous_key, 0), rows.get(key, 1)
+
+
+class RedisStore(object):
+    """Counters in Redis (or anything speaking its protocol)."""
+
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError('the redis package is needed for %s' % url)
+        self.client = redis.StrictRedis.from_url(url)
+
+    def hit(self, key, previous_key, expires):
+        pipeline = self.client.pipeline()
+        pipeline.incr(key)
+        pipeline.expire(key, int(math.ceil(expires)))
+        pipeline.get(previous_key)
+        count, _, previous = pipeline.execute()
+        return int(previous or 0), count
+
+
+def create_store(url):
+    if url == 'memory://':
+        return MemoryStore()
+    if url.startswith('sqlite:///'):
+        return SQLiteStore(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisStore(url)
+    raise ValueError('unknown rate limit store %r' % url)
+
+
+def ip_key():
+    return 'ip:%s' % request.remote_addr
+
+
+def user_key():
+    """The client as far as it can be told without a database lookup: the
+    API credentials or the logged-in user id in the session, else the IP.
+    Neither is verified yet, so limits keyed on it need an IP-keyed limit
+    next to them."""
+    if request.authorization and request.authorization.username:
+        return 'auth:%s' % request.authorization.username
+    user_id = session.get('user_id')
+    if user_id is not None:
+        return 'user:%s' % user_id
+    return ip_key()
+
+
+def endpoint_key():
+    return 'endpoint'
+
+
+key_functions = {
+    'ip': ip_key,
+    'user': user_key,
+    'endpoint': endpoint_key,
+}
+
+
+class _State(object):
+    def __init__(self, app):
+        self.store = create_store(app.config['RATELIMIT_STORAGE_URL'])
+        self.blueprints = {}
+
+
+class RateLimiter(object):
+    """Sliding-window rate limits, checked before any other request hook.
+
+    Each limit counts hits in fixed windows and weighs the previous window by
+    how much of it still overlaps the sliding window, which needs just two
+    counters per client. Rejected requests are counted too, so a client that
+    keeps hammering stays locked out. Counters live in the store named by
+    ``RATELIMIT_STORAGE_URL``: ``memory://`` for a single process,
+    ``sqlite:////path/to/file`` to share them between the workers of one host
+    or ``redis://host:port/db`` between hosts.
+
+    Limits are given as config keys holding strings like ``"10/minute"``.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RATELIMIT_ENABLED', True)
+        app.config.setdefault('RATELIMIT_STORAGE_URL', 'memory://')
+        app.config.setdefault('RATELIMIT_COMMENT', '2/minute')
+        app.config.setdefault('RATELIMIT_COMMENT_TOTAL', '60/minute')
+        app.config.setdefault('RATELIMIT_LOGIN', '10/minute')
+        app.config.setdefault('RATELIMIT_API', '300/minute')
+        app.config.setdefault('RATELIMIT_API_IP', '1200/minute')
+        app.extensions['rate_limit'] = _State(app)
+        # registered before the blueprints, so it runs before their hooks
+        app.before_request(self._check_request)
+
+    def limit(self, config_key, key='ip', methods=None):
+        """Limit a view to the rate in ``config_key`` per ``key``: "ip",
+        "user", "endpoint" or a function returning the key. Only requests
+        with one of ``methods`` count, if given. Goes right below the route
+        decorator."""
+        def decorator(f):
+            f.rate_limits = getattr(f, 'rate_limits', []) + [(config_key, key, methods)]
+            return f
+        return decorator
+
+    def limit_blueprint(self, blueprint, config_key, key='ip', methods=None):
+        """Limit every view of ``blueprint`` together."""
+        def register(state):
+            limits = state.app.extensions['rate_limit'].blueprints
+            limits.setdefault(blueprint.name, []).append((config_key, key, methods))
+        blueprint.record(register)
+
+    def hit(self, name, config_key, key='ip'):
+        """Count a hit on limit ``name``; raise ``RateLimitExceeded`` if the
+        client is over it."""
+        count, period = parse_limit(current_app.config[config_key])
+        if not callable(key):
+            key = key_functions[key]
+        now = time.time()
+        window = int(now // period)
+        prefix = 'rl:%s:%s:%s:' % (name, config_key, key())
+        previous, current = current_app.extensions['rate_limit'].store.hit(
+            prefix + str(window), prefix + str(window - 1), 2 * period)
+        elapsed = now - window * period
+        if previous * (1 - elapsed / period) + current > count:
+            if current < count:
+                # wait for the previous window to slide out far enough
+                wait = period * (1 - (count - current) / previous) - elapsed
+            else:
+                # wait for this window to become the previous one
+                wait = period - elapsed + period * (1 - (count - 1) / current)
+            raise RateLimitExceeded(max(1, int(math.ceil(wait))))
+
+    def _check_request(self):
+        if not current_app.config['RATELIMIT_ENABLED'] or request.endpoint is None:
+            return
+        state = current_app.extensions['rate_limit']
+        view = current_app.view_functions.get(request.endpoint)
+        for name, limits in ((request.blueprint, state.blueprints.get(request.blueprint, [])),
+                             (request.endpoint, getattr(view, 'rate_limits', []))):
+            for config_key, key, methods in limits:
+                if methods is None or request.method in methods:
+                    self.hit(name, config_key, key)
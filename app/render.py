@@ -0,0 +1,249 @@
+import hashlib
+import os
+import queue
+import re
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app
+from markdown import Markdown, markdown
+from werkzeug.contrib.cache import SimpleCache
+import bleach
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def slugify(value, separator):
+    # markdown's own slugify drops every non-ASCII character, which would
+    # leave Chinese headings without usable anchors
+    value = re.sub(r'[^\w\s-]', '', value).strip().lower()
+    return re.sub(r'[%s\s]+' % separator, separator, value)
+
+
+def render_post(body):
+    md = Markdown(extensions=['extra', 'toc'],
+                  extension_configs={'toc': {'toc_depth': 3, 'slugify': slugify}})
+    body_html = bleach.linkify(md.convert(body))
+    return {'body_html': body_html, 'toc_html': md.toc if md.toc_tokens else None}
+
+
+def render_comment(body):
+    allowed_tags = ['a', 'abbr', 'acronym', 'b', 'code', 'em', 'i',
+                    'strong']
+    return {'body_html': bleach.linkify(bleach.clean(
+        markdown(body, output_format='html'),
+        tags=allowed_tags, strip=True))}
+
+
+renderers = {
+    'post': render_post,
+    'comment': render_comment,
+}
+
+
+class RenderTimeout(Exception):
+    pass
+
+
+def _timed_out(signum, frame):
+    raise RenderTimeout()
+
+
+_memory_limited = False
+
+
+def render_job(kind, body, timeout, memory_limit):
+    """Runs in a pool worker: render ``body`` under a time and memory limit."""
+    global _memory_limited
+    if resource is not None and memory_limit and not _memory_limited:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+        _memory_limited = True
+    signal.signal(signal.SIGALRM, _timed_out)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return renderers[kind](body)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def render_batch(kind, bodies):
+    """Render ``bodies``, giving ``(columns, None)`` for each, or
+    ``(None, error)`` for a body that could not be rendered."""
+    results = []
+    for body in bodies:
+        try:
+            results.append((renderers[kind](body), None))
+        except Exception as e:
+            results.append((None, repr(e)))
+    return results
+
+
+def rerender(kind, model, chunk_size=1000, workers=None, start_id=0):
+    """Re-render every ``body`` of ``model`` after ``start_id``.
+
+    Only ``(id, body)`` is read, in id order, one chunk at a time; the
+    bodies are rendered across a process pool and the HTML columns written
+    back with one executemany UPDATE per chunk, which also bumps
+    ``update_time``. The session and its flush hooks are bypassed, so the
+    search index, which holds the text of the posts' HTML, is rebuilt once
+    at the end. Each chunk is committed before the next one is read. A row
+    that fails to render is logged and left as it is. Yields ``(rows,
+    last_id)`` after each chunk, so an interrupted run can be resumed from
+    the last id.
+    """
+    from . import db
+    from .search import reindex
+    workers = workers or os.cpu_count() or 1
+    table = model.__table__
+    update = None
+    with ProcessPoolExecutor(workers) as pool:
+        last_id = start_id
+        while True:
+            rows = db.session.query(model.id, model.body) \
+                .filter(model.id > last_id, model.body != None) \
+                .order_by(model.id).limit(chunk_size).all()
+            if not rows:
+                break
+            bodies = [body for id, body in rows]
+            size = len(bodies) // workers + 1
+            batches = [bodies[i:i + size] for i in range(0, len(bodies), size)]
+            results = [result for batch in pool.map(render_batch, [kind] * len(batches), batches)
+                       for result in batch]
+            params = []
+            for (id, body), (columns, error) in zip(rows, results):
+                if error is not None:
+                    current_app.logger.error('Rendering %s %s failed: %s', kind, id, error)
+                    continue
+                if update is None:
+                    update = table.update().where(table.c.id == db.bindparam('row_id')) \
+                        .values({key: db.bindparam('new_' + key) for key in columns})
+                params.append(dict({'new_' + key: value for key, value in columns.items()},
+                                   row_id=id))
+            if params:
+                db.session.execute(update, params)
+            last_id = rows[-1].id
+            db.session.commit()
+            yield len(params), last_id
+    if kind == 'post':
+        reindex()
+        db.session.commit()
+
+
+def content_hash(kind, body):
+    return hashlib.sha1((kind + '\0' + body).encode('utf-8')).hexdigest()
+
+
+class _State(object):
+    def __init__(self, app):
+        self.app = app
+        self.cache = SimpleCache(threshold=app.config['RENDER_CACHE_THRESHOLD'],
+                                 default_timeout=0)
+        self.pool = None
+        # rendered results waiting to be written back
+        self.results = queue.Queue()
+        self.writer = None
+
+
+class Renderer(object):
+    """Renders post and comment markdown to HTML.
+
+    Results are cached by content hash, so an unchanged body is never
+    rendered twice. With ``RENDER_WORKERS`` set, cache misses are rendered by
+    a process pool once the transaction commits, under ``RENDER_TIMEOUT``
+    seconds and ``RENDER_MEMORY_LIMIT`` bytes per job, and written back to the
+    row by a writer thread through its own session, so the usual commit
+    hooks run without holding up the pool or the request; until then
+    ``body_html`` is empty and the templates show the escaped raw body. With
+    ``RENDER_WORKERS = 0`` rendering is done inline.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RENDER_WORKERS', 0)
+        app.config.setdefault('RENDER_TIMEOUT', 10)
+        app.config.setdefault('RENDER_MEMORY_LIMIT', 512 * 1024 * 1024)
+        app.config.setdefault('RENDER_CACHE_THRESHOLD', 200)
+        app.extensions['renderer'] = _State(app)
+
+    def render(self, kind, body):
+        """Return the rendered columns for ``body`` (``body_html``, plus
+        ``toc_html`` for posts) if they can be had without waiting, otherwise
+        ``None``."""
+        state = current_app.extensions['renderer']
+        key = content_hash(kind, body)
+        columns = state.cache.get(key)
+        if columns is None and not current_app.config['RENDER_WORKERS']:
+            columns = renderers[kind](body)
+            state.cache.set(key, columns)
+        return columns
+
+    def submit(self, kind, model, id, body, callback=None):
+        """Render ``body`` in the pool and store the result in the ``model``
+        row ``id``, provided the row still has the same body. ``callback`` is
+        then called inside an app context."""
+        state = current_app.extensions['renderer']
+        args = (render_job, kind, body, current_app.config['RENDER_TIMEOUT'],
+                current_app.config['RENDER_MEMORY_LIMIT'])
+        if state.pool is None:
+            # created lazily so that each forked server worker gets its own
+            state.pool = ProcessPoolExecutor(current_app.config['RENDER_WORKERS'])
+        if state.writer is None or not state.writer.is_alive():
+            state.writer = threading.Thread(target=self._write, args=(state,), daemon=True)
+            state.writer.start()
+        try:
+            future = state.pool.submit(*args)
+        except BrokenProcessPool:
+            # a worker died, e.g. killed for running out of memory; the
+            # pool refuses any further job until it is replaced
+            current_app.logger.warning('Render pool broken, starting a new one')
+            state.pool.shutdown(wait=False)
+            state.pool = ProcessPoolExecutor(current_app.config['RENDER_WORKERS'])
+            future = state.pool.submit(*args)
+        future.add_done_callback(
+            lambda future: self._done(state, future, kind, model, id, body, callback))
+        return future
+
+    def _done(self, state, future, kind, model, id, body, callback):
+        # runs on the pool's result thread, or right away in the caller's
+        # if the job is already done, so the writing is left to the writer
+        try:
+            columns = future.result()
+        except Exception as e:
+            state.app.logger.warning('Rendering %s %s failed: %r', kind, id, e)
+            return
+        state.cache.set(content_hash(kind, body), columns)
+        state.results.put((kind, model, id, body, columns, callback))
+
+    def _write(self, state):
+        while True:
+            job = state.results.get()
+            try:
+                self._store(state, *job)
+            except Exception:
+                state.app.logger.exception('Storing a render failed')
+            finally:
+                state.results.task_done()
+
+    def _store(self, state, kind, model, id, body, columns, callback):
+        with state.app.app_context():
+            # written through the session so that the flush and commit hooks
+            # see the change, and update_time, which the page and API
+            # versions are read from, is bumped; db.session is scoped to the
+            # thread, so this is the writer's own
+            from . import db
+            obj = db.session.query(model).with_for_update().get(id)
+            if obj is None or obj.body != body:
+                db.session.rollback()
+                return
+            for key, value in columns.items():
+                setattr(obj, key, value)
+            db.session.commit()
+            if callback is not None:
+                callback()
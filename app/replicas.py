@@ -0,0 +1,152 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from flask import has_request_context, request, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import orm
+from sqlalchemy.sql.expression import Select, CompoundSelect, Insert, Update, Delete
+
+# the flask session key holding when the client last wrote
+WROTE_AT = '_db_wrote_at'
+
+
+def mysql_lag(connection):
+    row = connection.execute('SHOW SLAVE STATUS').first()
+    if row is None:
+        # not replicating at all
+        return float('inf')
+    lag = row['Seconds_Behind_Master']
+    return float('inf') if lag is None else lag
+
+
+def primary(f):
+    """Make every read of a view go to the primary, for views that write
+    what they read, even on GET. Goes right below the route decorator."""
+    f.use_primary = True
+    return f
+
+
+class _State(object):
+    def __init__(self, keys):
+        self.keys = keys
+        self.lock = threading.Lock()
+        # bind key -> (time of the check, lag in seconds)
+        self.lags = {}
+
+
+class RoutingSession(SignallingSession):
+    """Sends reads made while handling a GET or HEAD request to a replica.
+
+    Everything else uses the primary: writes, reads after a write in the
+    same session, reads outside of a request, ``SELECT ... FOR UPDATE``,
+    textual statements, reads in views marked with ``primary`` or in a
+    ``primary_reads`` block, and reads from a client that wrote less than
+    ``SQLALCHEMY_REPLICA_MAX_LAG`` seconds ago, so that they see what they
+    wrote. A session reads from one replica only, picked at random from
+    those no further behind than ``SQLALCHEMY_REPLICA_MAX_LAG``.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        state = self.app.extensions['replicas']
+        if not state.keys or (mapper is not None and
+                              mapper.persist_selectable.info.get('bind_key') is not None):
+            return super(RoutingSession, self).get_bind(mapper, clause)
+        if isinstance(clause, (Select, CompoundSelect)) and clause._for_update_arg is None:
+            key = self._replica(state)
+            if key is not None:
+                return get_state(self.app).db.get_engine(self.app, bind=key)
+        elif (self._flushing or isinstance(clause, (Insert, Update, Delete))) and \
+                not self.info.get('db_wrote'):
+            self.info['db_wrote'] = True
+            if has_request_context():
+                session[WROTE_AT] = time.time()
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+    def _replica(self, state):
+        if self.info.get('db_wrote') or self.info.get('db_primary') or \
+                not has_request_context() or \
+                request.method not in ('GET', 'HEAD') or \
+                getattr(self.app.view_functions.get(request.endpoint), 'use_primary', False) or \
+                time.time() - session.get(WROTE_AT, 0) < \
+                self.app.config['SQLALCHEMY_REPLICA_MAX_LAG']:
+            return None
+        if 'db_replica' not in self.info:
+            keys = [key for key in state.keys if self._lag(state, key) <=
+                    self.app.config['SQLALCHEMY_REPLICA_MAX_LAG']]
+            self.info['db_replica'] = random.choice(keys) if keys else None
+        return self.info['db_replica']
+
+    def _lag(self, state, key):
+        now = time.time()
+        checked_at, lag = state.lags.get(key, (0, None))
+        if now - checked_at < self.app.config['SQLALCHEMY_REPLICA_CHECK_INTERVAL']:
+            return lag
+        db = get_state(self.app).db
+        engine = db.get_engine(self.app, bind=key)
+        probe = db.lag_probes.get(engine.dialect.name)
+        try:
+            if probe is None:
+                lag = 0
+            else:
+                with engine.connect() as connection:
+                    lag = probe(connection)
+        except Exception:
+            self.app.logger.exception('Could not check replica %s', key)
+            lag = float('inf')
+        with state.lock:
+            state.lags[key] = now, lag
+        return lag
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """``SQLAlchemy`` with optional read replicas.
+
+    Each URI in ``SQLALCHEMY_REPLICA_URIS`` becomes a bind named
+    ``replica_<n>`` with no tables of its own, and the session routes reads
+    to them as ``RoutingSession`` describes. ``lag_probes`` maps a dialect
+    name to a function measuring how many seconds a replica connection is
+    behind; dialects without a probe are assumed to be up to date.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.lag_probes = {'mysql': mysql_lag}
+        super(RoutingSQLAlchemy, self).__init__(*args, **kwargs)
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+        app.config.setdefault('SQLALCHEMY_REPLICA_MAX_LAG', 5)
+        app.config.setdefault('SQLALCHEMY_REPLICA_CHECK_INTERVAL', 5)
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        keys = []
+        for i, uri in enumerate(app.config['SQLALCHEMY_REPLICA_URIS']):
+            keys.append('replica_%d' % i)
+            binds[keys[-1]] = uri
+        if keys:
+            app.config['SQLALCHEMY_BINDS'] = binds
+        super(RoutingSQLAlchemy, self).init_app(app)
+        app.extensions['replicas'] = _State(keys)
+        if keys:
+            app.before_request(self._new_request)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    @contextmanager
+    def primary_reads(self):
+        """Read from the primary in the block, for results that outlive the
+        request, such as those filling a process-wide cache; a replica's
+        older copy would be kept there long after it caught up."""
+        info = self.session().info
+        previous = info.get('db_primary')
+        info['db_primary'] = True
+        try:
+            yield
+        finally:
+            info['db_primary'] = previous
+
+    def _new_request(self):
+        # the session outlives a request when the app context was pushed
+        # before it, as in the tests
+        self.session.info.pop('db_wrote', None)
+        self.session.info.pop('db_replica', None)
@@ -0,0 +1,200 @@
+import re
+from html import unescape
+import bleach
+from flask import current_app
+from flask_sqlalchemy import Pagination
+from sqlalchemy import DDL, or_, text, select, func, table, column
+from . import db
+from .models import Post
+from .listing import paginate_posts, posts_by_id
+
+CJK = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+TOKEN_RE = re.compile('([%s]+)|([^\\W%s]+)' % (CJK, CJK))
+
+
+def tokenize(text):
+    """Split text into search tokens.
+
+    Runs of CJK characters have no word boundaries, so they are cut into
+    overlapping bigrams ("全文检索" -> "全文 文检 检索"); other text is split
+    into lower-cased words.
+    """
+    tokens = []
+    for cjk, word in TOKEN_RE.findall((text or '').lower()):
+        if word:
+            tokens.append(word)
+        elif len(cjk) == 1:
+            tokens.append(cjk)
+        else:
+            tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+    return tokens
+
+
+def plain_text(post):
+    """The markdown-stripped body of a post."""
+    if post.body_html:
+        return unescape(bleach.clean(post.body_html, tags=[], strip=True))
+    return post.body or ''
+
+
+class SQLiteSearch(object):
+    """FTS5 index holding pre-tokenized text, ranked with bm25."""
+
+    create_ddl = 'CREATE VIRTUAL TABLE IF NOT EXISTS post_search ' \
+                 'USING fts5(title, summary, body)'
+
+    def index(self, connection, id, title, summary, body):
+        self.remove(connection, id)
+        connection.execute(
+            text('INSERT INTO post_search (rowid, title, summary, body) '
+                 'VALUES (:id, :title, :summary, :body)'),
+            id=id, title=' '.join(tokenize(title)),
+            summary=' '.join(tokenize(summary)), body=' '.join(tokenize(body)))
+
+    def remove(self, connection, id):
+        connection.execute(text('DELETE FROM post_search WHERE rowid = :id'),
+                           id=id)
+
+    def match(self, keywords):
+        terms = []
+        for token in tokenize(keywords):
+            # a lone CJK character can only match the start of a bigram
+            if len(token) == 1 and TOKEN_RE.match(token).group(1):
+                terms.append('"%s" *' % token)
+            else:
+                terms.append('"%s"' % token)
+        return ' '.join(terms)
+
+    index_table = table('post_search', column('rowid'))
+
+    def search(self, session, keywords, offset, limit):
+        condition = text('post_search MATCH :match')
+        params = {'match': self.match(keywords)}
+        total = session.execute(
+            select([func.count()]).select_from(self.index_table).where(condition),
+            params, mapper=Post.__mapper__).scalar()
+        ids = [row[0] for row in session.execute(
+            select([self.index_table.c.rowid]).where(condition)
+            .order_by(text('bm25(post_search, 10.0, 5.0, 1.0)'))
+            .limit(limit).offset(offset),
+            params, mapper=Post.__mapper__)]
+        return total, ids
+
+
+class MySQLSearch(object):
+    """InnoDB FULLTEXT index using MySQL's ngram parser, which does the same
+    bigram split as ``tokenize`` on the server side."""
+
+    create_ddl = 'CREATE TABLE IF NOT EXISTS post_search (' \
+                 'post_id INTEGER NOT NULL PRIMARY KEY, ' \
+                 'title TEXT, summary TEXT, body MEDIUMTEXT, ' \
+                 'FULLTEXT KEY ft_post_search (title, summary, body) WITH PARSER ngram' \
+                 ') ENGINE=InnoDB DEFAULT CHARSET=utf8mb4'
+
+    def index(self, connection, id, title, summary, body):
+        connection.execute(
+            text('REPLACE INTO post_search (post_id, title, summary, body) '
+                 'VALUES (:id, :title, :summary, :body)'),
+            id=id, title=title, summary=summary, body=body)
+
+    def remove(self, connection, id):
+        connection.execute(text('DELETE FROM post_search WHERE post_id = :id'),
+                           id=id)
+
+    def match(self, keywords):
+        return ' '.join('+"%s"' % word.replace('"', '')
+                        for word in keywords.split() if word.replace('"', ''))
+
+    index_table = table('post_search', column('post_id'))
+
+    def search(self, session, keywords, offset, limit):
+        relevance = 'MATCH (title, summary, body) AGAINST (:match IN BOOLEAN MODE)'
+        params = {'match': self.match(keywords)}
+        total = session.execute(
+            select([func.count()]).select_from(self.index_table).where(text(relevance)),
+            params, mapper=Post.__mapper__).scalar()
+        ids = [row[0] for row in session.execute(
+            select([self.index_table.c.post_id]).where(text(relevance))
+            .order_by(text(relevance + ' DESC'))
+            .limit(limit).offset(offset),
+            params, mapper=Post.__mapper__)]
+        return total, ids
+
+
+backends = {
+    'sqlite': SQLiteSearch(),
+    'mysql': MySQLSearch(),
+}
+
+
+def get_backend(bind):
+    return backends.get(bind.dialect.name)
+
+
+def index_post(connection, post):
+    backend = get_backend(connection)
+    if backend is not None:
+        backend.index(connection, post.id, post.title or '',
+                      post.summary or '', plain_text(post))
+
+
+def reindex():
+    """Rebuild the search index from every post."""
+    connection = db.session.connection()
+    if get_backend(connection) is None:
+        return 0
+    connection.execute(text('DELETE FROM post_search'))
+    count = 0
+    for post in Post.query.order_by(Post.id).yield_per(500):
+        index_post(connection, post)
+        count += 1
+    return count
+
+
+def search_posts(keywords, page, per_page=None):
+    """Paginate the posts matching ``keywords``, most relevant first.
+
+    Databases without a full-text backend fall back to LIKE on the title and
+    summary. The index is queried with SELECT constructs rather than textual
+    SQL, so that the session can send them to a read replica.
+    """
+    if per_page is None:
+        per_page = current_app.config['FLASKY_POSTS_PER_PAGE']
+    backend = get_backend(db.session.get_bind(Post.__mapper__))
+    if backend is None or not backend.match(keywords):
+        key_word = '%' + keywords + '%'
+        return paginate_posts(
+            Post.query.filter(or_(Post.title.like(key_word), Post.summary.like(key_word)))
+                .order_by(Post.timestamp.desc()), page, per_page)
+    page = max(page, 1)
+    total, ids = backend.search(db.session, keywords, (page - 1) * per_page, per_page)
+    return Pagination(None, page, per_page, total, posts_by_id(ids))
+
+
+# Keep the index in step with the posts table inside the same transaction.
+def search_after_flush(session, flush_context):
+    connection = session.connection()
+    backend = get_backend(connection)
+    if backend is None:
+        return
+    for obj in session.deleted:
+        if isinstance(obj, Post):
+            backend.remove(connection, obj.id)
+    for obj in session.new:
+        if isinstance(obj, Post):
+            index_post(connection, obj)
+    for obj in session.dirty:
+        if isinstance(obj, Post) and obj not in session.deleted:
+            state = db.inspect(obj)
+            if any(state.attrs[key].history.has_changes()
+                   for key in ('title', 'summary', 'body', 'body_html')):
+                index_post(connection, obj)
+
+
+db.event.listen(db.session, 'after_flush', search_after_flush)
+
+for dialect, search_backend in backends.items():
+    db.event.listen(Post.__table__, 'after_create',
+                    DDL(search_backend.create_ddl).execute_if(dialect=dialect))
+db.event.listen(Post.__table__, 'after_drop',
+                DDL('DROP TABLE IF EXISTS post_search'))
@@ -15,10 +15,17 @@ class Config:
     FLASKY_ADMIN = os.environ.get("FLASKY_ADMIN")
     SSL_REDIRECT = False
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    SQLALCHEMY_RECORD_QUERIES = True
+    # app.db_stats gathers what is needed at a fraction of the cost
+    SQLALCHEMY_RECORD_QUERIES = False
     FLASKY_POSTS_PER_PAGE = 10
     FLASKY_COMMENTS_PER_PAGE = 30
     FLASKY_SLOW_DB_QUERY_TIME = 0.5
+    LAST_SEEN_FLUSH_INTERVAL = 60
+    RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", 0))
+    RENDER_TIMEOUT = 10
+    RATELIMIT_STORAGE_URL = os.environ.get("RATELIMIT_STORAGE_URL", 'memory://')
+    PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", 'pbkdf2:sha256:50000')
+    PASSWORD_REHASH = os.environ.get("PASSWORD_REHASH", 'false').lower() in ['true', 'on', '1']
     ENABLE_COMMENT = os.environ.get("ENABLE_COMMENT", 1)
     ENABLE_REGISTER = os.environ.get("ENABLE_REGISTER", 0)
 
@@ -28,16 +35,28 @@ class Config:
 
 class DevelopmentConfig(Config):
     DEBUG = True
+    NPLUSONE_ENABLED = True
     SQLALCHEMY_DATABASE_URI = os.environ.get("DEV_DATABASE_URL") or 'sqlite:///' + os.path.join(basedir, 'data-dev.sqlite')
 
 class TestingConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = os.environ.get("TEST_DATABASE_URL") or 'sqlite://'
     WTF_CSRF_ENABLED = False
+    LAST_SEEN_FLUSH_INTERVAL = 0
+    # requests running a query per row fail the tests
+    NPLUSONE_ENABLED = True
+    NPLUSONE_RAISE = True
 
 class ProductionConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
                               'sqlite:///' + os.path.join(basedir, 'data.sqlite')
+    # comma-separated read replicas of DATABASE_URL
+    SQLALCHEMY_REPLICA_URIS = [uri for uri in os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+                               if uri.strip()]
+    RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", 2))
+    # shared by all the workers on the host
+    RATELIMIT_STORAGE_URL = os.environ.get("RATELIMIT_STORAGE_URL") or \
+                            'sqlite:///' + os.path.join(basedir, 'ratelimit.sqlite')
 
     @classmethod
     def init_app(cls, app):
@@ -12,6 +12,7 @@ if os.environ.get('FLASK_COVERAGE'):
     COV.start()
 
 import sys
+import time
 import click
 from flask_migrate import Migrate, upgrade
 from app import create_app, db
@@ -78,5 +79,74 @@ def deploy():
     # create or update user category
     Category.insert_categories()
 
+
+@app.cli.command()
+def recount():
+    """Rebuild the stored post and comment counters."""
+    Post.recount()
+    User.recount()
+    db.session.commit()
+
+
+@app.cli.command()
+def reindex():
+    """Rebuild the full-text search index."""
+    from app.search import reindex
+    count = reindex()
+    db.session.commit()
+    print('Indexed %d posts.' % count)
+
+
+@app.cli.group()
+def assets():
+    """Build the static assets."""
+
+
+@assets.command()
+@click.option('--fetch/--no-fetch', default=True,
+              help='Download the vendored files that are missing.')
+def build(fetch):
+    """Vendor, bundle and fingerprint the static files."""
+    from app import assets as assets_extension
+    from app.assets import build as build_assets
+    try:
+        manifest = build_assets(app.static_folder, fetch=fetch)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    assets_extension.reload(app)
+    print('Wrote %d files.' % len(manifest))
+
+
+@app.cli.command()
+@click.argument('what', type=click.Choice(['all', 'posts', 'comments']),
+                default='all')
+@click.option('--chunk-size', default=1000,
+              help='Number of rows read and written per batch.')
+@click.option('--workers', default=None, type=int,
+              help='Number of render processes, defaults to the CPU count.')
+@click.option('--start-id', default=0,
+              help='Resume after this row id; needs posts or comments.')
+def rerender(what, chunk_size, workers, start_id):
+    """Re-render the HTML of posts and comments."""
+    from app.render import rerender as rerender_rows
+    if start_id and what == 'all':
+        raise click.UsageError('--start-id is a posts or comments id, '
+                               'name the one to resume.')
+    targets = [('post', 'posts', Post), ('comment', 'comments', Comment)]
+    for kind, name, model in targets:
+        if what not in ('all', name):
+            continue
+        start = time.time()
+        total = 0
+        for rows, last_id in rerender_rows(kind, model, chunk_size,
+                                           workers, start_id):
+            total += rows
+            elapsed = max(time.time() - start, 1e-6)
+            print('%s: %d rendered, last id %d, %.0f rows/s'
+                  % (name, total, last_id, total / elapsed))
+        print('%s: done, %d rendered in %.1fs'
+              % (name, total, time.time() - start))
+
+
 if __name__ == '__main__':
     app.run(debug=1, host="0.0.0.0")
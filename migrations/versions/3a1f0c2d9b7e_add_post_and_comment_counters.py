@@ -0,0 +1,34 @@
+"""add post and comment counters
+
+Revision ID: 3a1f0c2d9b7e
+Revises: 68456a26ff60
+Create Date: 2026-10-18 10:12:31.402118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3a1f0c2d9b7e'
+down_revision = '68456a26ff60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('posts', sa.Column('comment_count', sa.Integer(), nullable=True, server_default='0'))
+    op.add_column('users', sa.Column('post_count', sa.Integer(), nullable=True, server_default='0'))
+    op.execute('UPDATE posts SET comment_count = '
+               '(SELECT COUNT(comments.id) FROM comments '
+               'WHERE comments.post_id = posts.id '
+               'AND (comments.disabled IS NULL OR comments.disabled = 0))')
+    op.execute('UPDATE users SET post_count = '
+               '(SELECT COUNT(posts.id) FROM posts WHERE posts.author_id = users.id)')
+
+
+def downgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('post_count')
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.drop_column('comment_count')
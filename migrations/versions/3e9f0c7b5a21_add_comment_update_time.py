@@ -0,0 +1,31 @@
+"""add comment update time
+
+Revision ID: 3e9f0c7b5a21
+Revises: f41b6e8a2c93
+Create Date: 2026-10-18 21:14:05.208641
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3e9f0c7b5a21'
+down_revision = 'f41b6e8a2c93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('comments', sa.Column('update_time', sa.DateTime(), nullable=True))
+    op.create_index(op.f('ix_comments_update_time'), 'comments', ['update_time'], unique=False)
+
+    comments = sa.table('comments', sa.column('timestamp', sa.DateTime),
+                        sa.column('update_time', sa.DateTime))
+    op.get_bind().execute(comments.update().values(update_time=comments.c.timestamp))
+
+
+def downgrade():
+    op.drop_index(op.f('ix_comments_update_time'), table_name='comments')
+    with op.batch_alter_table('comments') as batch_op:
+        batch_op.drop_column('update_time')
@@ -0,0 +1,38 @@
+"""add post search index
+
+Revision ID: 8c4e2b6f1d35
+Revises: 3a1f0c2d9b7e
+Create Date: 2026-10-18 14:03:55.716240
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4e2b6f1d35'
+down_revision = '3a1f0c2d9b7e'
+branch_labels = None
+depends_on = None
+
+
+# dialect name -> the index as of this revision; other dialects search with LIKE
+create_ddl = {
+    'sqlite': 'CREATE VIRTUAL TABLE IF NOT EXISTS post_search '
+              'USING fts5(title, summary, body)',
+    'mysql': 'CREATE TABLE IF NOT EXISTS post_search ('
+             'post_id INTEGER NOT NULL PRIMARY KEY, '
+             'title TEXT, summary TEXT, body MEDIUMTEXT, '
+             'FULLTEXT KEY ft_post_search (title, summary, body) WITH PARSER ngram'
+             ') ENGINE=InnoDB DEFAULT CHARSET=utf8mb4',
+}
+
+
+def upgrade():
+    # the index is filled by `flask reindex`
+    ddl = create_ddl.get(op.get_bind().dialect.name)
+    if ddl is not None:
+        op.execute(ddl)
+
+
+def downgrade():
+    op.execute('DROP TABLE IF EXISTS post_search')
@@ -0,0 +1,29 @@
+"""add page versions
+
+Revision ID: a7d3c5e9b214
+Revises: 3e9f0c7b5a21
+Create Date: 2026-10-18 23:02:41.530817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d3c5e9b214'
+down_revision = '3e9f0c7b5a21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('page_versions',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('update_time', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('page_versions')
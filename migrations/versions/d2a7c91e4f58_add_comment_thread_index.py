@@ -0,0 +1,53 @@
+"""add comment thread index
+
+Revision ID: d2a7c91e4f58
+Revises: b5d93e0a7c12
+Create Date: 2026-10-18 18:02:44.517930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2a7c91e4f58'
+down_revision = 'b5d93e0a7c12'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('comments', sa.Column('root_id', sa.Integer(), nullable=True))
+    op.add_column('comments', sa.Column('depth', sa.Integer(), nullable=True, server_default='0'))
+    op.create_index(op.f('ix_comments_root_id'), 'comments', ['root_id'], unique=False)
+
+    # replies always come after the comment they answer, so one pass in id
+    # order sees every parent before its children
+    comments = sa.table('comments', sa.column('id', sa.Integer),
+                        sa.column('replay_id', sa.Integer),
+                        sa.column('root_id', sa.Integer),
+                        sa.column('depth', sa.Integer))
+    bind = op.get_bind()
+    threads = {}
+    params = []
+    for id, replay_id in bind.execute(
+            sa.select([comments.c.id, comments.c.replay_id]).order_by(comments.c.id)):
+        if replay_id in threads:
+            root_id, depth = threads[replay_id]
+            root_id, depth = root_id or replay_id, depth + 1
+            params.append({'comment_id': id, 'root': root_id, 'level': depth})
+        else:
+            root_id, depth = None, 0
+        threads[id] = root_id, depth
+    if params:
+        bind.execute(comments.update()
+                     .where(comments.c.id == sa.bindparam('comment_id'))
+                     .values(root_id=sa.bindparam('root'), depth=sa.bindparam('level')),
+                     params)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_comments_root_id'), table_name='comments')
+    with op.batch_alter_table('comments') as batch_op:
+        batch_op.drop_column('depth')
+        batch_op.drop_column('root_id')
@@ -0,0 +1,112 @@
+import unittest
+import json
+from base64 import b64encode
+from app import create_app, db
+from app.models import User, Role, Post, Comment
+
+
+class APICachingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.init_roles()
+        self.client = self.app.test_client()
+        self.user = User(email='john@example.com', username='john',
+                         password='cat', confirmed=True)
+        self.post = Post(body='body of the post', author=self.user)
+        db.session.add_all([self.user, self.post])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get(self, url, etag=None):
+        headers = {
+            'Authorization': 'Basic ' + b64encode(
+                b'john@example.com:cat').decode('utf-8'),
+            'Accept': 'application/json',
+        }
+        if etag:
+            headers['If-None-Match'] = etag
+        return self.client.get(url, headers=headers)
+
+    def assert_revalidates(self, url, change):
+        response = self.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        self.assertIn('private', response.headers['Cache-Control'])
+        self.assertIn('no-cache', response.headers['Cache-Control'])
+
+        response = self.get(url, etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get_data(), b'')
+
+        change()
+        response = self.get(url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        return json.loads(response.get_data(as_text=True))
+
+    def test_post(self):
+        def change():
+            db.session.add(Comment(body='a comment', post=self.post))
+            db.session.commit()
+        json_post = self.assert_revalidates(
+            '/api/v1/posts/%d' % self.post.id, change)
+        self.assertEqual(json_post['comment_count'], 1)
+
+        def change():
+            self.post.body = 'new body'
+            db.session.commit()
+        json_post = self.assert_revalidates(
+            '/api/v1/posts/%d' % self.post.id, change)
+        self.assertEqual(json_post['body'], 'new body')
+
+    def test_post_with_embedded_objects(self):
+        url = '/api/v1/posts/%d' % self.post.id
+        etag = self.get(url).headers['ETag']
+
+        def change():
+            self.user.post_count = 5
+            db.session.commit()
+        json_post = self.assert_revalidates(url + '?embed=author', change)
+        self.assertEqual(json_post['author']['post_count'], 5)
+        # the post itself did not change
+        self.assertEqual(self.get(url, etag).status_code, 304)
+
+    def test_comments(self):
+        def change():
+            db.session.add(Comment(body='a comment', post=self.post))
+            db.session.commit()
+        json_response = self.assert_revalidates('/api/v1/comments/', change)
+        self.assertEqual(json_response['count'], 1)
+
+        # the HTML rendered after the fact changes both versions
+        comment = Comment.query.first()
+
+        def change():
+            comment.body_html = '<p>rendered</p>'
+            db.session.commit()
+        self.assert_revalidates('/api/v1/comments/', change)
+
+        def change():
+            comment.body_html = '<p>rendered again</p>'
+            db.session.commit()
+        json_comment = self.assert_revalidates(
+            '/api/v1/comments/%d' % comment.id, change)
+        self.assertEqual(json_comment['body_html'], '<p>rendered again</p>')
+
+    def test_user(self):
+        def change():
+            db.session.add(Post(body='another post', author=self.user))
+            db.session.commit()
+        json_user = self.assert_revalidates(
+            '/api/v1/users/%d' % self.user.id, change)
+        self.assertEqual(json_user['post_count'], 2)
+
+    def test_missing_resource(self):
+        self.assertEqual(self.get('/api/v1/posts/1000').status_code, 404)
@@ -0,0 +1,78 @@
+import unittest
+import json
+from base64 import b64encode
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.models import User, Role, Post
+
+
+class APIPaginationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.init_roles()
+        self.client = self.app.test_client()
+        self.user = User(email='john@example.com', username='john',
+                         password='cat', confirmed=True)
+        db.session.add(self.user)
+        # posts 0-4 share a timestamp so the id breaks the tie
+        start = datetime(2019, 1, 1)
+        for i in range(25):
+            db.session.add(Post(body='post %d' % i, author=self.user,
+                                timestamp=start + timedelta(days=max(i, 4))))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get_api_headers(self, username, password):
+        return {
+            'Authorization': 'Basic ' + b64encode(
+                (username + ':' + password).encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        }
+
+    def get(self, url):
+        response = self.client.get(
+            url, headers=self.get_api_headers('john@example.com', 'cat'))
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.get_data(as_text=True))
+
+    def walk(self, url):
+        pages = []
+        while url:
+            json_response = self.get(url)
+            self.assertNotIn('count', json_response)
+            pages.append(json_response)
+            url = json_response['next']
+        return pages
+
+    def test_post_cursor(self):
+        pages = self.walk('/api/v1/posts/?cursor=')
+        self.assertEqual([len(page['posts']) for page in pages], [10, 10, 5])
+        bodies = [post['body'] for page in pages for post in page['posts']]
+        self.assertEqual(bodies, ['post %d' % i for i in range(24, -1, -1)])
+        self.assertIsNone(pages[0]['prev'])
+
+        # walk back from the last page
+        json_response = self.get(pages[2]['prev'])
+        self.assertEqual(json_response['posts'], pages[1]['posts'])
+        json_response = self.get(json_response['prev'])
+        self.assertEqual(json_response['posts'], pages[0]['posts'])
+        self.assertIsNone(json_response['prev'])
+
+    def test_user_posts_cursor(self):
+        pages = self.walk(
+            '/api/v1/users/{}/posts/?cursor='.format(self.user.id))
+        self.assertEqual(sum(len(page['posts']) for page in pages), 25)
+
+    def test_bad_cursor(self):
+        response = self.client.get(
+            '/api/v1/posts/?cursor=garbage',
+            headers=self.get_api_headers('john@example.com', 'cat'))
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,111 @@
+import unittest
+import json
+from base64 import b64encode
+from flask import jsonify
+from sqlalchemy import event
+from app import create_app, db
+from app.models import User, Role, Post, Comment
+from app.api.serializers import serialize_posts, serialize_comments, url_templates
+
+
+class SerializersTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.init_roles()
+        u = User(email='john@example.com', username='john', password='cat',
+                 confirmed=True)
+        posts = [Post(title='title %d' % i, body='post %d' % i, author=u)
+                 for i in range(3)]
+        db.session.add_all([u] + posts)
+        db.session.add_all([Comment(body='comment', post=posts[0]),
+                            Comment(body='reply', post=posts[0], replay_id=1)])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get(self, url):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            if 'FROM posts' in statement:
+                statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            response = self.app.test_client().get(url, headers={
+                'Authorization': 'Basic ' + b64encode(
+                    b'john@example.com:cat').decode('utf-8'),
+                'Accept': 'application/json'})
+        finally:
+            event.remove(db.engine, 'before_cursor_execute',
+                         before_cursor_execute)
+        return response, statements
+
+    def roundtrip(self, data):
+        return json.loads(jsonify(data).get_data(as_text=True))
+
+    def test_same_as_to_json(self):
+        with self.app.test_request_context('/'):
+            posts = Post.query.all()
+            self.assertEqual(
+                self.roundtrip(serialize_posts(posts)),
+                self.roundtrip([post.to_json() for post in posts]))
+            comments = Comment.query.all()
+            self.assertEqual(
+                self.roundtrip(serialize_comments(comments)),
+                self.roundtrip([comment.to_json() for comment in comments]))
+
+    def test_url_templates_follow_script_root(self):
+        with self.app.test_request_context('/', base_url='http://localhost/blog'):
+            post_url, = url_templates('api.get_post')
+            self.assertEqual(post_url(12), '/blog/api/v1/posts/12')
+        with self.app.test_request_context('/'):
+            post_url, = url_templates('api.get_post')
+            self.assertEqual(post_url(12), '/api/v1/posts/12')
+            self.assertIsNone(post_url(None))
+
+    def test_sparse_fieldsets(self):
+        response, statements = self.get(
+            '/api/v1/posts/?fields=id,title,timestamp&cursor=')
+        self.assertEqual(response.status_code, 200)
+        posts = json.loads(response.get_data(as_text=True))['posts']
+        self.assertEqual(sorted(posts[0]), ['id', 'timestamp', 'title'])
+        self.assertEqual(posts[0]['title'], 'title 2')
+        self.assertEqual(len(statements), 1)
+        self.assertNotIn('posts.body', statements[0])
+
+        response, statements = self.get('/api/v1/posts/?fields=id,bogus')
+        self.assertEqual(response.status_code, 400)
+
+    def test_embed(self):
+        response, statements = self.get(
+            '/api/v1/posts/?fields=title&embed=author,category&cursor=')
+        self.assertEqual(response.status_code, 200)
+        posts = json.loads(response.get_data(as_text=True))['posts']
+        self.assertEqual(posts[0]['author']['username'], 'john')
+        self.assertEqual(posts[0]['author']['post_count'], 3)
+        self.assertIsNone(posts[0]['category'])
+        # loaded together with the posts
+        self.assertEqual(len(statements), 1)
+        self.assertIn('JOIN users', statements[0])
+
+        post = Post.query.first()
+        response, statements = self.get(
+            '/api/v1/posts/%d?fields=id&embed=author' % post.id)
+        self.assertEqual(json.loads(response.get_data(as_text=True)),
+                         {'id': post.id, 'author': posts[-1]['author']})
+
+    def test_fieldsets_are_kept_in_page_links(self):
+        for i in range(10):
+            db.session.add(Post(body='more', author=User.query.first()))
+        db.session.commit()
+        response, statements = self.get('/api/v1/posts/?fields=id&embed=author')
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertIn('fields=id', json_response['next'])
+        self.assertIn('embed=author', json_response['next'])
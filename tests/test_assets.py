@@ -0,0 +1,170 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from collections import OrderedDict
+from unittest import mock
+from app import create_app, db, assets
+from app.assets import VENDOR, VENDOR_REFS, build, integrity, minify_css, vendor
+from app.models import Role, Category
+
+# app.assets is also the name of the extension in the app package
+assets_module = sys.modules[vendor.__module__]
+
+
+class AssetsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.init_roles()
+        Category.insert_categories()
+        self.client = self.app.test_client()
+        self.tmp = tempfile.mkdtemp()
+        self.static_folder = os.path.join(self.tmp, 'static')
+        shutil.copytree(self.app.static_folder, self.static_folder)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def vendor(self):
+        # stand-ins for the downloaded files
+        for filename in VENDOR:
+            path = os.path.join(self.static_folder, filename)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                if filename.endswith('.css'):
+                    f.write('/* %s */\n.icon { src: url("../fonts/icon.woff?v=1#iefix"); }\n'
+                            % filename)
+                else:
+                    f.write('var x = 1\n//# sourceMappingURL=x.map\n')
+            fonts = os.path.join(os.path.dirname(os.path.dirname(path)), 'fonts')
+            os.makedirs(fonts, exist_ok=True)
+            with open(os.path.join(fonts, 'icon.woff'), 'wb') as f:
+                f.write(filename.encode('utf-8'))
+
+    def test_without_build(self):
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        data = response.get_data(as_text=True)
+        self.assertIn('href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/4.7.0/css/'
+                      'font-awesome.min.css" integrity="sha384-', data)
+        self.assertIn('crossorigin="anonymous"', data)
+        # nothing unpinned is loaded from a CDN
+        for filename, (url, pinned) in VENDOR.items():
+            if pinned is None:
+                self.assertNotIn(url, data)
+        self.assertIn('/static/styles.css', data)
+        self.assertIn('/static/js/base.js', data)
+        self.assertIn('/static/favicon.ico', data)
+
+    def test_vendor_checks_the_pinned_digests(self):
+        css = 'vendor/font-awesome/css/font-awesome.min.css'
+        files = {url: ('/* %s */' % url).encode('utf-8') for url, pinned in VENDOR.values()}
+        files[VENDOR[css][0]] = b'.icon { src: url("../fonts/icon.woff?v=1#iefix"); }'
+        font_url = VENDOR[css][0].replace('css/font-awesome.min.css', 'fonts/icon.woff')
+        files[font_url] = b'font'
+        moment = 'vendor/moment/moment-with-locales.min.js'
+        pins = OrderedDict((filename, (url, integrity(files[url])))
+                           for filename, (url, pinned) in VENDOR.items())
+        pins[moment] = (VENDOR[moment][0], None)
+        refs = {'vendor/font-awesome/fonts/icon.woff': integrity(b'font')}
+        with mock.patch.dict(VENDOR, pins), mock.patch.dict(VENDOR_REFS, refs), \
+                mock.patch.object(assets_module, '_fetch', files.__getitem__), \
+                self.assertRaises(RuntimeError) as cm:
+            vendor(self.static_folder, log=lambda message: None)
+        # an unpinned file is reported with its digest and not written
+        self.assertIn('%s %s' % (VENDOR[moment][0], integrity(files[VENDOR[moment][0]])),
+                      str(cm.exception))
+        self.assertFalse(os.path.exists(os.path.join(self.static_folder, moment)))
+        self.assertTrue(all(os.path.exists(os.path.join(self.static_folder, filename))
+                            for filename in VENDOR if filename != moment))
+        self.assertTrue(os.path.exists(
+            os.path.join(self.static_folder, 'vendor/font-awesome/fonts/icon.woff')))
+
+        # and so is an unpinned font
+        shutil.rmtree(os.path.join(self.static_folder, 'vendor'))
+        pins[moment] = (VENDOR[moment][0], integrity(files[VENDOR[moment][0]]))
+        with mock.patch.dict(VENDOR, pins), \
+                mock.patch.object(assets_module, '_fetch', files.__getitem__), \
+                self.assertRaises(RuntimeError) as cm:
+            vendor(self.static_folder, log=lambda message: None)
+        self.assertIn(font_url, str(cm.exception))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.static_folder, 'vendor/font-awesome/fonts/icon.woff')))
+
+        shutil.rmtree(os.path.join(self.static_folder, 'vendor'))
+        files[VENDOR['vendor/jquery/jquery.min.js'][0]] = b'tampered'
+        with mock.patch.dict(VENDOR, pins), mock.patch.dict(VENDOR_REFS, refs), \
+                mock.patch.object(assets_module, '_fetch', files.__getitem__), \
+                self.assertRaises(RuntimeError):
+            vendor(self.static_folder, log=lambda message: None)
+        self.assertFalse(os.path.exists(
+            os.path.join(self.static_folder, 'vendor/jquery/jquery.min.js')))
+
+    def test_build(self):
+        self.vendor()
+        manifest = build(self.static_folder, log=lambda message: None)
+        self.assertEqual(set(['base.css', 'base.js', 'post.js', 'styles.css',
+                              'js/base.js', 'js/post.js', 'favicon.ico']) -
+                         set(manifest), set())
+        self.assertRegex(manifest['base.css'], r'^dist/base\.[0-9a-f]{12}\.css$')
+        self.assertRegex(manifest['js/base.js'], r'^dist/js/base\.[0-9a-f]{12}\.js$')
+
+        with open(os.path.join(self.static_folder, manifest['base.css'])) as f:
+            css = f.read()
+        self.assertNotIn('/*', css)
+        self.assertIn('.article{', css)
+        # each font is fingerprinted and linked relative to the bundle
+        font = manifest['vendor/font-awesome/fonts/icon.woff']
+        self.assertIn('url(%s#iefix)' % font[len('dist/'):], css)
+        self.assertTrue(os.path.exists(os.path.join(self.static_folder, font)))
+        with open(os.path.join(self.static_folder, manifest['base.js'])) as f:
+            self.assertNotIn('sourceMappingURL', f.read())
+
+        # an unchanged build gives the same names
+        self.assertEqual(build(self.static_folder, log=lambda message: None), manifest)
+
+        self.app.static_folder = self.static_folder
+        assets.reload(self.app)
+        data = self.client.get('/').get_data(as_text=True)
+        self.assertIn('/static/' + manifest['base.css'], data)
+        self.assertIn('/static/' + manifest['base.js'], data)
+        self.assertIn('/static/' + manifest['favicon.ico'], data)
+        self.assertNotIn('cdn.bootcss.com', data)
+        self.assertNotIn('/static/js/base.js', data)
+
+        response = self.client.get('/static/' + manifest['base.css'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_data(as_text=True), css)
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertEqual(response.cache_control.max_age,
+                         self.app.config['ASSETS_MAX_AGE'])
+        response.close()
+
+        response = self.client.get('/static/styles.css')
+        self.assertNotIn('immutable', response.headers.get('Cache-Control', ''))
+        response.close()
+
+    def test_stale_outputs_are_removed(self):
+        self.vendor()
+        first = build(self.static_folder, log=lambda message: None)
+        with open(os.path.join(self.static_folder, 'js', 'post.js'), 'a') as f:
+            f.write('\nvar changed = 1;\n')
+        second = build(self.static_folder, log=lambda message: None)
+        self.assertNotEqual(first['post.js'], second['post.js'])
+        # the previous build is kept for pages still referring to it
+        self.assertTrue(os.path.exists(os.path.join(self.static_folder, first['post.js'])))
+        with open(os.path.join(self.static_folder, 'js', 'post.js'), 'a') as f:
+            f.write('\nvar changed = 2;\n')
+        build(self.static_folder, log=lambda message: None)
+        self.assertFalse(os.path.exists(os.path.join(self.static_folder, first['post.js'])))
+
+    def test_minify_css(self):
+        self.assertEqual(minify_css('/* x */\na ,  b  {\n  color : red;\n  content: "a  ;  b";\n}\n'),
+                         'a,b{color : red;content: "a  ;  b"}')
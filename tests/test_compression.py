@@ -0,0 +1,130 @@
+import os
+import unittest
+import zlib
+from flask import Response, jsonify, render_template_string
+from flask_wtf.csrf import generate_csrf
+from app import create_app, db
+from app.models import User, Role, Post, Category
+
+
+def gunzip(data):
+    return zlib.decompress(data, 31)
+
+
+class CompressionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+
+        @self.app.route('/_stream')
+        def stream():
+            return Response(('line %d\n' % i for i in range(3)),
+                            mimetype='text/plain')
+
+        @self.app.route('/_json')
+        def json():
+            return jsonify(items=list(range(500)))
+
+        @self.app.route('/_form')
+        def form():
+            return render_template_string(
+                '<form><input name="keyWord" value="{{ q }}">{{ token }}</form>' + 'x' * 1000,
+                q='reflected', token=generate_csrf())
+
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.init_roles()
+        Category.insert_categories()
+        self.client = self.app.test_client()
+        u = User(email='john@example.com', username='john', password='secret',
+                 confirmed=True)
+        self.post = Post(title='a post', summary='summary', body='body ' * 200,
+                         author=u, category=Category.query.first())
+        db.session.add_all([u, self.post])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_dynamic_responses(self):
+        plain = self.client.get('/_json')
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertIn('Accept-Encoding', plain.headers['Vary'])
+
+        response = self.client.get('/_json', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertLess(len(response.data), len(plain.data))
+        self.assertEqual(int(response.headers['Content-Length']), len(response.data))
+        self.assertEqual(gunzip(response.data), plain.data)
+
+        # not worth it below the threshold
+        self.app.config['COMPRESS_MIN_SIZE'] = len(plain.data) + 1
+        response = self.client.get('/_json', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+
+        response = self.client.get('/_json', headers={'Accept-Encoding': 'gzip;q=0'})
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_streamed_responses(self):
+        response = self.client.get('/_stream', headers={'Accept-Encoding': 'gzip'},
+                                   buffered=False)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', response.headers)
+        decompressor = zlib.decompressobj(31)
+        # every chunk can be decoded as soon as it arrives
+        chunks = [decompressor.decompress(chunk) for chunk in response.response]
+        self.assertEqual(chunks[:3], [b'line 0\n', b'line 1\n', b'line 2\n'])
+        response.close()
+
+    def test_page_etags(self):
+        url = '/post/%d' % self.post.id
+        response = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('a post', gunzip(response.data).decode('utf-8'))
+        etag = response.headers['ETag']
+        self.assertTrue(etag.startswith('W/'))
+
+        response = self.client.get(url, headers={'Accept-Encoding': 'gzip',
+                                                  'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_html_with_a_csrf_token_is_not_compressed(self):
+        response = self.client.get('/_form', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertIn(b'reflected', response.data)
+        # responses without a token still are
+        response = self.client.get('/_json', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+
+    def test_static_files(self):
+        # compressed on first use, not when the app is created
+        self.assertEqual(self.app.extensions['compress'].static_files, {})
+        with open(os.path.join(self.app.static_folder, 'styles.css'), 'rb') as f:
+            data = f.read()
+        response = self.client.get('/static/styles.css')
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(response.data, data)
+        response.close()
+
+        response = self.client.get('/static/styles.css',
+                                   headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.mimetype, 'text/css')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(gunzip(response.data), data)
+        self.assertIn('styles.css', self.app.extensions['compress'].static_files)
+
+        response = self.client.get('/static/styles.css', headers={
+            'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get('/static/missing.css',
+                                   headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 404)
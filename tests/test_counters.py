@@ -0,0 +1,63 @@
+import unittest
+from app import create_app, db
+from app.models import User, Role, Post, Comment
+
+
+class CountersTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.init_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_post_count(self):
+        u = User(email='john@example.com', password='cat')
+        p1 = Post(body='one', author=u)
+        p2 = Post(body='two', author=u)
+        db.session.add_all([u, p1, p2])
+        db.session.commit()
+        self.assertEqual(u.post_count, 2)
+        db.session.delete(p1)
+        db.session.commit()
+        self.assertEqual(u.post_count, 1)
+
+    def test_comment_count(self):
+        p = Post(body='post')
+        c1 = Comment(body='one', post=p)
+        c2 = Comment(body='two', post=p)
+        db.session.add_all([p, c1, c2])
+        db.session.commit()
+        self.assertEqual(p.comment_count, 2)
+
+        # moderated comments are not counted
+        c1.disabled = True
+        db.session.commit()
+        self.assertEqual(p.comment_count, 1)
+        c1.disabled = False
+        db.session.commit()
+        self.assertEqual(p.comment_count, 2)
+
+        db.session.add(Comment(body='three', post=p, disabled=True))
+        db.session.delete(c2)
+        db.session.commit()
+        self.assertEqual(p.comment_count, 1)
+
+    def test_recount(self):
+        u = User(email='john@example.com', password='cat')
+        p = Post(body='post', author=u)
+        db.session.add_all([u, p, Comment(body='one', post=p),
+                            Comment(body='two', post=p, disabled=True)])
+        db.session.commit()
+        db.session.execute(Post.__table__.update().values(comment_count=0))
+        db.session.execute(User.__table__.update().values(post_count=0))
+        Post.recount()
+        User.recount()
+        db.session.commit()
+        self.assertEqual(p.comment_count, 1)
+        self.assertEqual(u.post_count, 1)
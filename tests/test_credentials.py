@@ -0,0 +1,59 @@
+import unittest
+from base64 import b64encode
+from unittest import mock
+from werkzeug.security import check_password_hash
+from app import create_app, db
+from app.models import User, Role
+
+
+class CredentialCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.init_roles()
+        self.client = self.app.test_client()
+        self.user = User(email='john@example.com', username='john',
+                         password='cat', confirmed=True)
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get(self, password):
+        credentials = ('john@example.com:' + password).encode('utf-8')
+        return self.client.get('/api/v1/posts/', headers={
+            'Authorization': 'Basic ' + b64encode(credentials).decode('utf-8'),
+            'Accept': 'application/json'})
+
+    def test_verified_credentials_are_cached(self):
+        with mock.patch('app.models.check_password_hash',
+                        wraps=check_password_hash) as check:
+            self.assertEqual(self.get('cat').status_code, 200)
+            self.assertEqual(self.get('cat').status_code, 200)
+            self.assertEqual(check.call_count, 1)
+
+            # wrong passwords are always checked
+            self.assertEqual(self.get('dog').status_code, 401)
+            self.assertEqual(self.get('dog').status_code, 401)
+            self.assertEqual(check.call_count, 3)
+
+            # a new password invalidates the cached entry
+            self.user.password = 'dog'
+            db.session.commit()
+            self.assertEqual(self.get('cat').status_code, 401)
+            self.assertEqual(self.get('dog').status_code, 200)
+            self.assertEqual(self.get('dog').status_code, 200)
+            self.assertEqual(check.call_count, 5)
+
+    def test_keys_do_not_contain_credentials(self):
+        self.assertEqual(self.get('cat').status_code, 200)
+        cache = self.app.extensions['credential_cache'].cache
+        keys = list(cache._cache)
+        self.assertEqual(len(keys), 1)
+        self.assertNotIn('cat', keys[0])
+        self.assertNotIn('john', keys[0])
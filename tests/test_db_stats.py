@@ -0,0 +1,99 @@
+import unittest
+from app import create_app, db, query_stats
+from app.db_stats import statement_shape
+from app.models import User, Role, Post, Category
+from config import config, TestingConfig
+
+
+class QueryStatsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.init_roles()
+        Category.insert_categories()
+        admin = User(email='admin@example.com', username='admin', password='secret',
+                     confirmed=True, role=Role.query.filter_by(name='Administrator').first())
+        self.post = Post(title='a post', summary='summary', body='body',
+                         author=admin, category=Category.query.first())
+        db.session.add_all([admin, self.post])
+        db.session.commit()
+        self.client = self.app.test_client(use_cookies=True)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_statement_shape(self):
+        self.assertEqual(statement_shape("SELECT a FROM t\n  WHERE id IN (?, ?, ?) AND name = 'x''y' LIMIT 10"),
+                         'SELECT a FROM t WHERE id IN (?) AND name = ? LIMIT ?')
+        self.assertEqual(statement_shape('SELECT anon_1.id FROM t WHERE id IN (%s, %s)'),
+                         'SELECT anon_1.id FROM t WHERE id IN (?)')
+
+    def test_endpoint_stats(self):
+        # queries outside of a request are not counted
+        Post.query.all()
+        for i in range(2):
+            self.assertEqual(self.client.get('/post/%d' % self.post.id).status_code, 200)
+        self.client.get('/')
+
+        stats = query_stats.snapshot()
+        self.assertEqual(set(stats['endpoints']), {'main.post', 'main.index'})
+        post = stats['endpoints']['main.post']
+        self.assertEqual(post['requests'], 2)
+        self.assertGreater(post['queries'], 0)
+        self.assertGreater(post['db_time'], 0)
+        self.assertEqual(sum(post['query_counts']['counts']), 2)
+        self.assertEqual(len(post['query_counts']['counts']),
+                         len(post['query_counts']['bounds']) + 1)
+        self.assertEqual(sum(post['db_times']['counts']), 2)
+        self.assertTrue(post['slowest_statement'].startswith('SELECT'))
+        # no statements are kept unless sampling is turned on
+        self.assertEqual(stats['samples'], [])
+
+        query_stats.reset()
+        self.assertEqual(query_stats.snapshot()['endpoints'], {})
+
+    def test_sampling(self):
+        self.app.config['DB_STATS_SAMPLE_RATE'] = 1
+        self.client.get('/post/%d' % self.post.id)
+        samples = query_stats.snapshot()['samples']
+        self.assertEqual(len(samples), query_stats.snapshot()['endpoints']['main.post']['queries'])
+        self.assertEqual(samples[0]['endpoint'], 'main.post')
+
+    def test_sample_size(self):
+        class SampleConfig(TestingConfig):
+            DB_STATS_SAMPLE_RATE = 1
+            DB_STATS_SAMPLE_SIZE = 1
+
+        config['testing-sample'] = SampleConfig
+        try:
+            app = create_app('testing-sample')
+        finally:
+            del config['testing-sample']
+        with app.app_context():
+            db.create_all()
+            try:
+                self.assertEqual(app.test_client().get('/').status_code, 200)
+                stats = query_stats.snapshot()
+                self.assertGreater(stats['endpoints']['main.index']['queries'], 1)
+                self.assertEqual(len(stats['samples']), 1)
+            finally:
+                db.session.remove()
+                db.drop_all()
+
+    def test_slow_queries_are_logged(self):
+        self.app.config['FLASKY_SLOW_DB_QUERY_TIME'] = 0
+        with self.assertLogs(self.app.logger, 'WARNING') as logs:
+            self.client.get('/post/%d' % self.post.id)
+        self.assertIn('Slow query on main.post: SELECT', logs.output[0])
+
+    def test_stats_page(self):
+        self.assertEqual(self.client.get('/db-stats').status_code, 302)
+        self.client.post('/auth/login', data={'email': 'admin@example.com',
+                                              'password': 'secret'})
+        response = self.client.get('/db-stats')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('auth.login', response.get_json()['endpoints'])
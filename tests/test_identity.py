@@ -0,0 +1,110 @@
+import unittest
+from base64 import b64encode
+from sqlalchemy import event
+from app import create_app, db, identity_cache
+from app.models import User, Role, Permission
+
+
+class IdentityCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.init_roles()
+        self.client = self.app.test_client(use_cookies=True)
+        self.moderator = User(email='mod@example.com', username='mod',
+                              password='secret', confirmed=True,
+                              role=Role.query.filter_by(name='Moderator').first())
+        self.admin = User(email='admin@example.com', username='admin',
+                          password='secret', confirmed=True,
+                          role=Role.query.filter_by(name='Administrator').first())
+        db.session.add_all([self.moderator, self.admin])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def identity_queries(self, method, url, **kwargs):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            if 'FROM users' in statement or 'FROM roles' in statement:
+                statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            response = getattr(self.client, method)(url, **kwargs)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute',
+                         before_cursor_execute)
+        return response, statements
+
+    def login(self, email):
+        response = self.client.post('/auth/login', data={
+            'email': email, 'password': 'secret'})
+        self.assertEqual(response.status_code, 302)
+
+    def test_session_requests_need_no_identity_queries(self):
+        self.login('mod@example.com')
+        response, statements = self.identity_queries('get', '/moderate')
+        self.assertEqual(response.status_code, 200)
+        response, statements = self.identity_queries('get', '/moderate')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(statements, [])
+
+    def test_token_requests_need_no_identity_queries(self):
+        token = self.moderator.generate_auth_token(3600)
+        headers = {
+            'Authorization': 'Basic ' + b64encode(
+                (token + ':').encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json',
+        }
+        self.identity_queries('get', '/api/v1/comments/', headers=headers)
+        response, statements = self.identity_queries(
+            'get', '/api/v1/comments/', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(statements, [])
+
+    def test_role_change_invalidates(self):
+        self.login('mod@example.com')
+        self.assertEqual(self.client.get('/moderate').status_code, 200)
+
+        admin = self.app.test_client(use_cookies=True)
+        admin.post('/auth/login', data={'email': 'admin@example.com',
+                                        'password': 'secret'})
+        response = admin.post('/edit-profile/%d' % self.moderator.id, data={
+            'email': 'mod@example.com', 'username': 'mod', 'confirmed': 'y',
+            'role': Role.query.filter_by(name='User').first().id,
+            'about_me': ''})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.client.get('/moderate').status_code, 403)
+
+    def test_restored_user(self):
+        identity_cache.get(self.moderator.id)
+        db.session.remove()
+        user = identity_cache.get(self.moderator.id)
+        self.assertEqual(user.username, 'mod')
+        self.assertTrue(user.can(Permission.MODERATE))
+        self.assertFalse(user.can(Permission.ADMIN))
+        # everything else is loaded on demand
+        self.assertEqual(user.email, 'mod@example.com')
+        self.assertEqual(user.role.name, 'Moderator')
+        self.assertIsNone(identity_cache.get(1000))
+
+    def test_lru_and_ttl(self):
+        self.app.config['IDENTITY_CACHE_SIZE'] = 1
+        moderator_id, admin_id = self.moderator.id, self.admin.id
+        db.session.expunge_all()
+        identity_cache.get(moderator_id)
+        db.session.expunge_all()
+        identity_cache.get(admin_id)
+        identities = self.app.extensions['identity_cache'].identities
+        self.assertEqual(list(identities), [admin_id])
+
+        # expired snapshots are not used
+        identities[admin_id] = (0, identities[admin_id][1])
+        self.assertIsNone(identity_cache._lookup(admin_id))
+        self.assertEqual(len(identities), 0)
@@ -0,0 +1,235 @@
+import time
+import unittest
+from unittest import mock
+from sqlalchemy import event
+from app import create_app, db
+from app.models import User, Role, Post, Comment, Category
+
+
+class ListingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.init_roles()
+        Category.insert_categories()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_posts(self, count):
+        category = Category.query.first()
+        start = Post.query.count()
+        for i in range(start, start + count):
+            u = User(email='user%d@example.com' % i, username='user%d' % i,
+                     password='cat')
+            p = Post(title='post %d' % i, summary='summary', body='body',
+                     author=u, category=category)
+            db.session.add_all([u, p, Comment(body='hi', post=p),
+                                Comment(body='hello', post=p)])
+        db.session.commit()
+
+    def count_queries(self, url):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            response = self.client.get(url)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute',
+                         before_cursor_execute)
+        self.assertEqual(response.status_code, 200)
+        return len(statements), response.get_data(as_text=True)
+
+    def test_index_query_count_is_constant(self):
+        self.add_posts(1)
+        few, data = self.count_queries('/')
+        self.assertIn('2 评论', data)
+        self.add_posts(5)
+        many, data = self.count_queries('/')
+        self.assertEqual(few, many)
+
+    def test_category_and_user_listings(self):
+        self.add_posts(3)
+        category = Category.query.first()
+        count, data = self.count_queries('/category/%d' % category.id)
+        self.assertIn('post 2', data)
+        count, data = self.count_queries('/user/user1')
+        self.assertIn('post 1', data)
+        self.assertIn('2 评论', data)
+
+    def test_category_sidebar_is_cached(self):
+        self.add_posts(2)
+        counts = Category.post_counts()
+        self.assertEqual([c['post_count'] for c in counts], [2])
+
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            self.assertEqual(Category.post_counts(), counts)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute',
+                         before_cursor_execute)
+        self.assertEqual(statements, [])
+
+        # moving a post to another category invalidates the sidebar
+        post = Post.query.first()
+        post.category = Category.query.filter(
+            Category.id != post.category_id).first()
+        db.session.commit()
+        counts = Category.post_counts()
+        self.assertEqual(sorted(c['post_count'] for c in counts), [1, 1])
+
+    def test_archive_tree_is_updated_incrementally(self):
+        from datetime import datetime
+        from app.archive import archive_years
+        self.add_posts(1)
+        post = Post.query.first()
+        post.timestamp = datetime(2018, 5, 4)
+        db.session.commit()
+        self.assertEqual(archive_years(2018)[2018][5]['5-4'][0]['title'],
+                         'post 0')
+
+        p = Post(title='new post', timestamp=datetime(2019, 1, 2))
+        db.session.add(p)
+        db.session.commit()
+        self.assertEqual(archive_years(2019)[2019][1]['1-2'][0]['id'], p.id)
+
+        post.title = 'renamed'
+        db.session.commit()
+        self.assertEqual(archive_years(2018)[2018][5]['5-4'][0]['title'],
+                         'renamed')
+
+        db.session.delete(post)
+        db.session.commit()
+        self.assertEqual(archive_years(2018), {})
+        count, data = self.count_queries('/archive')
+        self.assertIn('new post', data)
+        self.assertEqual(self.client.get('/archive/2018').status_code, 404)
+        self.assertEqual(self.client.get('/archive/2019').status_code, 200)
+
+    def test_category_sidebar_expires(self):
+        self.add_posts(1)
+        post = Post.query.first()
+        self.assertEqual([c['post_count'] for c in Category.post_counts()], [1])
+
+        # another process adds a post; this one does not hear about it
+        db.engine.execute(Post.__table__.insert(), title='elsewhere',
+                          category_id=post.category_id)
+        self.assertEqual([c['post_count'] for c in Category.post_counts()], [1])
+        later = time.time() + self.app.config['CACHE_TIMEOUT'] + 1
+        with mock.patch('werkzeug.contrib.cache.time', return_value=later):
+            self.assertEqual([c['post_count'] for c in Category.post_counts()], [2])
+
+    def test_archive_tree_expires(self):
+        from datetime import datetime
+        from app.archive import archive_years
+        self.add_posts(1)
+        post = Post.query.first()
+        post.timestamp = datetime(2018, 5, 4)
+        db.session.commit()
+        self.assertEqual(len(archive_years(2018)[2018][5]['5-4']), 1)
+
+        db.engine.execute(Post.__table__.insert(), title='elsewhere',
+                          timestamp=datetime(2018, 5, 4))
+        # patching the tree keeps its expiry
+        post.title = 'renamed'
+        db.session.commit()
+        self.assertEqual(len(archive_years(2018)[2018][5]['5-4']), 1)
+        later = time.time() + self.app.config['CACHE_TIMEOUT'] + 1
+        with mock.patch('werkzeug.contrib.cache.time', return_value=later):
+            self.assertEqual(len(archive_years(2018)[2018][5]['5-4']), 2)
+
+    def test_search(self):
+        from app.search import tokenize, search_posts
+        self.assertEqual(tokenize('Flask 全文检索'),
+                         ['flask', '全文', '文检', '检索'])
+        category = Category.query.first()
+        p1 = Post(title='全文检索', summary='使用 FTS5', body='倒排索引 *markdown*',
+                  category=category)
+        p2 = Post(title='随笔', summary='markdown notes', body='全文 检索 in body',
+                  category=category)
+        db.session.add_all([p1, p2])
+        db.session.commit()
+
+        self.assertEqual(search_posts('检索', 1).items, [p1, p2])
+        self.assertEqual(search_posts('倒排', 1).items, [p1])
+        self.assertEqual(search_posts('markdown', 1).total, 2)
+        self.assertEqual(search_posts('nothing', 1).total, 0)
+
+        # the index follows edits and deletes
+        p2.body = 'nothing here'
+        db.session.delete(p1)
+        db.session.commit()
+        self.assertEqual(search_posts('检索', 1).total, 0)
+        self.assertEqual(search_posts('nothing', 1).items, [p2])
+
+        count, data = self.count_queries('/search/?keyWord=nothing')
+        self.assertIn('随笔', data)
+
+    def add_replies(self, post, count):
+        parent = Comment(body='first', user_name='first', post=post)
+        db.session.add(parent)
+        db.session.commit()
+        for i in range(count):
+            reply = Comment(body='reply %d' % i, user_name='user %d' % i,
+                            post=post, replay_id=parent.id)
+            db.session.add(reply)
+            db.session.commit()
+            parent = reply
+
+    def test_post_comments_query_count_is_constant(self):
+        self.add_posts(1)
+        post = Post.query.first()
+        self.add_replies(post, 1)
+        few, data = self.count_queries('/post/%d' % post.id)
+        self.assertIn('@first', data)
+        self.add_replies(post, 5)
+        many, data = self.count_queries('/post/%d' % post.id)
+        self.assertEqual(few, many)
+
+        hidden = Comment.query.filter_by(body='reply 3').one()
+        hidden.disabled = True
+        db.session.commit()
+        count, data = self.count_queries('/post/%d' % post.id)
+        self.assertNotIn('reply 3', data)
+        self.assertNotIn('@user 3', data)
+        self.assertIn('reply 4', data)
+
+    def test_comment_threads(self):
+        from app.listing import comment_tree
+        self.add_posts(1)
+        post = Post.query.first()
+        self.add_replies(post, 2)
+        first = Comment.query.filter_by(body='first').one()
+        reply = Comment.query.filter_by(body='reply 1').one()
+        self.assertIsNone(first.root_id)
+        self.assertEqual(reply.root_id, first.id)
+        self.assertEqual(reply.depth, 2)
+
+        tree = comment_tree(post.id)
+        self.assertEqual([node['comment'].body for node in tree],
+                         ['hi', 'hello', 'first'])
+        node = tree[2]['replies'][0]
+        self.assertEqual(node['comment'].body, 'reply 0')
+        self.assertEqual(node['replies'][0]['comment'].body, 'reply 1')
+
+        thread = comment_tree(post.id, first.id)
+        self.assertEqual(len(thread), 1)
+
+        Comment.query.filter_by(body='reply 0').one().disabled = True
+        db.session.commit()
+        tree = comment_tree(post.id, first.id)
+        self.assertEqual([node['comment'].body for node in tree],
+                         ['first', 'reply 1'])
@@ -0,0 +1,118 @@
+import asyncore
+import smtpd
+import threading
+import time
+import unittest
+from flask_mail import Message
+from app import create_app, mail_queue
+
+
+class StandInServer(smtpd.SMTPServer):
+    """A local SMTP server that keeps what it receives; the first
+    ``failures`` messages are refused with a temporary error."""
+
+    def __init__(self, failures=0, delay=0):
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None, decode_data=True)
+        self.port = self.socket.getsockname()[1]
+        self.failures = failures
+        self.delay = delay
+        self.connections = 0
+        self.messages = []
+
+    def handle_accepted(self, conn, addr):
+        self.connections += 1
+        smtpd.SMTPServer.handle_accepted(self, conn, addr)
+
+    def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+        time.sleep(self.delay)
+        if self.failures:
+            self.failures -= 1
+            return '451 try again later'
+        self.messages.append((rcpttos, data))
+
+
+class MailQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        self.server.close()
+        self.loop.join(5)
+        self.app_context.pop()
+
+    def start_server(self, **kwargs):
+        self.server = StandInServer(**kwargs)
+        self.loop = threading.Thread(
+            target=asyncore.loop, kwargs={'timeout': 0.05, 'map': None})
+        self.loop.daemon = True
+        self.loop.start()
+        self.app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=self.server.port,
+                               MAIL_USE_TLS=False, MAIL_USE_SSL=False,
+                               MAIL_SUPPRESS_SEND=False, MAIL_QUEUE_BACKOFF=0.01)
+        # Flask-Mail reads its settings at init_app
+        self.app.extensions['mail'].server = '127.0.0.1'
+        self.app.extensions['mail'].port = self.server.port
+        self.app.extensions['mail'].use_tls = False
+        self.app.extensions['mail'].use_ssl = False
+        self.app.extensions['mail'].suppress = False
+
+    def message(self, i):
+        return Message('hello %d' % i, sender='blog@example.com',
+                       recipients=['user%d@example.com' % i], body='hi')
+
+    def test_batches_share_a_connection(self):
+        self.app.config['MAIL_QUEUE_WORKERS'] = 1
+        self.start_server()
+        for i in range(10):
+            self.assertTrue(mail_queue.enqueue(self.message(i)))
+        self.assertTrue(mail_queue.flush(timeout=10))
+        self.assertEqual(len(self.server.messages), 10)
+        self.assertLess(self.server.connections, 10)
+        stats = mail_queue.stats()
+        self.assertEqual(stats['sent'], 10)
+        self.assertEqual(stats['waiting'], 0)
+
+    def test_temporary_failures_are_retried(self):
+        self.start_server(failures=2)
+        self.assertTrue(mail_queue.enqueue(self.message(1)))
+        self.assertTrue(mail_queue.flush(timeout=10))
+        self.assertEqual(len(self.server.messages), 1)
+        stats = mail_queue.stats()
+        self.assertEqual(stats['retried'], 2)
+        self.assertEqual(stats['sent'], 1)
+
+    def test_gives_up_after_retries(self):
+        self.app.config['MAIL_QUEUE_RETRIES'] = 1
+        self.start_server(failures=5)
+        mail_queue.enqueue(self.message(1))
+        self.assertTrue(mail_queue.flush(timeout=10))
+        self.assertEqual(self.server.messages, [])
+        self.assertEqual(mail_queue.stats()['failed'], 1)
+
+    def test_full_queue_drops(self):
+        self.app.config.update(MAIL_QUEUE_WORKERS=1, MAIL_QUEUE_PUT_TIMEOUT=0)
+        self.app.extensions['mail_queue'].queue.maxsize = 1
+        self.start_server(delay=0.2)
+        results = [mail_queue.enqueue(self.message(i)) for i in range(5)]
+        self.assertTrue(mail_queue.flush(timeout=10))
+        stats = mail_queue.stats()
+        self.assertGreater(stats['dropped'], 0)
+        self.assertEqual(results.count(False), stats['dropped'])
+        self.assertEqual(len(self.server.messages), stats['sent'])
+        self.assertEqual(stats['sent'] + stats['dropped'], 5)
+
+    def test_retries_do_not_hold_up_the_worker(self):
+        self.app.config['MAIL_QUEUE_WORKERS'] = 1
+        self.start_server(failures=1)
+        self.app.config['MAIL_QUEUE_BACKOFF'] = 0.5
+        mail_queue.enqueue(self.message(1))
+        deadline = time.time() + 5
+        while mail_queue.stats().get('retried') != 1 and time.time() < deadline:
+            time.sleep(0.01)
+        mail_queue.enqueue(self.message(2))
+        self.assertTrue(mail_queue.flush(timeout=10))
+        # the second message went out while the first waited for its retry
+        self.assertEqual([rcpttos for rcpttos, data in self.server.messages],
+                         [['user2@example.com'], ['user1@example.com']])
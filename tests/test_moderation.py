@@ -0,0 +1,128 @@
+import unittest
+import json
+from base64 import b64encode
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from app import create_app, db
+from app.exceptions import ValidationError
+from app.models import User, Role, Post, Comment
+
+
+class ModerationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.init_roles()
+        self.client = self.app.test_client(use_cookies=True)
+        self.moderator = User(email='mod@example.com', username='mod',
+                              password='secret', confirmed=True,
+                              role=Role.query.filter_by(name='Moderator').first())
+        self.p1 = Post(body='one')
+        self.p2 = Post(body='two')
+        now = datetime.utcnow()
+        for i in range(10):
+            db.session.add(Comment(body='spam %d' % i, email='spam@example.com',
+                                   post=self.p1 if i % 2 else self.p2,
+                                   timestamp=now - timedelta(hours=i)))
+        db.session.add_all([self.moderator, self.p1, self.p2,
+                            Comment(body='ham', email='ham@example.com', post=self.p1)])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_moderate_is_one_update(self):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        condition = Comment.selection(email='spam@example.com')
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            count = Comment.moderate(condition, disabled=True)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute',
+                         before_cursor_execute)
+        db.session.commit()
+        self.assertEqual(count, 10)
+        self.assertEqual(
+            len([s for s in statements if s.startswith('UPDATE comments')]), 1)
+        self.assertEqual(self.p1.comment_count, 1)
+        self.assertEqual(self.p2.comment_count, 0)
+
+        # enabling them again restores the counts
+        Comment.moderate(Comment.selection(post_id=self.p2.id), disabled=False)
+        db.session.commit()
+        self.assertEqual(self.p2.comment_count, 5)
+
+    def test_selection(self):
+        with self.assertRaises(ValidationError):
+            Comment.selection()
+        since = datetime.utcnow() - timedelta(hours=2, minutes=30)
+        self.assertEqual(Comment.query.filter(
+            Comment.selection(email='spam@example.com', since=since)).count(), 3)
+        ids = [c.id for c in Comment.query.limit(4)]
+        Comment.moderate(Comment.selection(ids=ids[:2]), disabled=False)
+        db.session.commit()
+        self.assertEqual(Comment.query.filter(
+            Comment.selection(ids=ids, pending=True)).count(), 2)
+
+    def test_moderate_view(self):
+        response = self.client.post('/auth/login', data={
+            'email': 'mod@example.com', 'password': 'secret'})
+        self.assertEqual(response.status_code, 302)
+        response = self.client.post('/moderate/bulk', data={
+            'post_id': self.p1.id, 'email': 'spam@example.com',
+            'disable': '屏蔽'}, follow_redirects=True)
+        self.assertIn('已屏蔽 5 条评论', response.get_data(as_text=True))
+        self.assertEqual(self.p1.comment_count, 1)
+
+        ham = Comment.query.filter_by(body='ham').one()
+        response = self.client.post('/moderate/bulk', data={
+            'ids': [ham.id], 'disable': '屏蔽'}, follow_redirects=True)
+        self.assertIn('已屏蔽 1 条评论', response.get_data(as_text=True))
+        self.assertEqual(self.p1.comment_count, 0)
+
+        response = self.client.get('/moderate?pending=1')
+        data = response.get_data(as_text=True)
+        for comment in Comment.query:
+            checkbox = 'name="ids" value="%d"' % comment.id
+            if comment.disabled is None:
+                self.assertIn(checkbox, data)
+            else:
+                self.assertNotIn(checkbox, data)
+
+    def test_moderate_api(self):
+        headers = {
+            'Authorization': 'Basic ' + b64encode(
+                b'mod@example.com:secret').decode('utf-8'),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        }
+        response = self.client.post('/api/v1/comments/moderate', headers=headers,
+                                    data=json.dumps({'action': 'disable',
+                                                     'email': 'spam@example.com',
+                                                     'until': '2000-01-01T00:00:00'}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.get_data(as_text=True))['count'], 0)
+
+        response = self.client.post('/api/v1/comments/moderate', headers=headers,
+                                    data=json.dumps({'action': 'disable'}))
+        self.assertEqual(response.status_code, 400)
+
+        for post_id in (str(self.p1.id), [self.p1.id]):
+            response = self.client.post('/api/v1/comments/moderate', headers=headers,
+                                        data=json.dumps({'action': 'disable',
+                                                         'post_id': post_id}))
+            self.assertEqual(response.status_code, 400)
+
+        response = self.client.post('/api/v1/comments/moderate', headers=headers,
+                                    data=json.dumps({'action': 'disable',
+                                                     'email': 'spam@example.com'}))
+        self.assertEqual(json.loads(response.get_data(as_text=True))['count'], 10)
+        self.assertEqual(self.p1.comment_count, 1)
@@ -0,0 +1,154 @@
+import unittest
+from base64 import b64encode
+from datetime import datetime, timedelta
+from flask import render_template, render_template_string
+from jinja2 import ChoiceLoader, DictLoader
+from app import create_app, db, query_stats
+from app.db_stats import NPlusOneError
+from app.models import User, Role, Post, Comment, Category
+
+
+class NPlusOneTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.jinja_loader = ChoiceLoader([
+            DictLoader({'_authors.html':
+                        '{% for post in posts %}{{ post.author.username }}{% endfor %}',
+                        '_page.html': '{{ posts|length }}{% include "_authors.html" %}'}),
+            self.app.jinja_loader])
+
+        @self.app.route('/_authors')
+        def authors():
+            return render_template('_authors.html', posts=Post.query.all())
+
+        @self.app.route('/_page')
+        def page():
+            return render_template('_page.html', posts=Post.query.all())
+
+        @self.app.route('/_posts')
+        def posts():
+            return ','.join(Post.query.get(id).title for id in self.ids)
+
+        @self.app.route('/_touch')
+        def touch():
+            for id in self.ids:
+                Post.query.filter_by(id=id).update({'title': 'touched'})
+            db.session.commit()
+            return ''
+
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.init_roles()
+        Category.insert_categories()
+        self.client = self.app.test_client(use_cookies=True)
+        self.moderator = User(email='mod@example.com', username='mod',
+                              password='secret', confirmed=True,
+                              role=Role.query.filter_by(name='Moderator').first())
+        db.session.add(self.moderator)
+        now = datetime.utcnow()
+        categories = Category.query.all()
+        for i in range(12):
+            author = User(email='user%d@example.com' % i, username='user%d' % i,
+                          password='secret', confirmed=True)
+            post = Post(title='post %d' % i, summary='summary', body='body %d' % i,
+                        author=author, category=categories[i % len(categories)],
+                        timestamp=now - timedelta(days=40 * i))
+            db.session.add_all([author, post])
+            for j in range(8):
+                comment = Comment(body='comment %d' % j, user_name='reader %d' % j,
+                                  email='reader%d@example.com' % j, post=post)
+                db.session.add(comment)
+                if j % 2:
+                    db.session.flush()
+                    db.session.add(Comment(body='reply %d' % j, user_name='author',
+                                           post=post, replay=comment))
+        db.session.commit()
+        self.post = Post.query.first()
+        self.ids = [post.id for post in Post.query]
+        db.session.remove()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def api_headers(self):
+        return {'Authorization': 'Basic ' + b64encode(
+                    b'mod@example.com:secret').decode('utf-8'),
+                'Accept': 'application/json'}
+
+    def test_repeated_statements_fail(self):
+        with self.assertRaises(NPlusOneError) as cm:
+            self.client.get('/_posts')
+        finding = cm.exception.findings[0]
+        self.assertEqual(finding.endpoint, 'posts')
+        self.assertEqual(finding.count, len(self.ids))
+        self.assertIn('WHERE posts.id = ?', finding.shape)
+
+    def test_findings_name_the_template(self):
+        self.app.config['NPLUSONE_RAISE'] = False
+        with self.assertLogs(self.app.logger, 'WARNING') as logs:
+            with query_stats.capture() as findings:
+                response = self.client.get('/_authors')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(findings), 1)
+        self.assertEqual(findings[0].template, '_authors.html')
+        self.assertEqual(findings[0].endpoint, 'authors')
+        self.assertIn('N+1 queries on authors (template _authors.html)', logs.output[0])
+
+        # below the threshold
+        self.app.config['NPLUSONE_THRESHOLD'] = len(self.ids)
+        with query_stats.capture() as findings:
+            self.client.get('/_authors')
+        self.assertEqual(findings, [])
+
+    def test_findings_name_the_included_template(self):
+        self.app.config['NPLUSONE_RAISE'] = False
+        with query_stats.capture() as findings:
+            self.client.get('/_page')
+        self.assertEqual(len(findings), 1)
+        self.assertEqual(findings[0].template, '_authors.html')
+
+    def test_only_selects_are_counted(self):
+        self.assertEqual(self.client.get('/_touch').status_code, 200)
+
+    def test_pages(self):
+        # any N+1 query raises NPlusOneError
+        post = '/post/%d' % self.post.id
+        for url in ['/', '/?page=2', post, post + '?page=-1', '/archive',
+                    '/archive/%d' % self.post.timestamp.year,
+                    '/category/%d' % self.post.category_id, '/search/?keyWord=post',
+                    '/user/user1', '/about']:
+            self.assertEqual(self.client.get(url).status_code, 200, url)
+
+        self.client.post('/auth/login', data={'email': 'mod@example.com',
+                                              'password': 'secret'})
+        for url in ['/', post, '/moderate', '/moderate?pending=1',
+                    '/edit/%d' % self.post.id]:
+            response = self.client.get(url)
+            self.assertIn(response.status_code, (200, 403), url)
+
+    def test_api(self):
+        post = '/api/v1/posts/%d' % self.post.id
+        for url in ['/api/v1/posts/', '/api/v1/posts/?cursor=',
+                    '/api/v1/posts/?embed=author,category&fields=id,title',
+                    post, post + '?embed=author', post + '/comments/',
+                    post + '/comments/tree', '/api/v1/comments/',
+                    '/api/v1/users/%d' % self.post.author_id,
+                    '/api/v1/users/%d/posts/' % self.post.author_id]:
+            response = self.client.get(url, headers=self.api_headers())
+            self.assertEqual(response.status_code, 200, url)
+
+    def test_template_string_has_no_name(self):
+        self.app.config['NPLUSONE_RAISE'] = False
+        with self.app.test_request_context('/'):
+            self.app.preprocess_request()
+            with query_stats.capture() as findings:
+                render_template_string(
+                    '{% for post in posts %}{{ post.author.username }}{% endfor %}',
+                    posts=Post.query.all())
+                self.app.process_response(self.app.response_class())
+            self.app.do_teardown_request()
+        self.assertEqual(len(findings), 1)
+        self.assertIsNone(findings[0].template)
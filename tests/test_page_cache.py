@@ -0,0 +1,162 @@
+import unittest
+from sqlalchemy import event
+from app import create_app, db
+from app.models import User, Role, Post, Comment, Category
+
+
+class PageCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.init_roles()
+        Category.insert_categories()
+        self.client = self.app.test_client(use_cookies=True)
+        u = User(email='john@example.com', username='john', password='secret',
+                 confirmed=True)
+        self.post = Post(title='a post', summary='summary', body='body',
+                         author=u, category=Category.query.first())
+        db.session.add_all([u, self.post])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get(self, url, **kwargs):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            response = self.client.get(url, **kwargs)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute',
+                         before_cursor_execute)
+        return response, statements
+
+    def test_anonymous_pages_are_cached(self):
+        url = '/post/%d' % self.post.id
+        response, statements = self.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(statements)
+        etag = response.headers['ETag']
+        self.assertIsNotNone(response.headers.get('Last-Modified'))
+
+        # served from the cache after a single query for the version
+        response, statements = self.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertIn('a post', response.get_data(as_text=True))
+
+        # conditional requests are answered with 304
+        response, statements = self.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get_data(), b'')
+
+        # a new comment changes the post page and the listings
+        index_etag = self.get('/')[0].headers['ETag']
+        db.session.add(Comment(body='new comment', post=self.post))
+        db.session.commit()
+        response, statements = self.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertIn('new comment', response.get_data(as_text=True))
+        self.assertNotEqual(self.get('/')[0].headers['ETag'], index_etag)
+
+    def test_changes_made_elsewhere(self):
+        # writes that bypass this process's session, as a CLI command or a
+        # manual edit would make
+        url = '/post/%d' % self.post.id
+        etag = self.get(url)[0].headers['ETag']
+        db.engine.execute(Comment.__table__.insert(), body='elsewhere',
+                          post_id=self.post.id)
+        response = self.get(url, headers={'If-None-Match': etag})[0]
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+
+        db.engine.execute(Post.__table__.update().values(title='retitled'))
+        # the session outlives the requests here
+        db.session.expire_all()
+        response = self.get(url, headers={'If-None-Match': etag})[0]
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('retitled', response.get_data(as_text=True))
+
+    def test_listings_are_versioned_by_page(self):
+        other = Category.query.filter(Category.id != self.post.category_id).first()
+        year = self.post.timestamp.year
+        urls = ['/', '/category/%d' % self.post.category_id, '/category/%d' % other.id,
+                '/archive', '/archive/%d' % year]
+
+        def etags():
+            return [self.get(url)[0].headers['ETag'] for url in urls]
+
+        # a single lookup by primary key validates a cached listing
+        self.get('/')
+        response, statements = self.get('/')
+        self.assertEqual(len(statements), 1)
+        self.assertIn('FROM page_versions', statements[0])
+
+        before = etags()
+        db.session.add(Comment(body='new comment', post=self.post))
+        db.session.commit()
+        after = etags()
+        # the index and the post's category show the comment count
+        self.assertEqual([a != b for a, b in zip(before, after)],
+                         [True, True, False, False, False])
+
+        self.post.body = 'new body'
+        db.session.commit()
+        self.assertEqual(etags(), after)
+
+        self.post.category = other
+        db.session.commit()
+        moved = etags()
+        self.assertEqual([a != b for a, b in zip(after, moved)],
+                         [True, True, True, False, False])
+
+        self.post.title = 'retitled'
+        db.session.commit()
+        self.assertEqual([a != b for a, b in zip(moved, etags())],
+                         [True, False, True, True, True])
+
+    def test_recount_changes_the_listings(self):
+        etag = self.get('/')[0].headers['ETag']
+        Post.recount()
+        db.session.commit()
+        self.assertNotEqual(self.get('/')[0].headers['ETag'], etag)
+
+    def test_renames_change_the_pages(self):
+        url = '/post/%d' % self.post.id
+        etag = self.get(url)[0].headers['ETag']
+        self.post.author.username = 'jack'
+        db.session.commit()
+        response = self.get(url, headers={'If-None-Match': etag})[0]
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+
+        index_etag = self.get('/')[0].headers['ETag']
+        self.post.category.name = 'renamed'
+        db.session.commit()
+        response = self.get(url, headers={'If-None-Match': etag})[0]
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(self.get('/')[0].headers['ETag'], index_etag)
+
+        index_etag = self.get('/')[0].headers['ETag']
+        self.post.author.username = 'jim'
+        db.session.commit()
+        self.assertNotEqual(self.get('/')[0].headers['ETag'], index_etag)
+
+    def test_logged_in_users_bypass_the_cache(self):
+        self.client.post('/auth/login', data={
+            'email': 'john@example.com',
+            'password': 'secret'
+        })
+        response, statements = self.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response.headers)
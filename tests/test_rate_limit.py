@@ -0,0 +1,135 @@
+import os
+import json
+import tempfile
+import unittest
+from base64 import b64encode
+from sqlalchemy import event
+from app import create_app, db
+from app.models import User, Role, Post
+from app.rate_limit import MemoryStore, SQLiteStore, parse_limit
+
+
+class RateLimitTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['RATELIMIT_COMMENT'] = '2/minute'
+        self.app.config['RATELIMIT_LOGIN'] = '3/minute'
+        self.app.config['RATELIMIT_API'] = '5/minute'
+        self.app.config['RATELIMIT_API_IP'] = '8/minute'
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.init_roles()
+        self.client = self.app.test_client()
+        user = User(email='john@example.com', username='john',
+                    password='secret', confirmed=True)
+        self.post = Post(body='a post', author=user)
+        db.session.add_all([user, self.post])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def post_comment(self):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            response = self.client.post('/comment/%d' % self.post.id, data={
+                'name': 'john', 'email': 'john@example.com',
+                'url': 'http://example.com', 'body': 'a comment'})
+        finally:
+            event.remove(db.engine, 'before_cursor_execute',
+                         before_cursor_execute)
+        return response, statements
+
+    def test_parse_limit(self):
+        self.assertEqual(parse_limit('10/minute'), (10, 60))
+        with self.assertRaises(ValueError):
+            parse_limit('10 per minute')
+
+    def test_comments_are_limited_per_ip(self):
+        for i in range(2):
+            response, statements = self.post_comment()
+            self.assertEqual(response.status_code, 302)
+        response, statements = self.post_comment()
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(int(response.headers['Retry-After']) > 0)
+        # rejected before touching the database
+        self.assertEqual(statements, [])
+        self.assertEqual(self.post.comment_count, 2)
+
+        # dropping the session cookie does not help
+        self.client.cookie_jar.clear()
+        response, statements = self.post_comment()
+        self.assertEqual(response.status_code, 429)
+
+    def test_login_posts_are_limited(self):
+        for i in range(5):
+            self.assertEqual(self.client.get('/auth/login').status_code, 200)
+        for i in range(3):
+            response = self.client.post('/auth/login', data={
+                'email': 'john@example.com', 'password': 'wrong!'})
+            self.assertEqual(response.status_code, 200)
+        response = self.client.post('/auth/login', data={
+            'email': 'john@example.com', 'password': 'secret'})
+        self.assertEqual(response.status_code, 429)
+
+    def test_api_is_limited_per_user(self):
+        headers = {
+            'Authorization': 'Basic ' + b64encode(
+                b'john@example.com:secret').decode('utf-8'),
+            'Accept': 'application/json',
+        }
+        for i in range(5):
+            response = self.client.get('/api/v1/posts/', headers=headers)
+            self.assertEqual(response.status_code, 200)
+        response = self.client.get('/api/v1/posts/', headers=headers)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(json.loads(response.get_data(as_text=True))['error'],
+                         'too many requests')
+
+    def test_api_is_limited_per_ip(self):
+        # a new made-up username per request still counts against the IP
+        for i in range(8):
+            response = self.client.get('/api/v1/posts/', headers={
+                'Authorization': 'Basic ' + b64encode(
+                    ('user%d:secret' % i).encode('utf-8')).decode('utf-8'),
+                'Accept': 'application/json'})
+            self.assertEqual(response.status_code, 401)
+        response = self.client.get('/api/v1/posts/', headers={
+            'Authorization': 'Basic ' + b64encode(
+                b'john@example.com:secret').decode('utf-8'),
+            'Accept': 'application/json'})
+        self.assertEqual(response.status_code, 429)
+
+    def test_disabled(self):
+        self.app.config['RATELIMIT_ENABLED'] = False
+        for i in range(3):
+            response, statements = self.post_comment()
+            self.assertEqual(response.status_code, 302)
+
+
+class StoreTestCase(unittest.TestCase):
+    def check_store(self, first, second):
+        self.assertEqual(first.hit('a:2', 'a:1', 120), (0, 1))
+        self.assertEqual(second.hit('a:2', 'a:1', 120), (0, 2))
+        self.assertEqual(first.hit('a:3', 'a:2', 120), (2, 1))
+        self.assertEqual(second.hit('b:3', 'b:2', 120), (0, 1))
+
+    def test_memory_store(self):
+        store = MemoryStore()
+        self.check_store(store, store)
+
+    def test_sqlite_store_is_shared(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            self.check_store(SQLiteStore(path), SQLiteStore(path))
+        finally:
+            os.remove(path)
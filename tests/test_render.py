@@ -0,0 +1,185 @@
+import os
+import signal
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import Future
+from unittest import mock
+from sqlalchemy import event
+from app import create_app, db, renderer
+from app.models import Role, Post, Comment
+
+
+class RenderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        # the render pool writes back on its own connection, so the
+        # database has to outlive a single in-memory connection
+        fd, self.db_path = tempfile.mkstemp()
+        os.close(fd)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + self.db_path
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.init_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        os.remove(self.db_path)
+
+    def wait_for_html(self, obj):
+        for i in range(100):
+            db.session.expire(obj)
+            if obj.body_html is not None:
+                return obj.body_html
+            time.sleep(0.1)
+        self.fail('body was not rendered')
+
+    def test_inline_render(self):
+        p = Post(body='body of the *blog* post')
+        self.assertEqual(p.body_html, '<p>body of the <em>blog</em> post</p>')
+
+    def test_table_of_contents(self):
+        p = Post(body='# 简介\n\ntext\n\n## Setup steps\n\n#### too deep')
+        self.assertIn('<h1 id="简介">简介</h1>', p.body_html)
+        self.assertIn('<a href="#简介">简介</a>', p.toc_html)
+        self.assertIn('<a href="#setup-steps">Setup steps</a>', p.toc_html)
+        self.assertNotIn('too deep', p.toc_html)
+        self.assertIsNone(Post(body='no headings').toc_html)
+
+    def test_background_render(self):
+        self.app.config['RENDER_WORKERS'] = 1
+        p = Post(body='body of the *blog* post')
+        self.assertIsNone(p.body_html)
+        db.session.add(p)
+        c = Comment(body='a <script>comment</script>', post=p)
+        db.session.add(c)
+        db.session.commit()
+        self.assertEqual(self.wait_for_html(p),
+                         '<p>body of the <em>blog</em> post</p>')
+        self.assertEqual(self.wait_for_html(c), 'a comment')
+
+        # the same body again is served from the render cache
+        p2 = Post(body='body of the *blog* post')
+        self.assertEqual(p2.body_html, p.body_html)
+
+    def test_background_render_goes_through_the_session(self):
+        from app.search import search_posts
+        self.app.config['RENDER_WORKERS'] = 1
+        p = Post(title='title', body='see [the docs](http://example.com/hidden)')
+        db.session.add(p)
+        db.session.commit()
+        created = p.update_time
+        # indexed from the raw body until the HTML is there
+        self.assertEqual(search_posts('hidden', 1).total, 1)
+        self.wait_for_html(p)
+        self.assertGreater(p.update_time, created)
+        self.assertEqual(search_posts('hidden', 1).total, 0)
+        self.assertEqual(search_posts('docs', 1).total, 1)
+
+    def test_results_are_written_by_the_writer_thread(self):
+        self.app.config['RENDER_WORKERS'] = 1
+        state = self.app.extensions['renderer']
+        c = Comment(body='*done*')
+        db.session.add(c)
+        db.session.commit()
+        pending = Comment(body='pending')
+        db.session.add(pending)
+
+        # a job that is already done when its callback is added
+        done = Future()
+        done.set_result({'body_html': '<em>done</em>'})
+        threads = []
+        renderer.submit('comment', Comment, 0, 'warm up').result()
+        with mock.patch.object(state.pool, 'submit', return_value=done):
+            renderer.submit('comment', Comment, c.id, '*done*',
+                            callback=lambda: threads.append(threading.current_thread()))
+        # the request's session was left alone
+        self.assertIn(pending, db.session.new)
+        state.results.join()
+        self.assertEqual(threads, [state.writer])
+        self.assertEqual(self.wait_for_html(c), '<em>done</em>')
+
+    def test_broken_pool_is_replaced(self):
+        self.app.config['RENDER_WORKERS'] = 1
+        state = self.app.extensions['renderer']
+        renderer.submit('comment', Comment, 0, 'warm up').result()
+        for pid in list(state.pool._processes):
+            os.kill(pid, signal.SIGKILL)
+        time.sleep(0.5)
+        with self.assertLogs(self.app.logger, 'WARNING'):
+            future = renderer.submit('comment', Comment, 0, '*again*')
+        self.assertEqual(future.result(timeout=10), {'body_html': '<em>again</em>'})
+
+    def test_rerender(self):
+        from app.render import rerender
+        from app.search import reindex, search_posts
+        posts = [Post(body='# post %d' % i) for i in range(5)]
+        db.session.add_all(posts)
+        db.session.add(Comment(body='*comment*', post=posts[0]))
+        db.session.commit()
+        db.session.execute(Post.__table__.update().values(body_html='stale',
+                                                          toc_html=None))
+        db.session.execute(Comment.__table__.update().values(body_html='stale'))
+        reindex()
+        db.session.commit()
+        rendered_at = posts[4].update_time
+
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append((statement, executemany))
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            progress = list(rerender('post', Post, chunk_size=2,
+                                     workers=2, start_id=posts[0].id))
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        self.assertEqual(progress, [(2, posts[2].id), (2, posts[4].id)])
+        # only the id and body are read, and each chunk is one executemany
+        selects = [statement for statement, many in statements
+                   if statement.startswith('SELECT posts.id AS posts_id, '
+                                           'posts.body AS posts_body \nFROM')]
+        self.assertEqual(len(selects), 3)
+        updates = [many for statement, many in statements
+                   if statement.startswith('UPDATE posts SET body_html')]
+        self.assertEqual(updates, [True, True])
+        db.session.expire_all()
+        self.assertEqual(posts[0].body_html, 'stale')
+        self.assertEqual(posts[4].body_html, '<h1 id="post-4">post 4</h1>')
+        self.assertIn('#post-4', posts[4].toc_html)
+        self.assertGreater(posts[4].update_time, rendered_at)
+        # re-indexed from the new HTML
+        self.assertEqual(search_posts('stale', 1).total, 1)
+
+        list(rerender('comment', Comment, workers=1))
+        db.session.expire_all()
+        self.assertEqual(Comment.query.first().body_html, '<em>comment</em>')
+
+    def test_rerender_skips_failing_rows(self):
+        from app import render
+        p = Post(body='fine')
+        bad = Post(body='bad')
+        db.session.add_all([p, bad])
+        db.session.commit()
+        db.session.execute(Post.__table__.update().values(body_html='stale'))
+        db.session.commit()
+
+        def render_post(body):
+            if body == 'bad':
+                raise ValueError(body)
+            return {'body_html': body, 'toc_html': None}
+
+        renderers = dict(render.renderers, post=render_post)
+        with mock.patch.object(render, 'renderers', renderers), \
+                self.assertLogs(self.app.logger, 'ERROR') as logs:
+            progress = list(render.rerender('post', Post, workers=1))
+        self.assertEqual(progress, [(1, bad.id)])
+        self.assertIn('Rendering post %d failed' % bad.id, logs.output[0])
+        db.session.expire_all()
+        self.assertEqual(p.body_html, 'fine')
+        self.assertEqual(bad.body_html, 'stale')
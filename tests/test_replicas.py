@@ -0,0 +1,122 @@
+import os
+import shutil
+import tempfile
+import unittest
+from flask import jsonify
+from app import create_app, db
+from app.replicas import primary
+from app.models import Post, Category
+from app.search import SQLiteSearch, search_posts
+from config import config, TestingConfig
+
+
+class ReplicaTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+        class ReplicaConfig(TestingConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(self.tmp, 'primary.sqlite')
+            SQLALCHEMY_REPLICA_URIS = ['sqlite:///' + os.path.join(self.tmp, 'replica.sqlite')]
+
+        config['testing-replica'] = ReplicaConfig
+        self.app = create_app('testing-replica')
+
+        @self.app.route('/_post/<int:id>', methods=['GET', 'POST'])
+        def read(id):
+            titles = []
+            if 'write' in self.client_args:
+                db.session.add(Category(name='new'))
+                db.session.flush()
+            titles.append(Post.query.get(id).title)
+            return jsonify(titles=titles)
+
+        @self.app.route('/_primary/<int:id>')
+        @primary
+        def read_primary(id):
+            return jsonify(titles=[Post.query.get(id).title])
+
+        @self.app.route('/_text/<int:id>')
+        def read_after_text(id):
+            db.session.execute('SELECT 1')
+            titles = [Post.query.get(id).title]
+            with db.primary_reads():
+                db.session.expire_all()
+                titles.append(Post.query.get(id).title)
+            return jsonify(titles=titles)
+
+        self.client_args = set()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.replica = db.get_engine(self.app, 'replica_0')
+        db.Model.metadata.create_all(bind=self.replica)
+        # the replica has an older copy of the post
+        self.replica.execute(Post.__table__.insert(), id=1, title='replica')
+        db.session.add(Post(id=1, title='primary'))
+        db.session.commit()
+        db.session.remove()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        del config['testing-replica']
+        shutil.rmtree(self.tmp)
+
+    def title(self, method='get'):
+        response = getattr(self.client, method)('/_post/1')
+        db.session.remove()
+        return response.get_json()['titles'][0]
+
+    def test_get_reads_from_replica(self):
+        self.assertEqual(self.title(), 'replica')
+        self.assertEqual(self.title('post'), 'primary')
+        # outside a request everything goes to the primary
+        self.assertEqual(Post.query.get(1).title, 'primary')
+
+    def test_reads_after_a_write(self):
+        self.client_args.add('write')
+        self.assertEqual(self.title(), 'primary')
+        # the same client keeps reading from the primary for a while
+        self.client_args.clear()
+        self.assertEqual(self.title(), 'primary')
+
+        self.app.config['SQLALCHEMY_REPLICA_MAX_LAG'] = 0
+        self.assertEqual(self.title(), 'replica')
+
+    def test_primary_views(self):
+        response = self.client.get('/_primary/1')
+        self.assertEqual(response.get_json()['titles'], ['primary'])
+
+    def test_textual_statements_are_not_writes(self):
+        response = self.client.get('/_text/1')
+        self.assertEqual(response.get_json()['titles'], ['replica', 'primary'])
+        db.session.remove()
+        # and the next request still reads from the replica
+        self.assertEqual(self.title(), 'replica')
+
+    def test_lagging_replica(self):
+        self.app.config['SQLALCHEMY_REPLICA_CHECK_INTERVAL'] = 0
+        db.lag_probes['sqlite'] = lambda connection: 60
+        try:
+            self.assertEqual(self.title(), 'primary')
+            db.lag_probes['sqlite'] = lambda connection: 1
+            self.assertEqual(self.title(), 'replica')
+        finally:
+            del db.lag_probes['sqlite']
+
+    def test_search_reads_from_replica(self):
+        with self.replica.connect() as connection:
+            SQLiteSearch().index(connection, 1, 'replica', '', '')
+        with self.app.test_request_context('/search/?keyWord=replica'):
+            pagination = search_posts('replica', 1)
+            self.assertEqual(pagination.total, 1)
+            self.assertEqual(pagination.items[0].title, 'replica')
+            db.session.remove()
+            self.assertEqual(search_posts('primary', 1).total, 0)
+        # outside a request the primary's index is searched
+        self.assertEqual(search_posts('primary', 1).total, 1)
+
+    def test_create_all_leaves_replicas_alone(self):
+        self.assertEqual(db.get_tables_for_bind('replica_0'), [])
@@ -200,4 +200,58 @@ class UserModelTestCase(unittest.TestCase):
         expected_keys = ['url', 'username', 'join_time', 'last_seen',
                          'posts_url', 'post_count']
         self.assertEqual(sorted(json_user.keys()), sorted(expected_keys))
-        self.assertEqual('/api/v1/users/' + str(u.id), json_user['url'])
\ No newline at end of file
+        self.assertEqual('/api/v1/users/' + str(u.id), json_user['url'])
+
+    def test_ping_is_buffered(self):
+        from app import last_seen_tracker
+        self.app.config['LAST_SEEN_FLUSH_INTERVAL'] = 60
+        u = User(password='cat')
+        db.session.add(u)
+        db.session.commit()
+        last_seen_before = u.last_seen
+        time.sleep(1)
+        u.ping()
+        self.assertFalse(db.session.dirty)
+        db.session.expire(u)
+        self.assertEqual(u.last_seen, last_seen_before)
+        self.assertEqual(last_seen_tracker.flush(), 1)
+        db.session.expire(u)
+        self.assertTrue(u.last_seen > last_seen_before)
+
+    def test_ping_is_flushed_in_the_background(self):
+        u = User(password='cat')
+        db.session.add(u)
+        db.session.commit()
+        last_seen_before = u.last_seen
+        self.app.config['LAST_SEEN_FLUSH_INTERVAL'] = 0.5
+        try:
+            u.ping()
+            # without another request coming in
+            for i in range(50):
+                db.session.commit()
+                db.session.expire(u)
+                if u.last_seen > last_seen_before:
+                    break
+                time.sleep(0.1)
+            self.assertTrue(u.last_seen > last_seen_before)
+        finally:
+            self.app.config['LAST_SEEN_FLUSH_INTERVAL'] = 3600
+
+    def test_password_rehash(self):
+        u = User(password='cat')
+        db.session.add(u)
+        db.session.commit()
+        self.assertTrue(u.password_hash.startswith('pbkdf2:sha256:50000$'))
+        self.app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:60000'
+        self.assertTrue(u.verify_password('cat'))
+        self.assertTrue(u.password_hash.startswith('pbkdf2:sha256:50000$'))
+        self.app.config['PASSWORD_REHASH'] = True
+        self.assertFalse(u.verify_password('dog'))
+        self.assertTrue(u.password_hash.startswith('pbkdf2:sha256:50000$'))
+        self.assertTrue(u.verify_password('cat'))
+        # the new hash is left for the caller to commit
+        self.assertIn(u, db.session.dirty)
+        db.session.commit()
+        db.session.expire(u)
+        self.assertTrue(u.password_hash.startswith('pbkdf2:sha256:60000$'))
+        self.assertTrue(u.verify_password('cat'))